@@ -0,0 +1,200 @@
+import asyncio
+import json
+import random
+from aiohttp import web
+
+
+class FakeBitcoind:
+    """
+    Minimal bitcoind stand-in. Blocks listed in `pruned` are reported as pruned
+    until a getblockfrompeer for them completes after `downloadDelay` seconds.
+
+    For benchmarks, every height up to `height` can be served as a block of
+    `blockSize` bytes, each call can be delayed by `rpcDelay` seconds, and
+    getblockfrompeer fails with a probability of `peerFailureRate`.
+    """
+
+    def __init__(self) -> None:
+        # Calls are only recorded for tests
+        self.recordCalls: bool = True
+        self.calls: list[tuple[str, list]] = []
+        self.clientPorts: list[int] = []
+        self.batches: list[int] = []
+        self.blocks: dict[str, str] = {}
+        self.pruned: set[str] = set()
+        self.peers: list[dict] = [{"id": 1, "addr": "127.0.0.2:8333"}]
+        # Peers still listed by getpeerinfo, but already disconnected
+        self.disconnectedPeers: set[int] = set()
+        self.downloadDelay: float = 0.0
+        # Download delays of single peers, by peer id
+        self.peerDelays: dict[int, float] = {}
+        # Block hashes are the zero-padded hex of their height
+        self.height: int = 100
+        self.pruneHeight: int = 0
+        # Hashes of blocks that replaced others in a reorg, and their heights
+        self.forkHashes: dict[int, str] = {}
+        self.forkHeights: dict[str, int] = {}
+        self.reorgs: int = 0
+        self.newBlock: asyncio.Event | None = None
+        self.blockSize: int = 0
+        self.blockHex: str = ""
+        self.rpcDelay: float = 0.0
+        self.peerFailureRate: float = 0.0
+        self.random = random.Random(0)
+
+    def calls_of(self, method: str) -> list[list]:
+        return [params for (m, params) in self.calls if m == method]
+
+    def hash_of(self, height: int) -> str:
+        return self.forkHashes.get(height, f"{height:064x}")
+
+    def height_of(self, blockhash: str) -> int:
+        return self.forkHeights.get(blockhash, int(blockhash, 16))
+
+    def mine(self, blocks: int = 1, reorgDepth: int = 0) -> None:
+        # Extends the chain by `blocks`, after replacing the last `reorgDepth`
+        # blocks with other ones
+        if reorgDepth:
+            self.reorgs += 1
+        for height in range(self.height - reorgDepth + 1, self.height + 1):
+            blockhash = f"{self.reorgs:08x}{height:056x}"
+            self.forkHashes[height] = blockhash
+            self.forkHeights[blockhash] = height
+        self.height += blocks
+        if self.newBlock is not None:
+            self.newBlock.set()
+            self.newBlock = None
+
+    async def wait_for_new_block(self, params: list) -> None:
+        if self.newBlock is None:
+            self.newBlock = asyncio.Event()
+        timeout = params[0] / 1000 if params and params[0] else None
+        try:
+            await asyncio.wait_for(self.newBlock.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def get_block(self, blockhash: str) -> str | None:
+        if blockhash in self.blocks:
+            return self.blocks[blockhash]
+        if not self.blockSize:
+            return None
+        try:
+            height = int(blockhash, 16)
+        except ValueError:
+            return None
+        if height > self.height:
+            return None
+        if len(self.blockHex) != self.blockSize * 2:
+            # every generated block has the same content
+            self.blockHex = self.random.randbytes(self.blockSize).hex()
+        return self.blockHex
+
+    def result(self, method: str, params: list):
+        if method == "getblock":
+            blockhash = params[0]
+            if blockhash in self.pruned:
+                return None, {
+                    "code": -1,
+                    "message": "Block not available (pruned data)",
+                }
+            block = self.get_block(blockhash)
+            if block is None:
+                return None, {"code": -5, "message": "Block not found"}
+            return block, None
+        if method == "getblockcount":
+            return self.height, None
+        if method == "getbestblockhash":
+            return self.hash_of(self.height), None
+        if method == "waitfornewblock":
+            return {"hash": self.hash_of(self.height), "height": self.height}, None
+        if method == "getblockhash":
+            if params[0] > self.height:
+                return None, {"code": -8, "message": "Block height out of range"}
+            return self.hash_of(params[0]), None
+        if method == "getblockheader":
+            height = self.height_of(params[0])
+            return {
+                "hash": params[0],
+                "height": height,
+                "previousblockhash": self.hash_of(height - 1),
+            }, None
+        if method == "getblockchaininfo":
+            return {
+                "blocks": self.height,
+                "pruned": self.pruneHeight > 0,
+                "pruneheight": self.pruneHeight,
+            }, None
+        if method == "gettxout":
+            # odd outputs are spent
+            if params[1] % 2:
+                return None, None
+            return {
+                "bestblock": self.hash_of(self.height),
+                "confirmations": 6,
+                "value": 0.01,
+                "scriptPubKey": {"hex": "0014" + params[0][:40]},
+            }, None
+        if method == "getpeerinfo":
+            return self.peers, None
+        if method == "getblockfrompeer":
+            blockhash, peerId = params
+            peerIds = [peer["id"] for peer in self.peers]
+            if peerId not in peerIds or peerId in self.disconnectedPeers:
+                return None, {"code": -1, "message": "Peer does not exist"}
+            if self.random.random() < self.peerFailureRate:
+                return None, {"code": -1, "message": "Failed to fetch block"}
+            asyncio.get_running_loop().call_later(
+                self.peerDelays.get(peerId, self.downloadDelay),
+                self.pruned.discard,
+                blockhash,
+            )
+            return {}, None
+        return method, None
+
+    def call(self, payload: dict) -> dict:
+        method = payload["method"]
+        params = payload.get("params", [])
+        if self.recordCalls:
+            self.calls.append((method, params))
+        result, error = self.result(method, params)
+        if payload.get("jsonrpc") == "2.0":
+            # Like bitcoind 28+: either "result" or "error", after "jsonrpc"
+            response = {"jsonrpc": "2.0"}
+            if error is None:
+                response["result"] = result
+            else:
+                response["error"] = error
+            response["id"] = payload.get("id")
+            return response
+        return {"result": result, "error": error, "id": payload.get("id")}
+
+    async def rpc(self, request) -> web.Response:
+        if self.recordCalls:
+            self.clientPorts.append(request.transport.get_extra_info("peername")[1])
+        payload = await request.json()
+        if isinstance(payload, dict) and payload.get("method") == "waitfornewblock":
+            await self.wait_for_new_block(payload.get("params", []))
+        if self.rpcDelay:
+            await asyncio.sleep(self.rpcDelay)
+        if isinstance(payload, list):
+            if self.recordCalls:
+                self.batches.append(len(payload))
+            response = [self.call(entry) for entry in payload]
+            status = 200
+        else:
+            response = self.call(payload)
+            status = 200 if response.get("error") is None else 500
+            if payload.get("jsonrpc") == "2.0":
+                status = 200
+        # Like bitcoind: compact JSON, "result" first, HTTP 500 on 1.0 errors
+        return web.Response(
+            body=json.dumps(response, separators=(",", ":")).encode(),
+            status=status,
+            content_type="application/json",
+        )
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/", self.rpc)
+        return app
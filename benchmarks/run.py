@@ -0,0 +1,201 @@
+"""
+Benchmark for BTCProxy against an in-process fake bitcoind.
+
+    python -m benchmarks.run [--scenario gettxout rescan batch] [--save results.json]
+                             [--compare baseline.json]
+
+Every scenario runs in a fresh process, so the reported peak RSS belongs to
+that scenario alone (proxy, fake bitcoind and load generator together).
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import resource
+import statistics
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from aiohttp import ClientSession, web
+from benchmarks.fakebitcoind import FakeBitcoind
+from benchmarks.scenarios import SCENARIOS, Scenario
+from bitcoinproxy.proxy import BTCProxy
+
+HOST = "127.0.0.1"
+
+
+async def start_site(app: web.Application) -> tuple[web.AppRunner, int]:
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, HOST, 0)
+    await site.start()
+    return runner, runner.addresses[0][1]
+
+
+async def generate_load(
+    session: ClientSession, url: str, requests, concurrency: int
+) -> tuple[list[float], int]:
+    # `concurrency` clients send the requests one after another, each waiting
+    # for its previous response
+    latencies: list[float] = []
+    errors: int = 0
+
+    async def client() -> None:
+        nonlocal errors
+        for payload in requests:
+            startTime: float = time.perf_counter()
+            async with session.post(url, json=payload) as response:
+                await response.read()
+                if response.status != 200:
+                    errors += 1
+            latencies.append(time.perf_counter() - startTime)
+
+    await asyncio.gather(*[client() for _ in range(concurrency)])
+    return latencies, errors
+
+
+async def run_scenario(scenario: Scenario, options) -> dict:
+    bitcoind = FakeBitcoind()
+    bitcoind.recordCalls = False
+    bitcoindRunner, bitcoindPort = await start_site(bitcoind.create_app())
+    proxy = BTCProxy()
+    proxy.conf = {
+        "net": {
+            "dest_ip": HOST,
+            "dest_port": str(bitcoindPort),
+            "dest_user": "user",
+            "dest_pass": "pass",
+        },
+        "app": {"log_level": options.log_level},
+    }
+    scenario.setup(bitcoind, proxy.conf, options)
+    proxyRunner, proxyPort = await start_site(proxy.create_app())
+    count: int = scenario.request_count(options)
+    try:
+        async with ClientSession() as session:
+            startTime: float = time.perf_counter()
+            latencies, errors = await generate_load(
+                session,
+                f"http://{HOST}:{proxyPort}/",
+                scenario.requests(count),
+                options.concurrency,
+            )
+            elapsed: float = time.perf_counter() - startTime
+    finally:
+        await proxyRunner.cleanup()
+        await bitcoindRunner.cleanup()
+    return report(scenario.name, latencies, errors, elapsed)
+
+
+def report(name: str, latencies: list[float], errors: int, elapsed: float) -> dict:
+    percentiles = (
+        statistics.quantiles(latencies, n=100, method="inclusive")
+        if len(latencies) > 1
+        else latencies * 99
+    )
+    return {
+        "scenario": name,
+        "requests": len(latencies),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "throughput": round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentiles[49] * 1000, 2) if percentiles else 0.0,
+        "p99_ms": round(percentiles[98] * 1000, 2) if percentiles else 0.0,
+        # kilobytes on Linux
+        "peak_rss_mb": round(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1
+        ),
+    }
+
+
+def run_isolated(name: str, options) -> dict:
+    return asyncio.run(run_scenario(SCENARIOS[name], options))
+
+
+def compare(results: list[dict], baseline: list[dict], tolerance: float) -> list[str]:
+    # Returns a description of every scenario that got slower than the baseline
+    previous: dict[str, dict] = {result["scenario"]: result for result in baseline}
+    regressions: list[str] = []
+    for result in results:
+        before: dict | None = previous.get(result["scenario"])
+        if before is None:
+            continue
+        if result["throughput"] < before["throughput"] * (1 - tolerance):
+            regressions.append(
+                f"{result['scenario']}: throughput {result['throughput']}/s "
+                f"(baseline {before['throughput']}/s)"
+            )
+        if result["p99_ms"] > before["p99_ms"] * (1 + tolerance):
+            regressions.append(
+                f"{result['scenario']}: p99 {result['p99_ms']}ms "
+                f"(baseline {before['p99_ms']}ms)"
+            )
+    return regressions
+
+
+def print_results(results: list[dict]) -> None:
+    columns = (
+        "scenario",
+        "requests",
+        "errors",
+        "seconds",
+        "throughput",
+        "p50_ms",
+        "p99_ms",
+        "peak_rss_mb",
+    )
+    print("".join(f"{column:>13}" for column in columns))
+    for result in results:
+        print("".join(f"{result[column]:>13}" for column in columns))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark BTCProxy")
+    parser.add_argument(
+        "--scenario", nargs="+", choices=list(SCENARIOS), default=list(SCENARIOS)
+    )
+    parser.add_argument(
+        "--requests", type=int, help="requests per scenario (default per scenario)"
+    )
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument(
+        "--rpc-delay", type=float, default=0.0, help="bitcoind time per call (s)"
+    )
+    parser.add_argument("--block-size", type=int, default=1_500_000)
+    parser.add_argument("--download-delay", type=float, default=0.05)
+    parser.add_argument("--peer-failure-rate", type=float, default=0.05)
+    parser.add_argument(
+        "--prune-every", type=int, default=10, help="0 = no pruned blocks"
+    )
+    parser.add_argument("--log-level", default="error")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file with baseline results")
+    parser.add_argument(
+        "--tolerance", type=float, default=0.1, help="allowed regression (0.1 = 10%%)"
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> int:
+    options = parse_args(argv)
+    results: list[dict] = []
+    context = multiprocessing.get_context("spawn")
+    for name in options.scenario:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results.append(executor.submit(run_isolated, name, options).result())
+    print_results(results)
+    if options.save:
+        with open(options.save, "w") as resultsFile:
+            json.dump(results, resultsFile, indent=2)
+    if options.compare:
+        with open(options.compare) as baselineFile:
+            regressions = compare(results, json.load(baselineFile), options.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,124 @@
+from benchmarks.fakebitcoind import FakeBitcoind
+
+
+def blockhash(height: int) -> str:
+    return f"{height:064x}"
+
+
+def txid(number: int) -> str:
+    return f"{number * 2654435761 % 2**256:064x}"
+
+
+class Scenario:
+    """
+    A workload replaying one kind of CLN-like traffic. setup() prepares the
+    fake bitcoind and the proxy configuration, requests() yields the
+    JSON-RPC payloads (single calls or batches) sent to the proxy.
+    """
+
+    name: str = ""
+    description: str = ""
+    defaultRequests: int = 1000
+
+    def setup(self, bitcoind: FakeBitcoind, conf: dict, options) -> None:
+        bitcoind.rpcDelay = options.rpc_delay
+
+    def request_count(self, options) -> int:
+        return options.requests or self.defaultRequests
+
+    def requests(self, count: int):
+        raise NotImplementedError
+
+
+class GettxoutStorm(Scenario):
+    name = "gettxout"
+    description = "gettxout calls for distinct outpoints, like CLN checking channel funding outputs"
+    defaultRequests = 5000
+
+    def requests(self, count: int):
+        for number in range(count):
+            yield {
+                "jsonrpc": "1.0",
+                "id": number,
+                "method": "gettxout",
+                "params": [txid(number), number % 4, True],
+            }
+
+
+class Rescan(Scenario):
+    name = "rescan"
+    description = "sequential getblock calls, every prune_every-th block pruned and recovered from a peer"
+    defaultRequests = 200
+
+    def setup(self, bitcoind: FakeBitcoind, conf: dict, options) -> None:
+        super().setup(bitcoind, conf, options)
+        self.startHeight: int = 1000
+        bitcoind.height = self.startHeight + self.request_count(options) + 10
+        bitcoind.blockSize = options.block_size
+        bitcoind.downloadDelay = options.download_delay
+        bitcoind.peerFailureRate = options.peer_failure_rate
+        bitcoind.peers = [
+            {
+                "id": peerId,
+                "addr": f"10.0.0.{peerId}:8333",
+                "servicesnames": ["NETWORK", "WITNESS"],
+                "connection_type": "outbound-full-relay",
+                "minping": 0.01 * peerId,
+            }
+            for peerId in range(1, 9)
+        ]
+        if options.prune_every:
+            for height in range(self.startHeight, bitcoind.height, options.prune_every):
+                bitcoind.pruned.add(blockhash(height))
+        conf["app"].update(
+            {
+                "wait_for_download": "10",
+                "wait_mode": "poll",
+                "poll_interval": "0.01",
+                "peer_stall_timeout": "1",
+            }
+        )
+
+    def requests(self, count: int):
+        for number in range(count):
+            yield {
+                "jsonrpc": "1.0",
+                "id": number,
+                "method": "getblock",
+                "params": [blockhash(self.startHeight + number), 0],
+            }
+
+
+class MixedBatch(Scenario):
+    name = "batch"
+    description = (
+        "batches mixing chain queries, gettxout, fee estimation and small blocks"
+    )
+    defaultRequests = 1000
+
+    def setup(self, bitcoind: FakeBitcoind, conf: dict, options) -> None:
+        super().setup(bitcoind, conf, options)
+        bitcoind.height = 100000
+        bitcoind.blockSize = 4096
+
+    def requests(self, count: int):
+        for number in range(count):
+            height = 90000 + number
+            batch = [
+                {"method": "getblockcount", "params": []},
+                {"method": "getblockhash", "params": [height]},
+                {"method": "getblock", "params": [blockhash(height), 0]},
+                {"method": "estimatesmartfee", "params": [6]},
+            ]
+            batch += [
+                {"method": "gettxout", "params": [txid(number * 8 + vout), vout]}
+                for vout in range(6)
+            ]
+            for index, call in enumerate(batch):
+                call["id"] = f"{number}-{index}"
+            yield batch
+
+
+SCENARIOS: dict[str, Scenario] = {
+    scenario.name: scenario for scenario in (GettxoutStorm(), Rescan(), MixedBatch())
+}
@@ -0,0 +1,130 @@
+import asyncio
+from collections import deque
+
+# JSON-RPC "server error" returned for rejected calls
+OVERLOADED_ERROR_CODE = -32000
+
+FAST = "fast"
+DEFAULT = "default"
+RECOVERY = "recovery"
+
+# Cheap calls Lightning nodes need answered quickly
+FAST_METHODS = (
+    "getblockcount",
+    "getbestblockhash",
+    "getblockchaininfo",
+    "getnetworkinfo",
+    "getmempoolinfo",
+    "estimatesmartfee",
+    "sendrawtransaction",
+)
+
+
+class LaneFull(Exception):
+    def __init__(self, lane: str) -> None:
+        super().__init__(f"Too many {lane} calls waiting")
+        self.lane: str = lane
+
+
+class Lane:
+    """
+    Bounds the number of calls of one class handled at the same time. Calls
+    beyond `limit` wait in FIFO order; once `maxQueue` calls are waiting,
+    further calls are rejected with LaneFull right away. A limit of 0 admits
+    every call, a maxQueue of 0 lets any number of calls wait.
+    """
+
+    def __init__(self, name: str, limit: int = 0, maxQueue: int = 0) -> None:
+        self.name: str = name
+        self.limit: int = limit
+        self.maxQueue: int = maxQueue
+        self.active: int = 0
+        self.waiters: deque[asyncio.Future] = deque()
+        self.admitted: int = 0
+        self.rejected: int = 0
+
+    async def __aenter__(self) -> "Lane":
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.release()
+
+    async def acquire(self) -> None:
+        if self.limit <= 0 or (self.active < self.limit and not self.waiters):
+            self.active += 1
+            self.admitted += 1
+            return
+        if self.maxQueue and len(self.waiters) >= self.maxQueue:
+            self.rejected += 1
+            raise LaneFull(self.name)
+        waiter: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was already handed over, pass it on
+                self.release()
+            else:
+                self.waiters.remove(waiter)
+            raise
+        self.admitted += 1
+
+    def release(self) -> None:
+        # The slot goes to the next waiting call, if there is one
+        while self.waiters:
+            waiter: asyncio.Future = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class Slot:
+    """
+    A call's place in its lane, held from admission until the call is done.
+    A call that waits for something admitted elsewhere, like a getblock
+    waiting for a pruned block recovery, gives its slot up early.
+    """
+
+    def __init__(self, lane: Lane) -> None:
+        self.lane: Lane = lane
+        self.held: bool = False
+
+    async def __aenter__(self) -> "Slot":
+        await self.lane.acquire()
+        self.held = True
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        self.release()
+
+    def release(self) -> None:
+        if self.held:
+            self.held = False
+            self.lane.release()
+
+
+class AdmissionControl:
+    """Assigns every RPC method to a lane; methods without a lane use the default lane."""
+
+    def __init__(self, lanes: list[Lane], methodLanes: dict[str, str]) -> None:
+        self.lanes: dict[str, Lane] = {lane.name: lane for lane in lanes}
+        self.methodLanes: dict[str, str] = methodLanes
+
+    def lane_for(self, method: str) -> Lane:
+        return self.lanes[self.methodLanes.get(method, DEFAULT)]
+
+    def admit(self, method: str) -> Slot:
+        return Slot(self.lane_for(method))
+
+    def calls(self) -> dict[tuple, int]:
+        calls: dict[tuple, int] = {}
+        for name, lane in self.lanes.items():
+            calls[(name, "active")] = lane.active
+            calls[(name, "queued")] = len(lane.waiters)
+        return calls
+
+    def rejected(self) -> dict[tuple, int]:
+        return {(name,): lane.rejected for name, lane in self.lanes.items()}
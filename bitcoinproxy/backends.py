@@ -0,0 +1,142 @@
+import asyncio
+import time
+from bitcoinproxy.codec import loads
+from bitcoinproxy.upstream import Upstream
+
+ARCHIVAL = "archival"
+PRUNED = "pruned"
+ROLES = (ARCHIVAL, PRUNED)
+
+
+class Backend:
+    """
+    One bitcoind node behind the proxy, with the chain state reported by its
+    last health check. Until the first check a backend is assumed healthy.
+    """
+
+    def __init__(
+        self, name: str, upstream: Upstream, weight: float = 1.0, role: str = PRUNED
+    ) -> None:
+        self.name: str = name
+        self.upstream: Upstream = upstream
+        self.weight: float = weight
+        self.role: str = role
+        self.healthy: bool = True
+        self.height: int | None = None
+        self.pruneHeight: int = 0
+        self.latency: float | None = None
+        self.checkedAt: float | None = None
+        self.failures: int = 0
+
+    def load(self) -> float:
+        # Requests in progress relative to the backend's weight
+        return (self.upstream.active + 1) / self.weight
+
+    def has_block(self, height: int) -> bool:
+        return self.role == ARCHIVAL or height >= self.pruneHeight
+
+    def update(self, info: dict, latency: float) -> None:
+        self.height = info.get("blocks")
+        self.pruneHeight = info.get("pruneheight", 0) if info.get("pruned") else 0
+        self.healthy = not info.get("initialblockdownload", False)
+        self.latency = (
+            latency if self.latency is None else 0.7 * self.latency + 0.3 * latency
+        )
+        self.checkedAt = time.monotonic()
+
+    def mark_failed(self) -> None:
+        self.healthy = False
+        self.failures += 1
+        self.checkedAt = time.monotonic()
+
+
+class BackendPool:
+    """
+    The bitcoind nodes the proxy forwards to. Client calls go to the least
+    loaded healthy backend, while calls that depend on one node's state (peer
+    ids, getblockfrompeer and the retried getblock) go to the primary backend,
+    the first healthy one in configuration order.
+
+    A background task checks every backend with getblockchaininfo every
+    `checkInterval` seconds. Backends that are unreachable, in initial block
+    download or more than `maxLag` blocks behind the best backend are
+    unhealthy until a later check succeeds.
+    """
+
+    def __init__(
+        self,
+        backends: list[Backend],
+        checkInterval: float = 10.0,
+        checkTimeout: float = 5.0,
+        maxLag: int = 2,
+    ) -> None:
+        self.backends: list[Backend] = backends
+        self.checkInterval: float = checkInterval
+        self.checkTimeout: float = checkTimeout
+        self.maxLag: int = maxLag
+
+    def healthy(self) -> list[Backend]:
+        # Falls back to all backends, a request is better than no answer
+        return [backend for backend in self.backends if backend.healthy] or list(
+            self.backends
+        )
+
+    def primary(self) -> Backend:
+        return self.healthy()[0]
+
+    def select(self, exclude=()) -> Backend | None:
+        candidates = [backend for backend in self.healthy() if backend not in exclude]
+        if not candidates:
+            return None
+        return min(
+            candidates, key=lambda backend: (backend.load(), backend.latency or 0.0)
+        )
+
+    def with_block(self, height: int, exclude=()) -> list[Backend]:
+        # Healthy backends that still have the block at `height`, least loaded first
+        candidates = [
+            backend
+            for backend in self.backends
+            if backend not in exclude and backend.healthy and backend.has_block(height)
+        ]
+        return sorted(candidates, key=lambda backend: backend.load())
+
+    async def check(self, backend: Backend) -> None:
+        startTime: float = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                backend.upstream.post({"method": "getblockchaininfo", "params": []}),
+                self.checkTimeout,
+            )
+            info = loads(await response.read()).get("result")
+        except Exception:
+            info = None
+        if isinstance(info, dict):
+            backend.update(info, time.perf_counter() - startTime)
+        else:
+            backend.mark_failed()
+
+    async def check_all(self) -> None:
+        await asyncio.gather(*(self.check(backend) for backend in self.backends))
+        heights = [
+            backend.height
+            for backend in self.backends
+            if backend.healthy and backend.height is not None
+        ]
+        if heights:
+            bestHeight: int = max(heights)
+            for backend in self.backends:
+                if (
+                    backend.height is not None
+                    and backend.height < bestHeight - self.maxLag
+                ):
+                    backend.healthy = False
+
+    async def run(self) -> None:
+        while True:
+            await self.check_all()
+            await asyncio.sleep(self.checkInterval)
+
+    async def close(self) -> None:
+        for backend in self.backends:
+            await backend.upstream.close()
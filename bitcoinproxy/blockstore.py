@@ -0,0 +1,154 @@
+import fcntl
+import mmap
+import os
+import re
+import threading
+from collections import OrderedDict
+
+BLOCKHASH_PATTERN = re.compile("^[0-9a-f]{64}$")
+
+
+class BlockStore:
+    """
+    Local store for raw blocks, one binary file per block hash, which survives
+    bitcoind pruning them. Eviction is least recently used, pinned blocks are
+    never evicted. The order of use is kept in the files' modification times,
+    so it survives restarts.
+
+    All methods do blocking file I/O and are meant to be run in a thread. The
+    index and its counters are guarded by a lock, so several threads may use
+    the store at once; files are read and written outside of it.
+
+    A `shared` store is used by several worker processes at once. Blocks
+    stored by others are found on disk, and blocks are only stored while
+    holding a lock file, after the index has been read from the directory
+    again, so all processes keep within one size budget.
+    """
+
+    def __init__(
+        self, directory: str, maxBytes: int, pinned=(), shared: bool = False
+    ) -> None:
+        self.directory: str = directory
+        self.shared: bool = shared
+        self.maxBytes: int = maxBytes
+        self.pinned: set[str] = set(pinned)
+        self.index: OrderedDict[str, int] = OrderedDict()
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.lock = threading.Lock()
+
+    def load(self) -> None:
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.directory):
+            blockhash, extension = os.path.splitext(entry.name)
+            if extension == ".blk" and BLOCKHASH_PATTERN.match(blockhash):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, blockhash, stat.st_size))
+        with self.lock:
+            self.index.clear()
+            self.size = 0
+            for _, blockhash, size in sorted(entries):
+                self.index[blockhash] = size
+                self.size += size
+            self.evict()
+
+    def path(self, blockhash: str) -> str:
+        return os.path.join(self.directory, blockhash + ".blk")
+
+    def __contains__(self, blockhash: str) -> bool:
+        return blockhash in self.index
+
+    def get_hex(self, blockhash: str) -> str | None:
+        # The block file is memory-mapped and hex-encoded straight from the
+        # mapping, without reading it into an intermediate bytes object.
+        with self.lock:
+            if blockhash not in self.index and not self.shared:
+                self.misses += 1
+                return None
+        path = self.path(blockhash)
+        try:
+            with open(path, "rb") as blockFile:
+                with mmap.mmap(
+                    blockFile.fileno(), 0, access=mmap.ACCESS_READ
+                ) as mapped:
+                    with memoryview(mapped) as view:
+                        blockHex = view.hex()
+            os.utime(path)
+        except (OSError, ValueError):
+            # e.g. evicted by another thread in the meantime
+            with self.lock:
+                self.forget(blockhash)
+                self.misses += 1
+            return None
+        with self.lock:
+            if blockhash in self.index:
+                self.index.move_to_end(blockhash)
+            self.hits += 1
+        return blockHex
+
+    def put(self, blockhash: str, blockHex: str) -> None:
+        if not BLOCKHASH_PATTERN.match(blockhash) or blockhash in self.index:
+            return
+        data = bytes.fromhex(blockHex)
+        if len(data) > self.maxBytes:
+            return
+        if not self.shared:
+            self.write(blockhash, data)
+            return
+        fd = os.open(
+            os.path.join(self.directory, ".lock"), os.O_RDWR | os.O_CREAT, 0o600
+        )
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            self.load()
+            if blockhash not in self.index:
+                self.write(blockhash, data)
+        finally:
+            os.close(fd)
+
+    def write(self, blockhash: str, data: bytes) -> None:
+        path = self.path(blockhash)
+        # Concurrent writers of the same block each use a file of their own
+        tmpPath = f"{path}.{os.getpid()}-{threading.get_ident()}.tmp"
+        with open(tmpPath, "wb") as blockFile:
+            blockFile.write(data)
+        os.replace(tmpPath, path)
+        with self.lock:
+            if blockhash not in self.index:
+                self.index[blockhash] = len(data)
+                self.size += len(data)
+            self.evict()
+
+    def pin(self, blockhash: str) -> None:
+        self.pinned.add(blockhash)
+
+    def evict(self) -> None:
+        # Called with the lock held
+        for blockhash in list(self.index):
+            if self.size <= self.maxBytes:
+                break
+            if blockhash in self.pinned:
+                continue
+            self.forget(blockhash)
+            self.evictions += 1
+            try:
+                os.remove(self.path(blockhash))
+            except OSError:
+                pass
+
+    def forget(self, blockhash: str) -> None:
+        size = self.index.pop(blockhash, None)
+        if size is not None:
+            self.size -= size
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "blocks": len(self.index),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,62 @@
+import json
+from collections import OrderedDict
+
+
+def cache_key(method: str, params) -> str:
+    return method + json.dumps(params, separators=(",", ":"))
+
+
+class ResponseCache:
+    """
+    In-memory LRU cache for response bodies of immutable RPC calls, bounded by
+    the total number of bytes stored.
+    """
+
+    def __init__(self, maxBytes: int) -> None:
+        self.maxBytes: int = maxBytes
+        self.entries: OrderedDict[str, bytes] = OrderedDict()
+        self.size: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+
+    def get(self, key: str) -> bytes | None:
+        body = self.entries.get(key)
+        if body is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return body
+
+    def put(self, key: str, body: bytes) -> None:
+        if len(body) > self.maxBytes:
+            return
+        self.remove(key)
+        self.entries[key] = body
+        self.size += len(body)
+        while self.size > self.maxBytes:
+            _, evicted = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def remove(self, key: str) -> None:
+        body = self.entries.pop(key, None)
+        if body is not None:
+            self.size -= len(body)
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def __len__(self) -> int:
+        return len(self.entries)
@@ -0,0 +1,171 @@
+import asyncio
+import time
+from bitcoinproxy.cache import cache_key
+from bitcoinproxy.codec import dumps, loads
+from bitcoinproxy.log import LOG
+
+LONGPOLL = "longpoll"
+POLL = "poll"
+OFF = "off"
+MODES = (LONGPOLL, POLL, OFF)
+# Calls answered from the chain tip; the first one of these starts the watcher
+TIP_METHODS = ("getblockcount", "getbestblockhash", "getblockchaininfo")
+
+
+class ChainTip:
+    """
+    Follows bitcoind's chain tip, either by long-polling waitfornewblock or by
+    polling getbestblockhash, and keeps the hashes of the last `window` blocks.
+    Tip-related calls are answered from it as long as the watcher is in sync.
+
+    A new tip is connected to the window by walking back its headers. Heights
+    whose hash changed (a reorg) are dropped from the window and from the
+    response cache.
+    """
+
+    def __init__(
+        self,
+        proxy,
+        mode: str = LONGPOLL,
+        pollInterval: float = 2.0,
+        longpollTimeout: float = 30.0,
+        window: int = 144,
+    ) -> None:
+        self.proxy = proxy
+        self.mode: str = mode
+        self.pollInterval: float = pollInterval
+        self.longpollTimeout: float = longpollTimeout
+        self.window: int = window
+        self.hashes: dict[int, str] = {}
+        self.height: int | None = None
+        self.bestHash: str | None = None
+        self.chainInfo: bytes | None = None
+        # monotonic time bitcoind last confirmed the tip
+        self.confirmedAt: float | None = None
+        self.answered: int = 0
+        self.reorgs: int = 0
+
+    def is_fresh(self) -> bool:
+        if self.confirmedAt is None:
+            return False
+        interval = self.longpollTimeout if self.mode == LONGPOLL else self.pollInterval
+        return time.monotonic() - self.confirmedAt < interval + 5
+
+    def answer(self, method: str, params) -> bytes | None:
+        # Returns a response body for a tip-related call, or None if it has to
+        # be forwarded to bitcoind
+        if not self.is_fresh():
+            return None
+        if method == "getblockcount":
+            result = self.height
+        elif method == "getbestblockhash":
+            result = self.bestHash
+        elif method == "getblockchaininfo":
+            if self.chainInfo is None:
+                return None
+            self.answered += 1
+            return self.chainInfo
+        elif method == "getblockhash":
+            if (
+                not isinstance(params, list)
+                or len(params) != 1
+                or not isinstance(params[0], int)
+            ):
+                return None
+            result = self.hashes.get(params[0])
+        else:
+            return None
+        if result is None:
+            return None
+        self.answered += 1
+        return dumps({"result": result, "error": None, "id": None})
+
+    async def rpc_result(self, method: str, params: list):
+        response = await self.proxy.forward_request(method, params)
+        body = loads(await response.read())
+        if body.get("error") is not None:
+            raise ValueError(body["error"].get("message"))
+        return body.get("result")
+
+    async def run(self) -> None:
+        while True:
+            try:
+                if self.mode == LONGPOLL and self.bestHash is not None:
+                    tipHash: str = await self.wait_for_new_block()
+                else:
+                    tipHash = await self.rpc_result("getbestblockhash", [])
+                await self.update(tipHash)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.confirmedAt = None
+                LOG.error("Could not update the chain tip: %s", e)
+                await asyncio.sleep(self.pollInterval)
+                continue
+            if self.mode == POLL:
+                await asyncio.sleep(self.pollInterval)
+
+    async def wait_for_new_block(self) -> str:
+        # Returns the tip hash once a new block arrived, or the current one after
+        # longpollTimeout seconds. Falls back to polling if bitcoind rejects it.
+        try:
+            tip = await self.rpc_result(
+                "waitfornewblock", [int(self.longpollTimeout * 1000)]
+            )
+            return tip["hash"]
+        except (ValueError, KeyError, TypeError) as e:
+            LOG.warn("waitfornewblock failed (%s), polling the chain tip instead", e)
+            self.mode = POLL
+            return await self.rpc_result("getbestblockhash", [])
+
+    async def update(self, tipHash: str) -> None:
+        if tipHash != self.bestHash:
+            header = await self.rpc_result("getblockheader", [tipHash, True])
+            newHashes: dict[int, str] = {header["height"]: tipHash}
+            tipHeight: int = header["height"]
+            height: int = tipHeight
+            previous: str | None = header.get("previousblockhash")
+            # Walk back over skipped blocks and blocks replaced by a reorg
+            while (
+                self.bestHash is not None
+                and previous is not None
+                and tipHeight - (height - 1) < self.window
+                and (
+                    height - 1 > self.height
+                    or self.hashes.get(height - 1, previous) != previous
+                )
+            ):
+                header = await self.rpc_result("getblockheader", [previous, True])
+                height -= 1
+                newHashes[height] = previous
+                previous = header.get("previousblockhash")
+            if self.height is not None and height <= self.height:
+                self.reorged(height, self.height)
+            chainInfo: bytes | None = await self.fetch_chain_info()
+            self.hashes.update(newHashes)
+            for oldHeight in [h for h in self.hashes if h <= tipHeight - self.window]:
+                del self.hashes[oldHeight]
+            self.height = tipHeight
+            self.bestHash = tipHash
+            self.chainInfo = chainInfo
+            self.proxy.tipHeight = tipHeight
+            if self.proxy.txOutCache is not None:
+                self.proxy.txOutCache.new_tip(tipHash)
+        self.confirmedAt = time.monotonic()
+
+    async def fetch_chain_info(self) -> bytes | None:
+        response = await self.proxy.forward_request("getblockchaininfo", [])
+        body: bytes = await response.read()
+        return body if response.status == 200 else None
+
+    def reorged(self, fromHeight: int, toHeight: int) -> None:
+        # Blocks fromHeight..toHeight are no longer (or not only) in the chain
+        self.reorgs += 1
+        LOG.info("Chain reorganization: blocks %d to %d replaced", fromHeight, toHeight)
+        for height in range(fromHeight, toHeight + 1):
+            self.hashes.pop(height, None)
+            if self.proxy.responseCache is not None:
+                self.proxy.responseCache.remove(cache_key("getblockhash", [height]))
+
+    def stats(self) -> dict[str, int]:
+        return {"answered": self.answered, "reorgs": self.reorgs}
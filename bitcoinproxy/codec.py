@@ -0,0 +1,38 @@
+import json
+
+try:
+    import orjson
+except ImportError:  # optional, only makes encoding and decoding faster
+    orjson = None
+
+ID_KEY = b',"id":'
+
+
+def loads(data: bytes | str):
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(value) -> bytes:
+    # Compact encoding, like bitcoind's
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":")).encode()
+
+
+def encode_call(method: str, params, callId=None) -> bytes:
+    return dumps({"method": method, "params": params, "id": callId})
+
+
+def with_id(body: bytes, callId) -> bytes:
+    # Sets the id of a bitcoind response body (e.g. one served from a cache).
+    # bitcoind serializes "id" last, so only the end of the body is rewritten.
+    end: bytes = body.rstrip()
+    position: int = end.rfind(ID_KEY)
+    if position == -1 or not end.startswith(b'{"result":') or not end.endswith(b"}"):
+        return body
+    encodedId: bytes = dumps(callId)
+    if end[position + len(ID_KEY) : -1] == encodedId:
+        return body
+    return end[:position] + ID_KEY + encodedId + b"}" + body[len(end) :]
@@ -0,0 +1,69 @@
+import time
+
+PENDING = "pending"
+DOWNLOADED = "downloaded"
+FAILED = "failed"
+
+
+class BlockDownload:
+    """State of a pruned block that is (or was) being downloaded from a peer."""
+
+    def __init__(self, blockhash: str) -> None:
+        self.blockhash: str = blockhash
+        self.state: str = PENDING
+        self.peerId: int | None = None
+        self.peerAddr: str = ""
+        self.attempts: int = 0
+        self.triedPeers: set[int] = set()
+        # Additional peers the block was requested from while still pending
+        self.hedges: int = 0
+        self.requestedAt: float = time.time()
+        self.firstRequestedAt: float = self.requestedAt
+        self.updatedAt: float = self.requestedAt
+        # Seconds from the first download request until the block was available
+        self.fetchTime: float | None = None
+
+    def requested(self, peerId: int, peerAddr: str = "") -> None:
+        if self.state != PENDING:
+            self.firstRequestedAt = time.time()
+            self.hedges = 0
+        self.peerId = peerId
+        self.peerAddr = peerAddr
+        self.triedPeers.add(peerId)
+        self.attempts += 1
+        self.requestedAt = time.time()
+        self.set_state(PENDING)
+
+    def requested_elsewhere(self) -> None:
+        # Another worker process requested the block from one of its peers
+        if self.state != PENDING:
+            self.firstRequestedAt = time.time()
+        self.peerId = None
+        self.peerAddr = ""
+        self.requestedAt = time.time()
+        self.set_state(PENDING)
+
+    def downloaded(self) -> None:
+        if self.state != DOWNLOADED:
+            self.fetchTime = time.time() - self.firstRequestedAt
+        self.set_state(DOWNLOADED)
+
+    def set_state(self, state: str) -> None:
+        self.state = state
+        self.updatedAt = time.time()
+
+    def is_recently_requested(self, interval: float) -> bool:
+        return self.state == PENDING and time.time() - self.requestedAt < interval
+
+    def __repr__(self) -> str:
+        return f"BlockDownload({self.blockhash}, {self.state}, peer={self.peerId}, attempts={self.attempts})"
+
+
+def count_states(downloads: dict[str, BlockDownload]) -> dict[str, int]:
+    # Downloads requested by another worker are counted by that worker
+    counts = {PENDING: 0, DOWNLOADED: 0, FAILED: 0}
+    for download in downloads.values():
+        if download.peerId is None:
+            continue
+        counts[download.state] += 1
+    return counts
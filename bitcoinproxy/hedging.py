@@ -0,0 +1,95 @@
+import asyncio
+from bitcoinproxy.downloads import DOWNLOADED, FAILED, PENDING, BlockDownload
+from bitcoinproxy.log import LOG
+
+
+class Hedger:
+    """
+    Requests a pruned block from additional peers while the first peer has not
+    delivered it: one more peer every `delay` seconds for `maxPerBlock` rounds,
+    as long as fewer than `maxInFlight` extra requests are outstanding across
+    all blocks being hedged. Hedging stops as soon as the block is available,
+    and after the last round.
+
+    bitcoind does not tell which peer delivered a block, so a download is
+    counted as won by the last request sent before the block was available
+    (0 = the first request, 1 = the first hedge, ...).
+    """
+
+    def __init__(self, proxy, delay: float, maxPerBlock: int, maxInFlight: int) -> None:
+        self.proxy = proxy
+        self.delay: float = delay
+        self.maxPerBlock: int = maxPerBlock
+        self.maxInFlight: int = maxInFlight
+        self.tasks: dict[str, asyncio.Task] = {}
+        # Hedge requests sent for blocks that are still being downloaded
+        self.inFlight: int = 0
+        self.issued: int = 0
+        self.capped: int = 0
+        self.wins: dict[int, int] = {}
+
+    def start(self, download: BlockDownload) -> None:
+        blockhash: str = download.blockhash
+        if blockhash in self.tasks or download.state != PENDING:
+            return
+        task = self.proxy.run_background(self.hedge(download), f"Hedge {blockhash}")
+        self.tasks[blockhash] = task
+        task.add_done_callback(lambda _: self.tasks.pop(blockhash, None))
+
+    async def hedge(self, download: BlockDownload) -> None:
+        # Every round counts, including rounds skipped at the global cap, so
+        # the task ends after maxPerBlock rounds even if the block never arrives
+        hedges: int = 0
+        try:
+            for _ in range(self.maxPerBlock):
+                await asyncio.sleep(self.delay)
+                if download.state == DOWNLOADED:
+                    return
+                getBlockResponse, available = await self.proxy.retry_getblock(download)
+                if available:
+                    return
+                if self.maxInFlight and self.inFlight >= self.maxInFlight:
+                    self.capped += 1
+                    continue
+                hedges += 1
+                self.inFlight += 1
+                self.issued += 1
+                download.hedges += 1
+                LOG.info(
+                    "🧈 Block ...%s: not downloaded after %ss, hedging with another peer",
+                    download.blockhash[30:],
+                    self.delay,
+                )
+                peerId, peerAddr = download.peerId, download.peerAddr
+                await self.proxy.request_block_download(
+                    download.blockhash, exclude=download.triedPeers
+                )
+                if download.state == FAILED:
+                    # The earlier requests are still outstanding
+                    download.peerId, download.peerAddr = peerId, peerAddr
+                    download.set_state(PENDING)
+        finally:
+            self.inFlight -= hedges
+
+    def downloaded(self, download: BlockDownload) -> None:
+        # Called when a block requested from a peer is available
+        task: asyncio.Task | None = self.tasks.pop(download.blockhash, None)
+        if task is None and not download.hedges:
+            return
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        self.wins[download.hedges] = self.wins.get(download.hedges, 0) + 1
+        if download.hedges:
+            LOG.info(
+                "🧈 Block ...%s: won by hedge %d (peer %s)",
+                download.blockhash[30:],
+                download.hedges,
+                download.peerId,
+            )
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "issued": self.issued,
+            "capped": self.capped,
+            "in_flight": self.inFlight,
+        }
@@ -0,0 +1,133 @@
+import json
+import os
+import time
+from bitcoinproxy.downloads import DOWNLOADED, FAILED, PENDING
+from bitcoinproxy.peers import PeerStats
+
+REQUESTED = "requested"
+# Lines written by compact(), besides PENDING downloads
+PEER = "peer"
+
+
+class DownloadJournal:
+    """
+    Append-only journal of block downloads, one JSON object per line: which
+    block was requested from which peer, and whether and how fast it arrived.
+
+    load() replays the journal into the blocks that were still being
+    downloaded and the peers' download history, and compacts the file to
+    exactly that. It must not run while another process has the file open,
+    as records appended to the replaced file would be lost. Records are only
+    written after open(). load() and compact() are meant to be run in a
+    thread; record() only appends one short line.
+    """
+
+    def __init__(self, path: str, maxAge: float = 86400.0) -> None:
+        self.path: str = path
+        # Downloads requested longer ago are not resumed
+        self.maxAge: float = maxAge
+        self.file = None
+        self.records: int = 0
+
+    def open(self) -> None:
+        self.file = open(self.path, "a", buffering=1)
+
+    def record(
+        self,
+        event: str,
+        blockhash: str,
+        peerAddr: str,
+        latency: float | None = None,
+    ) -> None:
+        if self.file is None:
+            return
+        entry = {"t": round(time.time(), 3), "e": event, "h": blockhash, "p": peerAddr}
+        if latency is not None:
+            entry["l"] = round(latency, 3)
+        try:
+            self.file.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            self.records += 1
+        except OSError:
+            pass
+
+    def load(self) -> tuple[dict[str, dict], dict[str, PeerStats]]:
+        # Returns the downloads still pending (block hash -> last request) and
+        # the download history per peer address
+        pending: dict[str, dict] = {}
+        peers: dict[str, PeerStats] = {}
+        directory: str = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(self.path):
+            with open(self.path) as journalFile:
+                for line in journalFile:
+                    try:
+                        entry = json.loads(line)
+                        self.replay(entry, pending, peers)
+                    except (ValueError, KeyError, TypeError):
+                        # e.g. a line cut off by a crash
+                        continue
+        now: float = time.time()
+        pending = {
+            blockhash: entry
+            for blockhash, entry in pending.items()
+            if now - entry["t"] < self.maxAge
+        }
+        self.compact(pending, peers)
+        return pending, peers
+
+    def replay(self, entry: dict, pending: dict, peers: dict) -> None:
+        event: str = entry["e"]
+        if event == PEER:
+            stats = PeerStats()
+            stats.attempts = entry["a"]
+            stats.successes = entry["s"]
+            stats.failures = entry["f"]
+            stats.latency = entry.get("l")
+            stats.lastFailureAt = entry.get("lf", 0.0)
+            peers[entry["p"]] = stats
+            return
+        if event == PENDING:
+            pending[entry["h"]] = entry
+            return
+        stats = peers.setdefault(entry["p"], PeerStats())
+        if event == REQUESTED:
+            stats.attempts += 1
+            pending[entry["h"]] = entry
+        elif event == DOWNLOADED:
+            stats.successes += 1
+            if "l" in entry:
+                stats.latency = (
+                    entry["l"]
+                    if stats.latency is None
+                    else 0.7 * stats.latency + 0.3 * entry["l"]
+                )
+            pending.pop(entry["h"], None)
+        elif event == FAILED:
+            stats.failures += 1
+            stats.lastFailureAt = entry["t"]
+
+    def compact(self, pending: dict[str, dict], peers: dict[str, PeerStats]) -> None:
+        # Rewrites the journal as one line per peer and per pending download
+        with open(self.path + ".tmp", "w") as journalFile:
+            for addr, stats in peers.items():
+                entry = {
+                    "t": round(time.time(), 3),
+                    "e": PEER,
+                    "p": addr,
+                    "a": stats.attempts,
+                    "s": stats.successes,
+                    "f": stats.failures,
+                    "l": stats.latency,
+                    "lf": stats.lastFailureAt,
+                }
+                journalFile.write(json.dumps(entry, separators=(",", ":")) + "\n")
+            for entry in pending.values():
+                entry = {**entry, "e": PENDING}
+                journalFile.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        os.replace(self.path + ".tmp", self.path)
+
+    def close(self) -> None:
+        if self.file is not None:
+            self.file.close()
+            self.file = None
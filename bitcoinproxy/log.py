@@ -0,0 +1,205 @@
+import atexit
+import json
+import os
+import queue
+import sys
+import threading
+import time
+
+DEBUG = 10
+INFO = 20
+WARN = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: "debug", INFO: "info", WARN: "warn", ERROR: "error"}
+LEVELS = {name: level for level, name in LEVEL_NAMES.items()}
+LEVELS["warning"] = WARN
+QUEUE_SIZE = 10000
+
+
+class LOGGING:
+    """
+    Logger for the request hot path. The level is checked before anything
+    else happens, messages are only formatted (message % args) by a background
+    writer thread, and writing to the console or journald never blocks the
+    event loop.
+
+    Messages logged more than rateLimit times per rateInterval seconds with
+    the same template are dropped; the number of dropped messages is reported
+    once the interval is over.
+
+    At most queueSize messages wait for the writer. Messages logged while the
+    queue is full are dropped and counted, and their number is reported with
+    the next message written.
+    """
+
+    def __init__(self) -> None:
+        self.level: int = INFO
+        self.format: str = "console"
+        self.rateLimit: int = 0
+        self.rateInterval: float = 60.0
+        # template -> [start of the interval, messages logged, messages dropped]
+        self.rates: dict[str, list] = {}
+        self.queue: queue.Queue = queue.Queue(QUEUE_SIZE)
+        # Messages dropped because the queue was full, and how many of them the
+        # writer has reported
+        self.dropped: int = 0
+        self.reportedDrops: int = 0
+        self.writer: threading.Thread | None = None
+        self.writerLock = threading.Lock()
+        # rich is only imported once a message is printed to the console
+        self.console = None
+
+    def configure(
+        self,
+        level: str = "info",
+        format: str = "console",
+        rateLimit: int = 0,
+        rateInterval: float = 60.0,
+        queueSize: int = QUEUE_SIZE,
+    ) -> None:
+        self.level = LEVELS.get(str(level).lower(), INFO)
+        self.format = format if format in ("console", "json") else "console"
+        self.rateLimit = rateLimit
+        self.rateInterval = rateInterval
+        self.queue.maxsize = max(queueSize, 1)
+
+    def isEnabledFor(self, level: int) -> bool:
+        return level >= self.level
+
+    def debug(self, message: str, *args):
+        if self.level <= DEBUG:
+            self.log(DEBUG, message, args)
+
+    def info(self, message: str, *args):
+        if self.level <= INFO:
+            self.log(INFO, message, args)
+
+    def warn(self, message: str, *args):
+        if self.level <= WARN:
+            self.log(WARN, message, args)
+
+    def error(self, message: str, *args):
+        self.log(ERROR, message, args)
+
+    def log(self, level: int, message: str, args: tuple) -> None:
+        now: float = time.time()
+        if self.rateLimit and not self.allow(message, now):
+            return
+        if self.writer is None:
+            self.start_writer()
+        self.enqueue((now, level, message, args))
+
+    def enqueue(self, entry: tuple) -> None:
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            self.dropped += 1
+
+    def allow(self, template: str, now: float) -> bool:
+        rate = self.rates.get(template)
+        if rate is None or now - rate[0] >= self.rateInterval:
+            if rate is not None and rate[2]:
+                self.enqueue(
+                    (
+                        now,
+                        WARN,
+                        "%d similar messages were suppressed: %s",
+                        (rate[2], template),
+                    )
+                )
+            self.rates[template] = [now, 1, 0]
+            return True
+        if rate[1] < self.rateLimit:
+            rate[1] += 1
+            return True
+        rate[2] += 1
+        return False
+
+    def start_writer(self) -> None:
+        with self.writerLock:
+            if self.writer is None:
+                self.writer = threading.Thread(
+                    target=self.write_messages, name="Log writer", daemon=True
+                )
+                self.writer.start()
+                atexit.register(self.flush)
+
+    def write_messages(self) -> None:
+        while True:
+            entry = self.queue.get()
+            try:
+                self.report_drops(entry[0] if entry else time.time())
+                if entry is not None:
+                    self.write(*entry)
+            except Exception as e:
+                sys.stderr.write(f"Could not write log message: {e}\n")
+            if entry is None:
+                return
+
+    def report_drops(self, timestamp: float) -> None:
+        dropped: int = self.dropped - self.reportedDrops
+        if dropped:
+            self.reportedDrops += dropped
+            self.write(
+                timestamp,
+                WARN,
+                "%d log messages were dropped, the log queue was full",
+                (dropped,),
+            )
+
+    def write(self, timestamp: float, level: int, message: str, args: tuple) -> None:
+        if args:
+            message = message % args
+        if self.format == "json":
+            line = json.dumps(
+                {"ts": timestamp, "level": LEVEL_NAMES[level], "msg": message},
+                ensure_ascii=False,
+            )
+            sys.stdout.write(line + "\n")
+            sys.stdout.flush()
+        else:
+            if self.console is None:
+                self.console = self.make_console()
+            self.console.print(message, style=LEVEL_NAMES[level])
+
+    def make_console(self):
+        from rich.console import Console
+        from rich.theme import Theme
+
+        theme = Theme(
+            {
+                "debug": "black",
+                "info": "bold cyan",
+                "warn": "magenta",
+                "error": "bold red",
+            }
+        )
+        return Console(theme=theme)
+
+    def flush(self, timeout: float = 30.0) -> None:
+        # Writes all queued messages and stops the writer thread. Messages the
+        # writer could not write within timeout seconds are reported as lost.
+        with self.writerLock:
+            writer, self.writer = self.writer, None
+        if writer is not None:
+            try:
+                self.queue.put(None, timeout=timeout)
+                writer.join(timeout=timeout)
+            except queue.Full:
+                pass
+            if writer.is_alive():
+                sys.stderr.write(
+                    f"{self.queue.qsize()} log messages were not written\n"
+                )
+
+    def reset_after_fork(self) -> None:
+        # A forked worker process does not inherit the writer thread, and the
+        # console's lock may have been held by it at the time of the fork
+        self.writer = None
+        self.writerLock = threading.Lock()
+        self.queue = queue.Queue(self.queue.maxsize)
+        self.console = None
+
+
+LOG = LOGGING()
+os.register_at_fork(after_in_child=LOG.reset_after_fork)
@@ -0,0 +1,237 @@
+import bisect
+import math
+
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+)
+
+
+def format_labels(labelNames, labelValues, extra: str = "") -> str:
+    pairs = [
+        f'{name}="{escape(str(value))}"' for name, value in zip(labelNames, labelValues)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+class Counter:
+    def __init__(self, name: str, help: str, labelNames=()) -> None:
+        self.name: str = name
+        self.help: str = help
+        self.labelNames: tuple = tuple(labelNames)
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, labels: tuple = (), amount: float = 1) -> None:
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def current(self) -> dict[tuple, float]:
+        return self.values
+
+    def combine(self, values: list) -> float:
+        return sum(values)
+
+    def collect(self, values=None) -> list[str]:
+        if values is None:
+            values = self.values
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in sorted(values.items()):
+            lines.append(
+                f"{self.name}{format_labels(self.labelNames, labels)} {format_value(value)}"
+            )
+        return lines
+
+
+class Histogram:
+    """
+    Cumulative histogram with fixed buckets. observe() only does a bisect and
+    two additions, so it is cheap enough for every request.
+    """
+
+    def __init__(
+        self, name: str, help: str, labelNames=(), buckets=DEFAULT_BUCKETS
+    ) -> None:
+        self.name: str = name
+        self.help: str = help
+        self.labelNames: tuple = tuple(labelNames)
+        self.buckets: tuple = tuple(buckets)
+        # labels -> [per bucket counts (+Inf last), sum]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, labels: tuple = ()) -> None:
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        entry[0][bisect.bisect_left(self.buckets, value)] += 1
+        entry[1] += value
+
+    def count(self, labels: tuple = ()) -> int:
+        entry = self.values.get(labels)
+        return sum(entry[0]) if entry is not None else 0
+
+    def current(self) -> dict[tuple, list]:
+        return self.values
+
+    def combine(self, values: list) -> list:
+        return [
+            [sum(counts) for counts in zip(*(value[0] for value in values))],
+            sum(value[1] for value in values),
+        ]
+
+    def collect(self, values=None) -> list[str]:
+        if values is None:
+            values = self.values
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucketCount in zip(self.buckets + (math.inf,), counts):
+                cumulative += bucketCount
+                le = f'le="{format_value(float(bound))}"'
+                lines.append(
+                    f"{self.name}_bucket{format_labels(self.labelNames, labels, le)} {cumulative}"
+                )
+            labelStr = format_labels(self.labelNames, labels)
+            lines.append(f"{self.name}_sum{labelStr} {total}")
+            lines.append(f"{self.name}_count{labelStr} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """
+    Metric whose values are read from a callback when metrics are collected,
+    for values that are tracked elsewhere anyway (cache counters, pool usage).
+    aggregate ("sum", "min" or "mean") combines the values of several workers.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        function,
+        labelNames=(),
+        kind: str = "gauge",
+        aggregate: str = "sum",
+    ) -> None:
+        self.name: str = name
+        self.help: str = help
+        self.labelNames: tuple = tuple(labelNames)
+        self.kind: str = kind
+        self.aggregate: str = aggregate
+        # returns a number, or a dict of label values -> number
+        self.function = function
+
+    def current(self) -> dict[tuple, float] | None:
+        values = self.function()
+        if values is None or isinstance(values, dict):
+            return values
+        return {(): values}
+
+    def combine(self, values: list) -> float:
+        if self.aggregate == "min":
+            return min(values)
+        if self.aggregate == "mean":
+            return sum(values) / len(values)
+        return sum(values)
+
+    def collect(self, values=None) -> list[str]:
+        if values is None:
+            values = self.current()
+        if values is None:
+            return []
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in sorted(values.items()):
+            lines.append(
+                f"{self.name}{format_labels(self.labelNames, labels)} {format_value(value)}"
+            )
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self) -> None:
+        self.metrics: list = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name: str, help: str, labelNames=()) -> Counter:
+        return self.register(Counter(name, help, labelNames))
+
+    def histogram(
+        self, name: str, help: str, labelNames=(), buckets=DEFAULT_BUCKETS
+    ) -> Histogram:
+        return self.register(Histogram(name, help, labelNames, buckets))
+
+    def gauge(
+        self,
+        name: str,
+        help: str,
+        function,
+        labelNames=(),
+        kind: str = "gauge",
+        aggregate: str = "sum",
+    ) -> Gauge:
+        return self.register(Gauge(name, help, function, labelNames, kind, aggregate))
+
+    def snapshot(self) -> dict[str, list]:
+        # Current values of all metrics in a JSON serializable form, to be
+        # combined with the metrics of other worker processes by render()
+        snapshot: dict[str, list] = {}
+        for metric in self.metrics:
+            values = metric.current()
+            if values is not None:
+                snapshot[metric.name] = [
+                    [list(labels), value] for labels, value in values.items()
+                ]
+        return snapshot
+
+    def render(self, snapshots=()) -> str:
+        lines: list[str] = []
+        for metric in self.metrics:
+            values = combine(metric, snapshots)
+            if values is not None:
+                lines.extend(metric.collect(values))
+        return "\n".join(lines) + "\n"
+
+
+def combine(metric, snapshots) -> dict | None:
+    # Combines a metric's current values with the values in other workers'
+    # snapshots, label set by label set
+    values = metric.current()
+    if not snapshots:
+        return values
+    grouped: dict[tuple, list] = {}
+    for labels, value in (values or {}).items():
+        grouped[labels] = [value]
+    for snapshot in snapshots:
+        for labels, value in snapshot.get(metric.name, ()):
+            grouped.setdefault(tuple(labels), []).append(value)
+    if values is None and not grouped:
+        return None
+    return {labels: metric.combine(group) for labels, group in grouped.items()}
@@ -0,0 +1,160 @@
+import asyncio
+import random
+import time
+
+# Relative preference of the connection types reported by getpeerinfo. Feeler
+# and addr-fetch connections are short-lived and never used for downloads.
+CONNECTION_TYPE_WEIGHTS = {
+    "outbound-full-relay": 1.0,
+    "block-relay-only": 1.0,
+    "manual": 1.0,
+    "inbound": 0.6,
+}
+# Anonymity networks are usually much slower to transfer a full block
+NETWORK_WEIGHTS = {"onion": 0.6, "i2p": 0.6}
+FAILURE_PENALTY_SECONDS = 120
+
+
+class PeerStats:
+    """The proxy's own download history for one peer address."""
+
+    def __init__(self) -> None:
+        self.attempts: int = 0
+        self.successes: int = 0
+        self.failures: int = 0
+        self.latency: float | None = None
+        self.lastFailureAt: float = 0.0
+
+    def success_rate(self) -> float:
+        # Laplace smoothing, so a peer without history starts at 0.5
+        return (self.successes + 1) / (self.attempts + 2)
+
+
+class PeerScoreboard:
+    """
+    Scores the peers reported by getpeerinfo for downloading old blocks, based
+    on their services, connection type, network and ping time, and on how
+    reliably and fast they served blocks before. History is keyed by address,
+    since peer ids change whenever bitcoind reconnects.
+    """
+
+    def __init__(self, exploration: float = 0.1) -> None:
+        self.exploration: float = exploration
+        self.history: dict[str, PeerStats] = {}
+
+    def stats_for(self, addr: str) -> PeerStats:
+        return self.history.setdefault(addr, PeerStats())
+
+    def score(self, peer: dict) -> float | None:
+        # Returns None for peers that cannot serve historic blocks
+        services = peer.get("servicesnames")
+        if services is not None and "NETWORK" not in services:
+            return None
+        connectionType = peer.get("connection_type")
+        if connectionType is None:
+            connectionType = "inbound" if peer.get("inbound") else "outbound-full-relay"
+        weight = CONNECTION_TYPE_WEIGHTS.get(connectionType)
+        if weight is None:
+            return None
+        weight *= NETWORK_WEIGHTS.get(peer.get("network"), 1.0)
+        ping = peer.get("minping", peer.get("pingtime"))
+        if ping is not None:
+            weight /= 1 + ping
+        stats = self.history.get(peer.get("addr", ""))
+        if stats is not None:
+            weight *= stats.success_rate()
+            if stats.latency is not None:
+                weight /= 1 + stats.latency / 10
+            if time.time() - stats.lastFailureAt < FAILURE_PENALTY_SECONDS:
+                weight *= 0.1
+        else:
+            weight *= 0.5
+        return weight
+
+    def select(self, peers: list[dict], exclude=()) -> dict | None:
+        # Picks the best scoring peer not in exclude (peer ids), or, with a
+        # probability of `exploration`, a random eligible one, so peers without
+        # history get tried too.
+        scored = [(self.score(peer), peer) for peer in peers]
+        eligible = [(score, peer) for (score, peer) in scored if score is not None]
+        candidates = [
+            (score, peer) for (score, peer) in eligible if peer.get("id") not in exclude
+        ] or eligible
+        if not candidates:
+            return None
+        if random.random() < self.exploration:
+            return random.choice(candidates)[1]
+        return max(candidates, key=lambda candidate: candidate[0])[1]
+
+    def record_request(self, addr: str) -> None:
+        self.stats_for(addr).attempts += 1
+
+    def record_success(self, addr: str, latency: float) -> None:
+        stats = self.stats_for(addr)
+        stats.successes += 1
+        # exponentially weighted moving average of the download latency
+        stats.latency = (
+            latency if stats.latency is None else 0.7 * stats.latency + 0.3 * latency
+        )
+
+    def record_failure(self, addr: str) -> None:
+        stats = self.stats_for(addr)
+        stats.failures += 1
+        stats.lastFailureAt = time.time()
+
+
+class PeerInfoCache:
+    """
+    Snapshot of bitcoind's getpeerinfo, refreshed in the background every
+    `refreshInterval` seconds, so block recoveries do not have to query and
+    parse the full peer list each time. Concurrent refreshes are coalesced.
+    """
+
+    def __init__(self, fetch, refreshInterval: float = 30.0) -> None:
+        # fetch is a coroutine function returning the getpeerinfo result
+        self.fetch = fetch
+        self.refreshInterval: float = refreshInterval
+        self.peers: list[dict] = []
+        self.fetchedAt: float | None = None
+        self.refreshing: asyncio.Future | None = None
+        self.refreshes: int = 0
+
+    def is_stale(self) -> bool:
+        # Only happens if the background refresh is not running or failing
+        return (
+            self.fetchedAt is None
+            or time.monotonic() - self.fetchedAt > 2 * self.refreshInterval
+        )
+
+    async def get(self) -> list[dict]:
+        if self.is_stale() or not self.peers:
+            await self.refresh()
+        return self.peers
+
+    async def refresh(self) -> None:
+        if self.refreshing is None:
+            self.refreshing = asyncio.ensure_future(self.load())
+            self.refreshing.add_done_callback(
+                lambda _: setattr(self, "refreshing", None)
+            )
+        await asyncio.shield(self.refreshing)
+
+    async def load(self) -> None:
+        peers = await self.fetch()
+        if isinstance(peers, list):
+            self.peers = peers
+            self.fetchedAt = time.monotonic()
+            self.refreshes += 1
+
+    def invalidate(self, peerId: int) -> None:
+        # Drop a peer that bitcoind reported as disconnected
+        self.peers = [peer for peer in self.peers if peer.get("id") != peerId]
+
+    async def run(self) -> None:
+        while True:
+            await asyncio.sleep(self.refreshInterval)
+            try:
+                await self.refresh()
+            except Exception:
+                # keep the last snapshot, get() refreshes once it is stale
+                pass
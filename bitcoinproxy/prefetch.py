@@ -0,0 +1,149 @@
+import time
+from collections import OrderedDict
+from bitcoinproxy.codec import loads
+from bitcoinproxy.downloads import FAILED, PENDING
+
+# Heights of upcoming blocks remembered from getblockhash
+MAX_KNOWN_HEIGHTS = 1024
+
+
+class Prefetcher:
+    """
+    Detects sequential getblock access (e.g. a lightningd rescan) and requests
+    the next pruned blocks from peers before they are asked for.
+
+    A prefetched block counts as in flight until it is requested by a client
+    or `timeout` seconds have passed; at most `maxInFlight` blocks are in flight.
+    The heights of the blocks looked up for prefetching are remembered, so a
+    rescan reaching them needs no getblockheader call.
+    """
+
+    def __init__(
+        self,
+        proxy,
+        window: int,
+        maxInFlight: int,
+        timeout: float = 60.0,
+        minRun: int = 2,
+    ) -> None:
+        self.proxy = proxy
+        self.window: int = window
+        self.maxInFlight: int = maxInFlight
+        self.timeout: float = timeout
+        self.minRun: int = minRun
+        self.lastHeight: int | None = None
+        self.runLength: int = 0
+        self.scheduledUpTo: int = -1
+        self.inFlight: dict[str, float] = {}
+        self.heights: OrderedDict[str, int] = OrderedDict()
+        self.pruneHeight: int = 0
+        self.pruneHeightCheckedAt: float = 0.0
+        self.issued: int = 0
+        self.failed: int = 0
+        self.hits: int = 0
+        self.expired: int = 0
+
+    async def observe(self, blockhash: str) -> None:
+        # Called for every getblock request not served from the response cache
+        # or the block store
+        if self.inFlight.pop(blockhash, None) is not None:
+            self.hits += 1
+        height: int | None = await self.get_height(blockhash)
+        if height is None:
+            return
+        if self.lastHeight is not None and 0 < height - self.lastHeight <= 2:
+            self.runLength += 1
+        elif height != self.lastHeight:
+            self.runLength = 1
+            self.scheduledUpTo = height
+        self.lastHeight = height
+        if self.runLength >= self.minRun:
+            await self.prefetch(height)
+
+    async def prefetch(self, height: int) -> None:
+        self.expire()
+        start: int = max(height, self.scheduledUpTo) + 1
+        end: int = height + self.window
+        if start > end or len(self.inFlight) >= self.maxInFlight:
+            return
+        pruneHeight: int = await self.get_prune_height()
+        for nextHeight in range(start, end + 1):
+            if len(self.inFlight) >= self.maxInFlight:
+                break
+            # claimed before awaiting, so concurrent calls skip this height
+            self.scheduledUpTo = nextHeight
+            if nextHeight >= pruneHeight:
+                break
+            blockhash: str | None = await self.rpc_result("getblockhash", [nextHeight])
+            if blockhash is None:
+                continue
+            self.remember_height(blockhash, nextHeight)
+            if not await self.is_missing(blockhash):
+                continue
+            # spread the downloads across peers
+            busyPeers = {
+                download.peerId
+                for download in self.proxy.downloadBlockHashes.values()
+                if download.blockhash in self.inFlight
+            }
+            self.inFlight[blockhash] = time.monotonic()
+            self.issued += 1
+            download = await self.proxy.request_block_download(
+                blockhash, exclude=busyPeers
+            )
+            if download is None or download.state != PENDING:
+                self.inFlight.pop(blockhash, None)
+                self.failed += 1
+
+    async def is_missing(self, blockhash: str) -> bool:
+        if blockhash in self.inFlight:
+            return False
+        download = self.proxy.downloadBlockHashes.get(blockhash)
+        if download is not None and download.state != FAILED:
+            return False
+        blockStore = self.proxy.blockStore
+        return blockStore is None or blockhash not in blockStore
+
+    def expire(self) -> None:
+        now: float = time.monotonic()
+        for blockhash, requestedAt in list(self.inFlight.items()):
+            if now - requestedAt > self.timeout:
+                del self.inFlight[blockhash]
+                self.expired += 1
+
+    def remember_height(self, blockhash: str, height: int) -> None:
+        self.heights[blockhash] = height
+        if len(self.heights) > MAX_KNOWN_HEIGHTS:
+            self.heights.popitem(last=False)
+
+    async def get_height(self, blockhash: str) -> int | None:
+        height: int | None = self.heights.pop(blockhash, None)
+        if height is not None:
+            return height
+        header = await self.rpc_result("getblockheader", [blockhash, True])
+        return header.get("height") if isinstance(header, dict) else None
+
+    async def get_prune_height(self) -> int:
+        # Blocks below bitcoind's prune height are (most likely) pruned
+        if time.monotonic() - self.pruneHeightCheckedAt > 60:
+            info = await self.rpc_result("getblockchaininfo", [])
+            if isinstance(info, dict):
+                self.pruneHeight = (
+                    info.get("pruneheight", 0) if info.get("pruned") else 0
+                )
+                self.pruneHeightCheckedAt = time.monotonic()
+        return self.pruneHeight
+
+    async def rpc_result(self, method: str, params: list):
+        response = await self.proxy.forward_request(method, params)
+        return loads(await response.read()).get("result")
+
+    def stats(self) -> dict[str, int | float]:
+        return {
+            "issued": self.issued,
+            "failed": self.failed,
+            "hits": self.hits,
+            "expired": self.expired,
+            "in_flight": len(self.inFlight),
+            "hit_rate": self.hits / self.issued if self.issued else 0.0,
+        }
@@ -1,49 +1,62 @@
-import json
-import random
-import aiohttp
 import asyncio
+import contextlib
 import time
 import os
+import signal
+import socket
+import sys
 from configparser import ConfigParser
-import threading
 import logging
-from aiohttp import web, BasicAuth, ClientSession
-from rich.console import Console
-from rich.theme import Theme
-
-
-class LOGGING:
-    def __init__(self) -> None:
-        self.custom_theme = Theme(
-            {
-                "debug": "black",
-                "info": "bold cyan",
-                "warn": "magenta",
-                "error": "bold red",
-            }
-        )
-        self.console = Console(theme=self.custom_theme)
-
-    def debug(self, message: str):
-        self.console.print(message, style="debug")
-
-    def info(self, message: str):
-        self.console.print(message, style="info")
-
-    def warn(self, message: str):
-        self.console.print(message, style="warn")
-
-    def error(self, message: str):
-        self.console.print(message, style="error")
+from aiohttp import ClientConnectionError, web
+from bitcoinproxy.admission import (
+    FAST,
+    FAST_METHODS,
+    DEFAULT,
+    RECOVERY,
+    OVERLOADED_ERROR_CODE,
+    AdmissionControl,
+    Lane,
+    LaneFull,
+    Slot,
+)
+from bitcoinproxy.backends import ROLES, PRUNED, Backend, BackendPool
+from bitcoinproxy.blockstore import BlockStore
+from bitcoinproxy.cache import ResponseCache, cache_key
+from bitcoinproxy.chaintip import LONGPOLL, MODES, OFF, POLL, TIP_METHODS, ChainTip
+from bitcoinproxy.codec import dumps, encode_call, loads, with_id
+from bitcoinproxy.downloads import (
+    BlockDownload,
+    PENDING,
+    DOWNLOADED,
+    FAILED,
+    count_states,
+)
+from bitcoinproxy.hedging import Hedger
+from bitcoinproxy.journal import REQUESTED, DownloadJournal
+from bitcoinproxy.log import DEBUG, LOG
+from bitcoinproxy.metrics import MetricsRegistry
+from bitcoinproxy.peers import PeerInfoCache, PeerScoreboard
+from bitcoinproxy.prefetch import Prefetcher
+from bitcoinproxy.upstream import BufferedResponse, Upstream, read_prefix
+from bitcoinproxy.utxo import TxOutCache, outpoint_key
+from bitcoinproxy.workers import WorkerCoordinator
 
+# bitcoind serializes "result" first in responses to JSON-RPC 1.0 calls (as
+# encoded by encode_call), so their error responses start with this. Responses
+# to JSON-RPC 2.0 calls start with "jsonrpc" and may have no "result" at all.
+ERROR_RESPONSE_PREFIX = b'{"result":null'
+STREAM_CHUNK_SIZE = 64 * 1024
+MAX_METRIC_METHODS = 200
 
-LOG = LOGGING()
 
-logging.basicConfig(
-    format="%(asctime)s %(levelname)s [pyBTC] %(message)s", level=logging.INFO
-)
-# LOG = logging.getLogger(__name__)
-logging.getLogger("aiohttp.access").setLevel(logging.WARNING)
+def parse_bool(value) -> bool:
+    if isinstance(value, bool):
+        return value
+    if str(value).lower() in ("1", "true", "yes", "on"):
+        return True
+    if str(value).lower() in ("0", "false", "no", "off"):
+        return False
+    raise ValueError(value)
 
 
 class BTCProxy:
@@ -52,9 +65,264 @@ class BTCProxy:
         self.background_tasks = set()
         self.taskCounter: int = 0
         self.requestCounter: int = 0
-        self.downloadBlockHashes = set[int]
+        self.downloadBlockHashes: dict[str, BlockDownload] = {}
+        self.blockRecoveries: dict[str, asyncio.Future] = {}
         self.conf = None
         self.configFile = configFile
+        self.backends: BackendPool | None = None
+        self.responseCache: ResponseCache | None = None
+        self.txOutCache: TxOutCache | None = None
+        self.blockStore: BlockStore | None = None
+        self.prefetcher: Prefetcher | None = None
+        self.hedger: Hedger | None = None
+        self.admission: AdmissionControl | None = None
+        self.chainTip: ChainTip | None = None
+        self.journal: DownloadJournal | None = None
+        # Journal loaded by the main process before forking workers
+        self.journalState: tuple[dict, dict] | None = None
+        self.peerScoreboard: PeerScoreboard | None = None
+        self.peerInfoCache: PeerInfoCache | None = None
+        self.tipHeight: int | None = None
+        self.requestsInFlight: int = 0
+        # Only set in worker processes (workers > 1)
+        self.workerId: int | None = None
+        self.coordinator: WorkerCoordinator | None = None
+        self.setup_metrics()
+
+    def setup_metrics(self) -> None:
+        # Request metrics are recorded as they happen; everything else is read
+        # from the components' own counters when /metrics is scraped.
+        metrics = self.metrics = MetricsRegistry()
+        self.requestDuration = metrics.histogram(
+            "btcproxy_request_duration_seconds",
+            "Time to handle an RPC call, by method and outcome.",
+            ("method", "outcome"),
+        )
+        self.prunedBlockMisses = metrics.counter(
+            "btcproxy_pruned_block_misses_total",
+            "getblock calls for blocks bitcoind did not have.",
+        )
+        self.blockRecoveryDuration = metrics.histogram(
+            "btcproxy_block_recovery_seconds",
+            "Duration of pruned block recoveries, by outcome.",
+            ("outcome",),
+        )
+        metrics.gauge(
+            "btcproxy_in_flight",
+            "Requests, pruned block recoveries and background tasks in progress.",
+            lambda: {
+                ("requests",): self.requestsInFlight,
+                ("recoveries",): len(self.blockRecoveries),
+                ("background_tasks",): len(self.background_tasks),
+            },
+            ("kind",),
+        )
+        metrics.gauge(
+            "btcproxy_lane_calls",
+            "Calls being handled or waiting, by admission lane.",
+            lambda: self.admission.calls() if self.admission else None,
+            ("lane", "state"),
+        )
+        metrics.gauge(
+            "btcproxy_lane_rejected_total",
+            "Calls rejected because their admission lane was full.",
+            lambda: self.admission.rejected() if self.admission else None,
+            ("lane",),
+            kind="counter",
+        )
+        self.backendBlockFallbacks = metrics.counter(
+            "btcproxy_backend_block_fallbacks_total",
+            "Pruned blocks served by another backend instead of a peer download.",
+        )
+        metrics.gauge(
+            "btcproxy_upstream_connections_in_use",
+            "Requests to bitcoind currently holding a pooled connection.",
+            lambda: self.collect_backends(lambda backend: backend.upstream.active),
+            ("backend",),
+        )
+        metrics.gauge(
+            "btcproxy_upstream_pool_size",
+            "Maximum number of pooled connections to bitcoind.",
+            lambda: self.collect_backends(lambda backend: backend.upstream.poolSize),
+            ("backend",),
+        )
+        metrics.gauge(
+            "btcproxy_upstream_requests_total",
+            "Requests sent to bitcoind.",
+            lambda: self.collect_backends(lambda backend: backend.upstream.requests),
+            ("backend",),
+            kind="counter",
+        )
+        metrics.gauge(
+            "btcproxy_backend_healthy",
+            "Whether a backend passed its last health check.",
+            lambda: self.collect_backends(lambda backend: int(backend.healthy)),
+            ("backend",),
+            aggregate="min",
+        )
+        metrics.gauge(
+            "btcproxy_block_downloads",
+            "Blocks requested from peers, by download state.",
+            lambda: {
+                (state,): count
+                for state, count in count_states(self.downloadBlockHashes).items()
+            },
+            ("state",),
+        )
+        metrics.gauge(
+            "btcproxy_cache_events_total",
+            "Hits, misses and evictions of the response cache and the block store.",
+            self.collect_cache_events,
+            ("cache", "event"),
+            kind="counter",
+        )
+        metrics.gauge(
+            "btcproxy_cache_hit_ratio",
+            "Share of lookups served from the response cache and the block store.",
+            self.collect_cache_hit_ratios,
+            ("cache",),
+            aggregate="mean",
+        )
+        metrics.gauge(
+            "btcproxy_cache_bytes",
+            "Bytes held by the response cache and the block store.",
+            lambda: {
+                (name,): stats["bytes"] for name, stats in self.cache_stats().items()
+            },
+            ("cache",),
+        )
+        metrics.gauge(
+            "btcproxy_chain_tip_total",
+            "Calls answered from the tracked chain tip, and reorgs detected.",
+            lambda: (
+                {(event,): count for event, count in self.chainTip.stats().items()}
+                if self.chainTip
+                else None
+            ),
+            ("event",),
+            kind="counter",
+        )
+        metrics.gauge(
+            "btcproxy_prefetch_total",
+            "Prefetched blocks, by result.",
+            lambda: (
+                {
+                    (result,): self.prefetcher.stats()[result]
+                    for result in ("issued", "failed", "hits", "expired")
+                }
+                if self.prefetcher
+                else None
+            ),
+            ("result",),
+            kind="counter",
+        )
+        metrics.gauge(
+            "btcproxy_gettxout_lookups_total",
+            "gettxout lookups sent to bitcoind, the batches they were sent in, and lookups joining one in progress.",
+            lambda: (
+                {
+                    (kind,): self.txOutCache.stats()[kind]
+                    for kind in ("lookups", "batches", "coalesced")
+                }
+                if self.txOutCache
+                else None
+            ),
+            ("kind",),
+            kind="counter",
+        )
+        metrics.gauge(
+            "btcproxy_hedge_requests_total",
+            "Additional peer requests for blocks not yet downloaded, and hedges skipped at the cap.",
+            lambda: (
+                {
+                    (result,): self.hedger.stats()[result]
+                    for result in ("issued", "capped")
+                }
+                if self.hedger
+                else None
+            ),
+            ("result",),
+            kind="counter",
+        )
+        metrics.gauge(
+            "btcproxy_hedge_wins_total",
+            "Hedged downloads by the request last sent before the block arrived (0 = first request).",
+            lambda: (
+                {(str(hedge),): count for hedge, count in self.hedger.wins.items()}
+                if self.hedger
+                else None
+            ),
+            ("hedge",),
+            kind="counter",
+        )
+
+    def cache_stats(self) -> dict[str, dict]:
+        stats: dict[str, dict] = {}
+        if self.responseCache is not None:
+            stats["response"] = self.responseCache.stats()
+        if self.blockStore is not None:
+            stats["blockstore"] = self.blockStore.stats()
+        if self.txOutCache is not None:
+            stats["gettxout"] = self.txOutCache.stats()
+        return stats
+
+    def collect_cache_events(self) -> dict[tuple, int]:
+        return {
+            (name, event): stats[event]
+            for name, stats in self.cache_stats().items()
+            for event in ("hits", "misses", "evictions")
+        }
+
+    def collect_cache_hit_ratios(self) -> dict[tuple, float]:
+        return {
+            (name,): stats["hits"] / max(stats["hits"] + stats["misses"], 1)
+            for name, stats in self.cache_stats().items()
+        }
+
+    async def handle_metrics(self, request) -> web.Response:
+        # In worker mode the metrics of all workers are combined
+        snapshots: list[dict] = []
+        if self.coordinator is not None:
+            snapshots = await asyncio.to_thread(self.coordinator.read_metrics)
+        return web.Response(
+            text=self.metrics.render(snapshots),
+            content_type="text/plain",
+            charset="utf-8",
+        )
+
+    async def start_metrics_sync(self, app=None) -> None:
+        if self.coordinator is not None:
+            self.run_background(self.metricsSyncTask(), "Metrics sync")
+
+    async def metricsSyncTask(self):
+        # Publishes this worker's metrics for the worker serving /metrics. The
+        # first worker also removes the download claims that have expired.
+        interval: float = self.getCfgValue(
+            "metrics", "metrics_sync_interval", 5.0, float
+        )
+        retryInterval: float = self.getCfgValue(
+            "app", "download_retry_interval", 20.0, float
+        )
+        while True:
+            await asyncio.to_thread(
+                self.coordinator.write_metrics, self.metrics.snapshot()
+            )
+            if self.workerId == 0:
+                await asyncio.to_thread(
+                    self.coordinator.remove_expired_claims, retryInterval
+                )
+            await asyncio.sleep(interval)
+
+    def observe_request(self, method: str, startTime: float, response) -> None:
+        status = getattr(response, "status", 500)
+        outcome = "ok" if status == 200 else "error"
+        values = self.requestDuration.values
+        # Method names come from clients, so the number of label values is capped
+        if (method, outcome) not in values and (
+            len(values) >= MAX_METRIC_METHODS or not method.isalnum()
+        ):
+            method = "other"
+        self.requestDuration.observe(time.perf_counter() - startTime, (method, outcome))
 
     def start(self) -> None:
         LOG.debug("start()")
@@ -63,7 +331,7 @@ class BTCProxy:
         else:
             main_base: str = os.path.dirname(__file__)
             configFileFullPath = os.path.join(main_base, self.configFile)
-            LOG.info(f"Using config file {configFileFullPath}")
+            LOG.info("Using config file %s", configFileFullPath)
             parser = ConfigParser()
             if not parser.read(configFileFullPath):
                 raise FileNotFoundError(f"Config file not found ({configFileFullPath})")
@@ -71,83 +339,246 @@ class BTCProxy:
                 parser.read(configFileFullPath)
                 self.conf: ConfigParser = parser
 
-        serverThread = threading.Thread(
-            target=self.run_server, args=(self.aiohttp_server(),)
+        workers: int = self.getCfgValue("app", "workers", 1, int)
+        if workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+            LOG.error("Worker mode needs SO_REUSEPORT, running a single worker.")
+            workers = 1
+        # Only the proxy's own log goes to the console, aiohttp's messages are
+        # limited to warnings
+        logging.basicConfig(
+            format="%(asctime)s %(levelname)s [pyBTC] %(message)s", level=logging.INFO
+        )
+        logging.getLogger("aiohttp.access").setLevel(logging.WARNING)
+        if workers > 1:
+            self.start_workers(workers)
+            return
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            self.run_server()
+            return
+        # Started from within an event loop (e.g. a test): serve on that loop
+        self.run_background(self.serve(), "Server")
+
+    def start_workers(self, workers: int) -> None:
+        # Forks worker processes that all listen on listen_ip:listen_port. They
+        # coordinate pruned block downloads and share metrics through files in
+        # worker_dir (a temporary directory unless configured).
+        import multiprocessing
+        import shutil
+        import tempfile
+
+        directory: str = self.getCfgValue("app", "worker_dir", "")
+        temporary: bool = not directory
+        if temporary:
+            directory = tempfile.mkdtemp(prefix="pyBTCProxy-")
+        else:
+            directory = os.path.expanduser(directory)
+            os.makedirs(directory, exist_ok=True)
+        LOG.info(
+            "Starting %d worker processes, sharing state in %s", workers, directory
         )
-        serverThread.start()
+        journal: DownloadJournal | None = self.make_journal()
+        if journal is not None:
+            # Replayed and compacted once; the workers only append to it
+            try:
+                self.journalState = journal.load()
+            except OSError as e:
+                LOG.error("Could not load download journal %s: %s", journal.path, e)
+        # A worker must not inherit the log writer in the middle of a message
+        LOG.flush()
+        context = multiprocessing.get_context("fork")
+        processes = [
+            context.Process(
+                target=self.run_worker,
+                args=(workerId, directory),
+                name=f"Worker#{workerId}",
+            )
+            for workerId in range(workers)
+        ]
+        try:
+            for process in processes:
+                process.start()
+            # Stopping the main process stops the workers
+            signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+            for process in processes:
+                process.join()
+            # e.g. a worker could not bind the listen port
+            if any(process.exitcode for process in processes):
+                sys.exit(1)
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                    process.join()
+            if temporary:
+                shutil.rmtree(directory, ignore_errors=True)
 
-        statisticThread = threading.Thread(target=self.statistics)
-        statisticThread.start()
+    def run_worker(self, workerId: int, directory: str) -> None:
+        self.workerId = workerId
+        self.coordinator = WorkerCoordinator(directory, workerId)
+        self.run_server(reusePort=True)
 
     def aiohttp_server(self) -> web.AppRunner:
+        # In-flight requests get up to shutdown_timeout seconds to complete when
+        # the server is stopped
+        runner = web.AppRunner(
+            self.create_app(),
+            access_log=None,
+            shutdown_timeout=self.getCfgValue("app", "shutdown_timeout", 30.0, float),
+        )
+        return runner
+
+    def create_app(self) -> web.Application:
+        self.configure_logging()
         app = web.Application()
         app.router.add_post("/", self.taskRequestHandler)
-        runner = web.AppRunner(app)
-        return runner
+        if self.getCfgValue("metrics", "metrics_enabled", True, parse_bool):
+            app.router.add_get("/metrics", self.handle_metrics)
+        app.on_startup.append(self.statistics)
+        app.on_startup.append(self.start_metrics_sync)
+        app.on_startup.append(self.start_journal)
+        app.on_cleanup.append(self.cancel_background_tasks)
+        app.on_cleanup.append(self.close_upstream)
+        app.on_cleanup.append(self.close_journal)
+        return app
 
-    def run_server(self, runner):
-        LOG.info("Starting proxy server...")
-        loop = asyncio.new_event_loop()
+    def run_server(self, reusePort: bool = False) -> None:
+        # Runs the server on an event loop in the calling thread until SIGTERM
+        # or SIGINT. Exits with status 1 if the listen port cannot be bound.
+        if self.workerId is None:
+            LOG.info("Starting proxy server...")
+        else:
+            LOG.info("Starting proxy server worker #%d...", self.workerId)
+        loop = self.new_event_loop()
         asyncio.set_event_loop(loop)
-        loop.run_until_complete(runner.setup())
+        try:
+            loop.run_until_complete(self.serve(reusePort))
+        except OSError:
+            sys.exit(1)
+        finally:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+            LOG.flush()
+
+    def new_event_loop(self) -> asyncio.AbstractEventLoop:
+        # uvloop is used if it is installed, unless event_loop is set to asyncio
+        eventLoop: str = self.getCfgValue("app", "event_loop", "auto")
+        if eventLoop != "asyncio":
+            try:
+                import uvloop
+
+                LOG.debug("Using uvloop")
+                return uvloop.new_event_loop()
+            except ImportError:
+                if eventLoop == "uvloop":
+                    LOG.error("uvloop is not installed, using the asyncio event loop.")
+        return asyncio.new_event_loop()
+
+    async def serve(self, reusePort: bool = False) -> None:
+        runner: web.AppRunner = self.aiohttp_server()
+        await runner.setup()
         listen_host = self.getCfg("net", "listen_ip")
         listen_portnumber = self.getCfg("net", "listen_port")
         forward_host = self.getCfg("net", "dest_ip")
         forward_portnumber = self.getCfg("net", "dest_port")
         LOG.info(
-            f"Proxy is configured to listen on {listen_host}:{listen_portnumber} and forward to {forward_host}:{forward_portnumber}"
+            "Proxy is configured to listen on %s:%s and forward to %s:%s",
+            listen_host,
+            listen_portnumber,
+            forward_host,
+            forward_portnumber,
         )
-        site = web.TCPSite(runner, listen_host, listen_portnumber)
+        site = web.TCPSite(runner, listen_host, listen_portnumber, reuse_port=reusePort)
+        loop = asyncio.get_running_loop()
+        stopping = asyncio.Event()
+        signals: list[int] = []
         try:
-            loop.run_until_complete(site.start())
-        except Exception as err:
-            LOG.info(f"Unexpected {err=}, {type(err)=}")
-        LOG.info(
-            f"Proxy is listening on {listen_host}:{listen_portnumber} and forwarding to {forward_host}:{forward_portnumber}"
-        )
-        loop.run_forever()
+            await site.start()
+            LOG.info(
+                "Proxy is listening on %s:%s and forwarding to %s:%s",
+                listen_host,
+                listen_portnumber,
+                forward_host,
+                forward_portnumber,
+            )
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                try:
+                    loop.add_signal_handler(signum, stopping.set)
+                    signals.append(signum)
+                except (NotImplementedError, RuntimeError, ValueError):
+                    # Not in the main thread, or not supported by the platform
+                    pass
+            await stopping.wait()
+            LOG.info(
+                "Stopping proxy server, %d requests in flight...", self.requestsInFlight
+            )
+        except OSError as err:
+            LOG.error(
+                "Could not listen on %s:%s: %s", listen_host, listen_portnumber, err
+            )
+            raise
+        finally:
+            # Stops accepting connections, lets in-flight requests complete and
+            # runs the cleanup hooks (background tasks, upstream sessions, journal)
+            for signum in signals:
+                loop.remove_signal_handler(signum)
+            await runner.cleanup()
+        LOG.info("Proxy server stopped.")
 
     async def taskRequestHandler(self, request) -> web.Response | None:
         requestTask = asyncio.create_task(
             self._handle(request), name="Task#" + str(self.taskCounter)
         )
-        LOG.debug(f"{requestTask.get_name()}: Task created.")
+        LOG.debug("%s: Task created.", requestTask.get_name())
         self.taskCounter += 1
         self.background_tasks.add(requestTask)
         requestTask.add_done_callback(self.background_tasks.discard)
         if not requestTask.cancelled():
             if not requestTask.done():
                 LOG.debug(
-                    f"{requestTask.get_name()}: Task is not done yet...awaiting..."
+                    "%s: Task is not done yet...awaiting...", requestTask.get_name()
                 )
                 startTime = time.time()
                 await requestTask
                 stopTime = time.time()
                 LOG.debug(
-                    f"{requestTask.get_name()}: Task is done, execution took "
-                    + str(stopTime - startTime)
-                    + "ms."
+                    "%s: Task is done, execution took %sms.",
+                    requestTask.get_name(),
+                    stopTime - startTime,
                 )
 
             try:
                 response: web.Response = requestTask.result()
             except asyncio.InvalidStateError:
-                LOG.error(f"{requestTask.get_name()}: Task is in invalid state!")
+                LOG.error("%s: Task is in invalid state!", requestTask.get_name())
             except asyncio.CancelledError:
-                LOG.error(f"{requestTask.get_name()}: Task was cancelled!")
+                LOG.error("%s: Task was cancelled!", requestTask.get_name())
             else:
                 return response
 
-    def statistics(self):
-        LOG.info("Starting statistics thread...")
-        statisticsTask = asyncio.create_task(
-            self.statsTask(), name="Statistics Task#{self.taskCounter}"
+    def run_background(self, coro, name: str) -> asyncio.Task:
+        task = asyncio.create_task(
+            self.log_exceptions(coro, name), name=f"{name} Task#{self.taskCounter}"
         )
         self.taskCounter += 1
-        self.background_tasks.add(statisticsTask)
-        statisticsTask.add_done_callback(self.background_tasks.discard)
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        return task
+
+    async def log_exceptions(self, coro, name: str) -> None:
+        try:
+            await coro
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            LOG.error("%s task failed: %s", name, e)
+
+    async def statistics(self, app=None):
+        LOG.info("Starting statistics task...")
+        self.run_background(self.statsTask(), "Statistics")
 
-    def statsTask(self):
+    async def statsTask(self):
         while True:
             if self.requestCounter != 0:
                 now = int(time.time())
@@ -160,184 +591,1120 @@ class BTCProxy:
                     "%d days, %d hours, %d minutes, %d seconds. "
                     % (d[0], h[0], m[0], s)
                 )
+                downloadStates = count_states(self.downloadBlockHashes)
                 logStr += (
-                    str(len(self.downloadBlockHashes)) + " blocks were downloaded."
+                    str(downloadStates[DOWNLOADED])
+                    + " blocks were downloaded, "
+                    + str(downloadStates[PENDING])
+                    + " downloads are pending, "
+                    + str(downloadStates[FAILED])
+                    + " failed. "
                 )
+                if self.responseCache is not None:
+                    cacheStats = self.responseCache.stats()
+                    logStr += (
+                        f"Cache: {cacheStats['hits']} hits, {cacheStats['misses']} misses, "
+                        f"{cacheStats['evictions']} evictions, {cacheStats['bytes']} bytes. "
+                    )
+                if self.blockStore is not None:
+                    storeStats = self.blockStore.stats()
+                    logStr += (
+                        f"Block store: {storeStats['blocks']} blocks ({storeStats['bytes']} bytes), "
+                        f"{storeStats['hits']} hits, {storeStats['misses']} misses. "
+                    )
+                if self.prefetcher is not None:
+                    prefetchStats = self.prefetcher.stats()
+                    logStr += (
+                        f"Prefetch: {prefetchStats['issued']} issued, {prefetchStats['failed']} failed, "
+                        f"{prefetchStats['hits']} hits ({prefetchStats['hit_rate']:.0%})."
+                    )
                 LOG.info(logStr)
-                time.sleep(1800)
+                await asyncio.sleep(1800)
             else:
                 logStr = "📊 No requests were forwarded so far."
                 LOG.info(logStr)
 
-                time.sleep(180)
+                await asyncio.sleep(180)
 
     def getCfg(self, sectionName, valueName) -> str:
         if not self.conf:
             LOG.info("Configuration has not been properly initiated.")
             return ""
-        if sectionName  not in self.conf:
-            LOG.error(f"No section with name {sectionName} found in configuration.")
+        if sectionName not in self.conf:
+            LOG.error("No section with name %s found in configuration.", sectionName)
             return ""
-        if  valueName not in self.conf[sectionName]:
-            LOG.error(f"No value with name '{valueName} found in configuration.")
+        if valueName not in self.conf[sectionName]:
+            LOG.error("No value with name '%s' found in configuration.", valueName)
             return ""
         return self.conf[sectionName][valueName]
 
+    def getCfgValue(self, sectionName, valueName, default, convert=str):
+        # Like getCfg, but for optional values: missing or empty values silently
+        # fall back to the default, malformed values are reported.
+        if not self.conf or sectionName not in self.conf:
+            return default
+        if valueName not in self.conf[sectionName]:
+            return default
+        value = self.conf[sectionName][valueName]
+        if value == "":
+            return default
+        try:
+            return convert(value)
+        except ValueError:
+            LOG.error(
+                "Invalid value '%s' for %s.%s, using default %s.",
+                value,
+                sectionName,
+                valueName,
+                default,
+            )
+            return default
+
+    def configure_logging(self) -> None:
+        LOG.configure(
+            level=self.getCfgValue("app", "log_level", "info"),
+            format=self.getCfgValue("app", "log_format", "console"),
+            rateLimit=self.getCfgValue("app", "log_rate_limit", 0, int),
+            rateInterval=self.getCfgValue("app", "log_rate_interval", 60.0, float),
+            queueSize=self.getCfgValue("app", "log_queue_size", 10000, int),
+        )
+
+    def get_backends(self) -> BackendPool:
+        # Backends are configured in [backend:<name>] sections, or, without
+        # any, the single bitcoind given by dest_ip/dest_port in [net].
+        if self.backends is None:
+            sections = [
+                section
+                for section in (self.conf or {})
+                if section.startswith("backend:")
+            ]
+            if sections:
+                backends = [self.make_backend(section) for section in sections]
+            else:
+                backends = [Backend("default", self.make_upstream("net"))]
+            self.backends = BackendPool(
+                backends,
+                checkInterval=self.getCfgValue(
+                    "net", "health_check_interval", 10.0, float
+                ),
+                checkTimeout=self.getCfgValue(
+                    "net", "health_check_timeout", 5.0, float
+                ),
+                maxLag=self.getCfgValue("net", "health_max_lag", 2, int),
+            )
+            if len(backends) > 1 and self.backends.checkInterval > 0:
+                self.run_background(self.backends.run(), "Health checks")
+        return self.backends
+
+    def make_backend(self, section: str) -> Backend:
+        name: str = section.split(":", 1)[1]
+        role: str = self.getCfgValue(section, "role", PRUNED)
+        if role not in ROLES:
+            LOG.error("Invalid role '%s' for backend %s, using %s.", role, name, PRUNED)
+            role = PRUNED
+        weight: float = self.getCfgValue(section, "weight", 1.0, float)
+        return Backend(
+            name, self.make_upstream(section), weight=max(weight, 0.01), role=role
+        )
+
+    def make_upstream(self, section: str) -> Upstream:
+        # Missing values of a backend section are taken from [net]
+        def value(name: str, default, convert=str):
+            return self.getCfgValue(
+                section, name, self.getCfgValue("net", name, default, convert), convert
+            )
+
+        return Upstream(
+            f"http://{value('dest_ip', '127.0.0.1')}:{value('dest_port', '8332')}",
+            value("dest_user", ""),
+            value("dest_pass", ""),
+            poolSize=value("pool_size", 100, int),
+            poolSizePerHost=value("pool_size_per_host", 0, int),
+            idleTimeout=value("pool_idle_timeout", 15.0, float),
+            connectTimeout=value("connect_timeout", 5.0, float),
+            readTimeout=value("read_timeout", 120.0, float),
+        )
+
+    def get_upstream(self) -> Upstream:
+        return self.get_backends().primary().upstream
+
+    def collect_backends(self, function) -> dict:
+        if self.backends is None:
+            return {}
+        return {
+            (backend.name,): function(backend) for backend in self.backends.backends
+        }
+
+    async def cancel_background_tasks(self, app=None) -> None:
+        for task in list(self.background_tasks):
+            task.cancel()
+        await asyncio.gather(*self.background_tasks, return_exceptions=True)
+
+    async def close_upstream(self, app=None) -> None:
+        if self.backends is not None:
+            await self.backends.close()
+
     async def handle_request(self, request) -> web.Response:
-        data = await request.text()
+        # The request body is only decoded to read method, params and id. It is
+        # forwarded to bitcoind unchanged unless the call has to be rewritten.
+        body: bytes = await request.read()
+        request_json = loads(body)
+        if isinstance(request_json, list):
+            startTime: float = time.perf_counter()
+            try:
+                async with self.get_admission().admit("batch") as slot:
+                    response = await self.handle_batch(request_json, slot)
+            except LaneFull as e:
+                response = self.overloaded_response(e)
+            self.observe_request("batch", startTime, response)
+            return response
         self.requestCounter += 1
-        request_json = json.loads(data)
         method: str = request_json.get("method", "")
         params: str = request_json.get("params", [])
+        callId = request_json.get("id")
         #        headers = request.headers
         headers = ""
         if method != "gettxout":
-            LOG.info(f"-> Incoming request {method} {params} {headers}")
-        dest_user: str = self.getCfg("net", "dest_user")
-        dest_pass: str = self.getCfg("net", "dest_pass")
-        async with aiohttp.ClientSession(
-            auth=BasicAuth(dest_user, dest_pass)
-        ) as session:
-            if method == "getblock":
-                callParams: list[str] = [params[0]]
-                try:
-                    response: web.Response = await self.forward_request(
-                        session, method, callParams
-                    )
-                except Exception as e:
-                    LOG.error(f"Error forwarding getblock request: {str(e)}")
-                    response: dict[str, str] = {"error": str(e)}
-
-                responseText: str = await response.text()
-                #                LOG.info(f"responseText; {responseText}")
-                responseJson = await response.json()
-                if "error" in responseJson and responseJson["error"] is not None:
-                    LOG.info(f"Cannot retrieve block from bitcoind: {responseJson}")
-                    getBlockErrorResponse: (
-                        web.Response | None
-                    ) = await self.handle_getblock_error(session, callParams, response)
-                    responseText: str = await getBlockErrorResponse.text()
-                    content_type = getBlockErrorResponse.headers["Content-Type"]
+            LOG.info("-> Incoming request %s %s %s", method, params, headers)
+        startTime: float = time.perf_counter()
+        self.requestsInFlight += 1
+        response = None
+        try:
+            async with self.get_admission().admit(method) as slot:
+                response = await self.handle_call(
+                    method, params, request, callId, body, slot
+                )
+            return response
+        except LaneFull as e:
+            response = self.overloaded_response(e, callId)
+            return response
+        finally:
+            self.requestsInFlight -= 1
+            self.observe_request(method, startTime, response)
+
+    def overloaded_body(self, error: LaneFull, callId=None) -> bytes:
+        LOG.warn("Rejecting call: %s", str(error))
+        return dumps(
+            {
+                "result": None,
+                "error": {"code": OVERLOADED_ERROR_CODE, "message": str(error)},
+                "id": callId,
+            }
+        )
+
+    def overloaded_response(self, error: LaneFull, callId=None) -> web.Response:
+        return web.Response(
+            body=self.overloaded_body(error, callId),
+            status=503,
+            content_type="application/json",
+        )
+
+    async def handle_batch(self, calls: list, slot: Slot | None = None) -> web.Response:
+        # Calls of a JSON-RPC batch are forwarded to bitcoind as one batch, except
+        # getblock calls, which might need a pruned block recovery and are handled
+        # concurrently on their own. Results are returned in the original order.
+        # The batch's slot is given up as soon as one of its getblock calls
+        # waits for a recovery.
+        self.requestCounter += len(calls)
+        LOG.info("-> Incoming batch request with %d calls", len(calls))
+        results: list = [None] * len(calls)
+        forwardIndexes: list[int] = []
+        blockCalls: list = []
+        for index, call in enumerate(calls):
+            if not isinstance(call, dict) or not isinstance(call.get("method"), str):
+                results[index] = {
+                    "result": None,
+                    "error": {"code": -32600, "message": "Invalid Request object"},
+                    "id": None,
+                }
+            elif call["method"] == "getblock":
+                blockCalls.append(
+                    self.handle_batch_getblock(results, index, call, slot)
+                )
+            elif (
+                call["method"] == "gettxout"
+                and self.get_txout_cache() is not None
+                and outpoint_key(call.get("params")) is not None
+            ):
+                blockCalls.append(self.handle_batch_gettxout(results, index, call))
+            else:
+                forwardIndexes.append(index)
+        await asyncio.gather(
+            self.forward_batch(
+                results, [(index, calls[index]) for index in forwardIndexes]
+            ),
+            *blockCalls,
+        )
+        return web.Response(body=dumps(results), content_type="application/json")
+
+    async def forward_batch(self, results: list, indexedCalls: list) -> None:
+        if not indexedCalls:
+            return
+        try:
+            response = await self.forward_request(
+                "batch",
+                None,
+                self.get_backends().select(),
+                dumps([call for (_, call) in indexedCalls]),
+            )
+            batchResults = loads(await response.read())
+        except Exception as e:
+            LOG.error("Error forwarding batch request: %s", e)
+            batchResults = {"code": -32603, "message": str(e)}
+        # bitcoind answers a batch with a list in request order; anything else
+        # (e.g. an HTTP level error) is reported for every call of the batch
+        if not isinstance(batchResults, list) or len(batchResults) != len(indexedCalls):
+            error = (
+                batchResults.get("error", batchResults)
+                if isinstance(batchResults, dict)
+                else batchResults
+            )
+            batchResults = [
+                {"result": None, "error": error, "id": call.get("id")}
+                for (_, call) in indexedCalls
+            ]
+        for (index, _), result in zip(indexedCalls, batchResults):
+            results[index] = result
+
+    async def handle_batch_getblock(
+        self, results: list, index: int, call: dict, slot: Slot | None = None
+    ) -> None:
+        try:
+            response: web.Response = await self.handle_call(
+                "getblock", call.get("params", []), callId=call.get("id"), slot=slot
+            )
+            result = loads(response.body)
+        except Exception as e:
+            LOG.error("Error handling getblock in batch request: %s", e)
+            result = {"result": None, "error": {"code": -32603, "message": str(e)}}
+        result["id"] = call.get("id")
+        results[index] = result
+
+    async def handle_batch_gettxout(
+        self, results: list, index: int, call: dict
+    ) -> None:
+        status, body = await self.txOutCache.get(outpoint_key(call["params"]))
+        result = loads(body)
+        result["id"] = call.get("id")
+        results[index] = result
+
+    async def handle_call(
+        self, method: str, params, request=None, callId=None, body=None, slot=None
+    ) -> web.Response:
+        # If the client request is given, responses are streamed to the client as
+        # they arrive from bitcoind instead of being buffered completely. body is
+        # the client's original request, forwarded as is if it needs no rewrite.
+        # slot is the call's place in its admission lane.
+        if method == "gettxout":
+            txOutCache: TxOutCache | None = self.get_txout_cache()
+            outpoint: tuple | None = outpoint_key(params)
+            if txOutCache is not None and outpoint is not None:
+                status, txOutBody = await txOutCache.get(outpoint)
+                return web.Response(
+                    body=with_id(txOutBody, callId),
+                    status=status,
+                    content_type="application/json",
+                )
+        if method in TIP_METHODS or (
+            method == "getblockhash" and self.chainTip is not None
+        ):
+            chainTip: ChainTip | None = self.get_chain_tip()
+            tipBody: bytes | None = (
+                chainTip.answer(method, params) if chainTip else None
+            )
+            if tipBody is not None:
+                return web.Response(
+                    body=with_id(tipBody, callId), content_type="application/json"
+                )
+        cacheKey: str | None = self.get_cache_key(method, params)
+        if cacheKey is not None:
+            cachedBody: bytes | None = self.responseCache.get(cacheKey)
+            if cachedBody is not None:
+                LOG.debug("Serving %s %s from response cache", method, params)
+                return web.Response(
+                    body=with_id(cachedBody, callId), content_type="application/json"
+                )
+        if method == "getblock":
+            # Always sent as a JSON-RPC 1.0 call, so a pruned block error can be
+            # recognized by ERROR_RESPONSE_PREFIX
+            callParams: list[str] = params[:2]
+            body = encode_call(method, callParams, callId)
+            if len(callParams) > 1 and callParams[1] == 0:
+                storedBody: bytes | None = await self.get_stored_block(callParams[0])
+                if storedBody is not None:
+                    LOG.debug("Serving block %s from block store", callParams[0])
                     return web.Response(
-                        text=responseText, content_type=content_type, charset="utf-8"
+                        body=with_id(storedBody, callId),
+                        content_type="application/json",
                     )
+            prefetcher: Prefetcher | None = self.get_prefetcher()
+            if prefetcher is not None and callParams:
+                self.run_background(prefetcher.observe(callParams[0]), "Prefetch")
+            backend: Backend = self.get_backends().select()
+            try:
+                if request is not None:
+                    response = await self.stream_getblock(
+                        request, body, cacheKey, backend
+                    )
+                    if isinstance(response, web.StreamResponse):
+                        return response
                 else:
-                    content_type = response.headers["Content-Type"]
-                    #                    return web.Response(text=responseText, content_type=content_type, charset='utf-8')
-                    return web.json_response(text=responseText)
-            else:
+                    response = await self.forward_request(
+                        method, callParams, backend, body
+                    )
+            except Exception as e:
+                LOG.error("Error forwarding getblock request: %s", e)
+                return self.internal_error_response(e, callId)
+
+            responseBody: bytes = await response.read()
+            # Errors are recognized without decoding the (possibly multi-MB) block
+            if response.status != 200 or responseBody.startswith(ERROR_RESPONSE_PREFIX):
+                backendResponse = await self.getblock_from_backends(callParams, backend)
+                if backendResponse is not None:
+                    await self.cache_response(cacheKey, backendResponse)
+                    return web.Response(
+                        body=with_id(await backendResponse.read(), callId),
+                        content_type="application/json",
+                    )
+                LOG.info(
+                    "Cannot retrieve block from bitcoind: %s", responseBody.decode()
+                )
+                # The recovery is admitted through the recovery lane only, so
+                # waiting for a download does not hold up calls of this lane
+                if slot is not None:
+                    slot.release()
                 try:
-                    response: web.Response = await self.forward_request(
-                        session, method, params
+                    getBlockErrorResponse: web.Response = (
+                        await self.handle_getblock_error(callParams, response)
                     )
                 except Exception as e:
-                    LOG.error(f"Error forwarding generic request: {str(e)}")
-                responseText = await response.text()
-                #                return web.json_response(await response.json())
+                    LOG.error("Error recovering block %s: %s", callParams[0], e)
+                    return self.internal_error_response(e, callId)
+                await self.cache_response(
+                    self.get_cache_key("getblock", [callParams[0], 0]),
+                    getBlockErrorResponse,
+                )
+                content_type = getBlockErrorResponse.content_type
+                # Errors of bitcoind are returned with HTTP 200 as always, a
+                # full recovery lane with 503 like any other rejected call
+                status: int = 503 if getBlockErrorResponse.status == 503 else 200
                 return web.Response(
-                    text=responseText, content_type="text/plain", charset="utf-8"
+                    status=status,
+                    body=with_id(await getBlockErrorResponse.read(), callId),
+                    content_type=content_type,
+                )
+            else:
+                await self.cache_response(cacheKey, response)
+                return web.Response(body=responseBody, content_type="application/json")
+        elif (
+            request is not None
+            and cacheKey is None
+            and method not in ("getblockcount", "getblockchaininfo")
+        ):
+            # Errors before the response is streamed are returned as a JSON-RPC
+            # error; once streaming has started, the connection is just closed
+            streaming: bool = False
+            try:
+                async with self.stream_upstream(
+                    body or encode_call(method, params, callId)
+                ) as upstreamResponse:
+                    streaming = True
+                    return await self.stream_response(request, upstreamResponse)
+            except Exception as e:
+                if streaming:
+                    raise
+                LOG.error("Error forwarding %s request: %s", method, e)
+                return self.internal_error_response(e, callId)
+        else:
+            try:
+                response: web.Response = await self.forward_request(
+                    method,
+                    params,
+                    self.get_backends().select(),
+                    body or encode_call(method, params, callId),
                 )
+            except Exception as e:
+                LOG.error("Error forwarding %s request: %s", method, e)
+                return self.internal_error_response(e, callId)
+            responseBody = await response.read()
+            if method in ("getblockcount", "getblockchaininfo"):
+                self.observe_tip(method, responseBody)
+            await self.cache_response(cacheKey, response)
+            return web.Response(body=responseBody, content_type=response.content_type)
 
     #                    response = {'error': str(e)}
 
+    async def stream_getblock(
+        self, request, payload: bytes, cacheKey: str | None, backend: Backend
+    ):
+        # Streams a successful getblock response to the client. Errors are
+        # recognized by the HTTP status or the first bytes of the body, without
+        # decoding the response, and returned buffered for the block recovery.
+        async with self.stream_upstream(payload, backend) as upstreamResponse:
+            prefix: bytes = await read_prefix(
+                upstreamResponse.content, len(ERROR_RESPONSE_PREFIX)
+            )
+            if upstreamResponse.status != 200 or prefix == ERROR_RESPONSE_PREFIX:
+                body: bytes = prefix + await upstreamResponse.content.read()
+                return BufferedResponse(
+                    upstreamResponse.status, upstreamResponse.headers, body
+                )
+            return await self.stream_response(
+                request, upstreamResponse, prefix, cacheKey
+            )
+
+    async def stream_response(
+        self, request, upstreamResponse, prefix: bytes = b"", cacheKey=None
+    ) -> web.StreamResponse:
+        response = web.StreamResponse(status=upstreamResponse.status)
+        response.content_type = upstreamResponse.content_type
+        contentLength: int | None = upstreamResponse.content_length
+        if contentLength is not None:
+            response.content_length = contentLength
+        await response.prepare(request)
+        # Chunks are only kept if the complete response is going to be cached
+        chunks: list[bytes] | None = None
+        if cacheKey is not None and (contentLength or 0) <= self.responseCache.maxBytes:
+            chunks = []
+        if prefix:
+            await response.write(prefix)
+            if chunks is not None:
+                chunks.append(prefix)
+        async for chunk in upstreamResponse.content.iter_chunked(STREAM_CHUNK_SIZE):
+            await response.write(chunk)
+            if chunks is not None:
+                chunks.append(chunk)
+        await response.write_eof()
+        if chunks is not None and upstreamResponse.status == 200:
+            self.responseCache.put(cacheKey, b"".join(chunks))
+        return response
+
+    def get_cache_key(self, method: str, params) -> str | None:
+        # Returns the response cache key for calls whose result can never change,
+        # or None if the call must be forwarded. Verbose getblock/getblockheader
+        # results contain the confirmation count and are therefore not cached.
+        if self.responseCache is None:
+            self.responseCache = ResponseCache(
+                int(self.getCfgValue("cache", "cache_size_mb", 32, float) * 1024 * 1024)
+            )
+        if self.responseCache.maxBytes == 0 or not isinstance(params, list):
+            return None
+        if method == "getblock":
+            immutable = len(params) > 1 and params[1] == 0
+        elif method == "getblockheader":
+            immutable = len(params) > 1 and params[1] is False
+        elif method == "getblockhash":
+            reorgDepth: int = self.getCfgValue("cache", "cache_reorg_depth", 6, int)
+            immutable = (
+                self.tipHeight is not None
+                and len(params) > 0
+                and isinstance(params[0], int)
+                and params[0] <= self.tipHeight - reorgDepth
+            )
+        else:
+            immutable = False
+        return cache_key(method, params) if immutable else None
+
+    async def cache_response(self, cacheKey: str | None, response) -> None:
+        # Only successful responses are cached. bitcoind answers errors with a
+        # non-200 status and always serializes "result" first.
+        if cacheKey is None or response.status != 200:
+            return
+        body: bytes = await response.read()
+        if body.startswith(b'{"result":') and not body.startswith(
+            ERROR_RESPONSE_PREFIX
+        ):
+            self.responseCache.put(cacheKey, body)
+
+    def observe_tip(self, method: str, responseBody: bytes) -> None:
+        # Remember the chain height reported by bitcoind to decide which
+        # getblockhash results are buried deep enough to be cached.
+        try:
+            result = loads(responseBody)["result"]
+            height = result["blocks"] if method == "getblockchaininfo" else result
+        except (ValueError, KeyError, TypeError):
+            return
+        if isinstance(height, int):
+            self.tipHeight = height
+
     async def forward_request(
-        self, session: ClientSession, method, params
+        self, method, params, backend=None, body: bytes | None = None
     ) -> web.Response:
-        destipadress: str = self.getCfg("net", "dest_ip")
-        destportnumber: str = self.getCfg("net", "dest_port")
-        url: str = f"http://{destipadress}:{destportnumber}"
-        LOG.debug(f"Dest URL is {destipadress}:{destportnumber}")
-        async with session.post(
-            url, json={"method": method, "params": params}
-        ) as response:
+        # Without a backend the call goes to the primary backend. If the backend
+        # cannot be reached, it is marked unhealthy and the call is sent to the
+        # next primary backend once. body is an already encoded call to send.
+        backends: BackendPool = self.get_backends()
+        if backend is None:
+            backend = backends.primary()
+        LOG.debug("Dest URL is %s", backend.upstream.url)
+        payload: bytes = body if body is not None else encode_call(method, params)
+        try:
+            response = await backend.upstream.post(payload)
+        except ClientConnectionError:
+            response = await self.fail_over(backend).upstream.post(payload)
+        if LOG.isEnabledFor(DEBUG):
+            # only decode the (possibly multi-MB) body when it is logged
             data: str = await response.text()
             LOG.debug(
-                f"Response for forwarded request {method}: {data[:200]}...{data[-200:]}"
+                "Response for forwarded request %s: %s...%s",
+                method,
+                data[:200],
+                data[-200:],
+            )
+        return response
+
+    def fail_over(self, backend: Backend) -> Backend:
+        # Marks a backend that cannot be reached as failed and returns the next
+        # primary backend to retry on. Re-raises the error if there is none.
+        backend.mark_failed()
+        fallback: Backend = self.get_backends().primary()
+        if fallback is backend:
+            raise
+        LOG.warn("Backend %s unreachable, retrying on %s", backend.name, fallback.name)
+        return fallback
+
+    @contextlib.asynccontextmanager
+    async def stream_upstream(self, payload: bytes, backend: Backend | None = None):
+        # Like forward_request, but yields the response with its body not read
+        # yet. Without a backend the least loaded backend is used.
+        if backend is None:
+            backend = self.get_backends().select()
+        async with contextlib.AsyncExitStack() as stack:
+            try:
+                response = await stack.enter_async_context(
+                    backend.upstream.stream(payload)
+                )
+            except ClientConnectionError:
+                response = await stack.enter_async_context(
+                    self.fail_over(backend).upstream.stream(payload)
+                )
+            yield response
+
+    def internal_error_response(self, error: Exception, callId=None) -> web.Response:
+        return web.json_response(
+            {
+                "result": None,
+                "error": {"code": -32603, "message": str(error)},
+                "id": callId,
+            },
+            status=500,
+        )
+
+    async def getblock_from_backends(self, params: list, failed: Backend):
+        # Asks the other backends that still have a block bitcoind reported as
+        # pruned, before downloading it from a peer. Returns None if none has it.
+        backends: BackendPool = self.get_backends()
+        if len(backends.backends) < 2:
+            return None
+        try:
+            headerResponse = await self.forward_request(
+                "getblockheader", [params[0], True], failed
+            )
+            header = loads(await headerResponse.read()).get("result")
+        except Exception:
+            return None
+        if not isinstance(header, dict) or not isinstance(header.get("height"), int):
+            return None
+        for backend in backends.with_block(header["height"], exclude=(failed,)):
+            try:
+                response = await self.forward_request("getblock", params, backend)
+            except Exception as e:
+                LOG.error(
+                    "Error forwarding getblock to backend %s: %s", backend.name, e
+                )
+                continue
+            if response.status == 200:
+                LOG.info("Block %s served by backend %s", params[0], backend.name)
+                self.backendBlockFallbacks.inc()
+                return response
+        return None
+
+    async def handle_getblock_error(self, params: tuple[int, int], errorResponse):
+        # Concurrent requests for the same block hash share a single recovery. The
+        # recovery is shielded, so a client dropping its request does not cancel
+        # it for the others waiting on it.
+        blockhash: str = params[0]
+        self.prunedBlockMisses.inc()
+        recovery: asyncio.Future | None = self.blockRecoveries.get(blockhash)
+        if recovery is None:
+            recovery = asyncio.ensure_future(self.timed_recovery(params, errorResponse))
+            self.blockRecoveries[blockhash] = recovery
+            recovery.add_done_callback(
+                lambda _: self.blockRecoveries.pop(blockhash, None)
             )
+        else:
+            LOG.debug("Block %s: joining recovery already in progress", blockhash)
+        return await asyncio.shield(recovery)
+
+    async def timed_recovery(self, params: tuple[int, int], errorResponse):
+        # Recoveries run in their own lane, so a burst of them (each possibly
+        # waiting for a download) cannot hold up other calls
+        startTime: float = time.perf_counter()
+        outcome = "failed"
+        try:
+            async with self.get_admission().lanes[RECOVERY]:
+                response = await self.recover_block(params, errorResponse)
+            if response.status == 200:
+                outcome = "recovered"
             return response
+        except LaneFull as e:
+            outcome = "rejected"
+            return BufferedResponse(
+                503, {"Content-Type": "application/json"}, self.overloaded_body(e)
+            )
+        finally:
+            self.blockRecoveryDuration.observe(
+                time.perf_counter() - startTime, (outcome,)
+            )
 
-    async def handle_getblock_error(
-        self, session: ClientSession, params: tuple[int, int], errorResponse
-    ):
-        errorResponseText: str = await errorResponse.text()
-        errorDict: tuple[str, str] = json.loads(errorResponseText)
+    async def recover_block(self, params: tuple[int, int], errorResponse):
+        errorDict: dict = loads(await errorResponse.read())
         errorCode: int = int(errorDict["error"]["code"])
         errorMessage: str = errorDict["error"]["message"]
-        blockhash: int = params[0]
+        blockhash: str = params[0]
 
         catchErrorCodes = [-5, -1]
         if errorCode not in catchErrorCodes:
-            LOG.error(f"Unexpected Error {errorCode}: {errorMessage}")
+            LOG.error("Unexpected Error %s: %s", errorCode, errorMessage)
+            return errorResponse
+
+        download: BlockDownload | None = self.downloadBlockHashes.get(blockhash)
+        retryInterval: float = self.getCfgValue(
+            "app", "download_retry_interval", 20.0, float
+        )
+        waitMode: str = self.getCfgValue("app", "wait_mode", "sleep")
+        waitForDownload = int(self.getCfgValue("app", "wait_for_download", 0, float))
+        if download is not None and download.is_recently_requested(retryInterval):
+            LOG.debug(
+                "Block %s: download was already requested from peer %s, not requesting again",
+                blockhash,
+                download.peerId,
+            )
         else:
             LOG.debug(
-                f"Block {blockhash} not found, might have been pruned; select random peer to download from"
-            )
-            peerInfoResp: web.Response = await self.forward_request(
-                session, "getpeerinfo", []
-            )
-            peerInfoResponseText: str = await peerInfoResp.text()
-            peerInfoDict: tuple[str, str] = json.loads(peerInfoResponseText)
-            if "result" in peerInfoDict:
-                peerEntries = peerInfoDict["result"]
-                LOG.debug(f"Got {len(peerEntries)} peerIds")
-                if len(peerEntries) == 0:
-                    LOG.error(
-                        "No peers to download from found. Is bitcoind connected to the internet?"
-                    )
-                else:
-                    # select random entry
-                    randomPeer = random.choice(peerEntries)
-                    peer_id = randomPeer.get("id", "")
-                    peer_addr = randomPeer.get("addr", "")
-                    LOG.debug(
-                        f"Block {blockhash} will be downloaded from peer {peer_id} / {peer_addr}"
-                    )
-                    try:
-                        getblockfrompeer_result: web.Response = (
-                            await self.forward_request(
-                                session, "getblockfrompeer", [blockhash, peer_id]
-                            )
-                        )
-                    except Exception as e:
-                        LOG.error(f"Error calling getblockfrompeer: {str(e)}")
-                        getblockfrompeer_result = {"error": str(e)}
-                    getBlockFromPeerDict = json.loads(
-                        await getblockfrompeer_result.text()
-                    )
-                    LOG.debug(f"getBlockFromPeerDict:  {getBlockFromPeerDict}")
-
-                    if (
-                        "error" in getBlockFromPeerDict
-                        and getBlockFromPeerDict["error"] is not None
-                    ):
-                        errMessage = getBlockFromPeerDict["error"]["message"]
-                        LOG.info(
-                            f"🧈 Block ...{blockhash[30:]}: could not initiate download via peer {peer_id}: {errMessage}."
-                        )
-                    else:
-                        LOG.info(
-                            f"🧈 Block ...{blockhash[30:]}: download initiated via peer id {peer_id} / {peer_addr}"
-                        )
-                        self.downloadBlockHashes.add(blockhash)
-
-                        waitForDownload = int(self.getCfg("app", "wait_for_download"))
-                        if waitForDownload:
-                            LOG.info(f"Waiting {waitForDownload}s to download block")
-                            await asyncio.sleep(waitForDownload)
-                    #                            LOG.info(f"Woke up!")
-                    # retry getblock and just forward result. If we slept above, the block might have been downloaded in the meantime.
-                    LOG.info(f"🧈 Retrying getblock call for block hash {blockhash}")
-                    getBlockResponse = await self.forward_request(
-                        session, "getblock", [blockhash, 0]
+                "Block %s not found, might have been pruned; select peer to download from",
+                blockhash,
+            )
+            download = await self.request_block_download(blockhash)
+            if download is None:
+                return errorResponse
+            hedger: Hedger | None = self.get_hedger()
+            if hedger is not None and download.peerId is not None:
+                hedger.start(download)
+            if download.state == PENDING and waitMode == "sleep":
+                if waitForDownload:
+                    LOG.info("Waiting %ss to download block", waitForDownload)
+                    await asyncio.sleep(waitForDownload)
+
+        if waitMode == "poll" and download.state == PENDING and waitForDownload:
+            return await self.poll_for_block(download, waitForDownload)
+
+        # retry getblock and just forward result. If we slept above, the block might have been downloaded in the meantime.
+        LOG.info("🧈 Retrying getblock call for block hash %s", blockhash)
+        getBlockResponse, available = await self.retry_getblock(download)
+        return getBlockResponse
+
+    async def retry_getblock(self, download: BlockDownload):
+        getBlockResponse = await self.forward_request(
+            "getblock", [download.blockhash, 0]
+        )
+        dictRetry = loads(await getBlockResponse.read())
+        available: bool = dictRetry["result"] is not None
+        if available:
+            if download.state == PENDING and download.peerId is not None:
+                latency: float = time.time() - download.requestedAt
+                self.get_peer_scoreboard().record_success(download.peerAddr, latency)
+                self.journal_record(
+                    DOWNLOADED, download.blockhash, download.peerAddr, latency
+                )
+                if self.hedger is not None:
+                    self.hedger.downloaded(download)
+            if self.coordinator is not None and download.state != DOWNLOADED:
+                await asyncio.to_thread(
+                    self.coordinator.release_download, download.blockhash
+                )
+            download.downloaded()
+            LOG.info(
+                "🧈 Block %s has now been downloaded (took %.2fs).",
+                download.blockhash,
+                download.fetchTime,
+            )
+            # In worker mode, the worker that requested the block stores it
+            if self.coordinator is None or download.peerId is not None:
+                await self.store_block(download.blockhash, dictRetry["result"])
+        return getBlockResponse, available
+
+    def get_peer_scoreboard(self) -> PeerScoreboard:
+        if self.peerScoreboard is None:
+            self.peerScoreboard = PeerScoreboard(
+                self.getCfgValue("peers", "peer_exploration", 0.1, float)
+            )
+        return self.peerScoreboard
+
+    def get_peer_info_cache(self) -> PeerInfoCache:
+        # The snapshot is refreshed by a background task, started on first use
+        if self.peerInfoCache is None:
+            self.peerInfoCache = PeerInfoCache(
+                self.fetch_peer_info,
+                self.getCfgValue("peers", "peerinfo_refresh_interval", 30.0, float),
+            )
+            self.run_background(self.peerInfoCache.run(), "Peer info refresh")
+        return self.peerInfoCache
+
+    async def fetch_peer_info(self) -> list[dict] | None:
+        peerInfoResp: web.Response = await self.forward_request("getpeerinfo", [])
+        peerInfoDict: dict = loads(await peerInfoResp.read())
+        return peerInfoDict.get("result")
+
+    def get_admission(self) -> AdmissionControl:
+        # Every call is admitted through the lane of its method: cheap,
+        # latency-critical calls, pruned block recoveries, methods with their own
+        # limits in method_limits, and the default lane for everything else.
+        # The default lane may use half of the upstream pool, so a burst of
+        # slow calls always leaves connections for fast calls and recoveries.
+        if self.admission is None:
+            poolSize: int = self.getCfgValue("net", "pool_size", 100, int)
+            lanes: list[Lane] = [
+                self.make_lane(FAST, 0, 0),
+                self.make_lane(DEFAULT, max(poolSize // 2, 1), 256),
+                self.make_lane(RECOVERY, 16, 256),
+            ]
+            fastMethods: str = self.getCfgValue(
+                "admission", "fast_methods", ",".join(FAST_METHODS)
+            )
+            methodLanes: dict[str, str] = {
+                method.strip(): FAST
+                for method in fastMethods.split(",")
+                if method.strip()
+            }
+            for entry in self.getCfgValue("admission", "method_limits", "").split(","):
+                if not entry.strip():
+                    continue
+                try:
+                    method, *limits = entry.strip().split(":")
+                    limit, maxQueue = (list(map(int, limits)) + [0])[:2]
+                except ValueError:
+                    LOG.error("Invalid method limit '%s', ignoring it.", entry.strip())
+                    continue
+                lanes.append(Lane(method, limit, maxQueue))
+                methodLanes[method] = method
+            self.admission = AdmissionControl(lanes, methodLanes)
+        return self.admission
+
+    def make_lane(self, name: str, limit: int, maxQueue: int) -> Lane:
+        return Lane(
+            name,
+            self.getCfgValue("admission", f"{name}_limit", limit, int),
+            self.getCfgValue("admission", f"{name}_queue", maxQueue, int),
+        )
+
+    def get_chain_tip(self) -> ChainTip | None:
+        # The chain tip watcher is started on first use, unless tip_mode is off
+        if self.chainTip is None:
+            mode: str = self.getCfgValue("chaintip", "tip_mode", LONGPOLL)
+            if mode not in MODES:
+                LOG.error("Invalid tip_mode '%s', using %s.", mode, LONGPOLL)
+                mode = LONGPOLL
+            if mode == OFF:
+                return None
+            if mode == LONGPOLL and self.workerId:
+                # Every long-poll holds one of bitcoind's RPC threads, so in
+                # worker mode only worker 0 long-polls
+                mode = POLL
+            self.chainTip = ChainTip(
+                self,
+                mode,
+                self.getCfgValue("chaintip", "tip_poll_interval", 2.0, float),
+                self.getCfgValue("chaintip", "tip_longpoll_timeout", 30.0, float),
+                self.getCfgValue("chaintip", "tip_window", 144, int),
+            )
+            self.run_background(self.chainTip.run(), "Chain tip")
+        return self.chainTip
+
+    def make_journal(self) -> DownloadJournal | None:
+        # The download journal is optional and only enabled if journal_file is set
+        path: str = self.getCfgValue("journal", "journal_file", "")
+        if not path:
+            return None
+        return DownloadJournal(
+            os.path.expanduser(path),
+            self.getCfgValue("journal", "journal_max_age", 86400.0, float),
+        )
+
+    async def start_journal(self, app=None) -> None:
+        # Peer history is restored from the journal, and downloads that were
+        # still pending before a restart are resumed in the background. In
+        # worker mode the main process has loaded the journal already, and only
+        # worker 0 resumes the pending downloads.
+        journal: DownloadJournal | None = self.make_journal()
+        if journal is None or self.journal is not None:
+            return
+        try:
+            if self.journalState is None:
+                pending, peers = await asyncio.to_thread(journal.load)
+            else:
+                pending, peers = self.journalState
+                if self.workerId:
+                    pending = {}
+            await asyncio.to_thread(journal.open)
+        except OSError as e:
+            LOG.error("Could not load download journal %s: %s", journal.path, e)
+            return
+        self.journal = journal
+        self.get_peer_scoreboard().history.update(peers)
+        LOG.info(
+            "Download journal %s: %d pending downloads, %d peers",
+            journal.path,
+            len(pending),
+            len(peers),
+        )
+        if pending:
+            self.run_background(self.resume_downloads(pending), "Resume downloads")
+
+    async def close_journal(self, app=None) -> None:
+        if self.journal is not None:
+            self.journal.close()
+
+    def journal_record(
+        self, event: str, blockhash: str, peerAddr: str, latency: float | None = None
+    ) -> None:
+        if self.journal is not None:
+            self.journal.record(event, blockhash, peerAddr, latency)
+
+    async def resume_downloads(self, pending: dict[str, dict]) -> None:
+        # Requests the blocks again one after another, unless bitcoind has them
+        # by now or a client has asked for them in the meantime
+        for blockhash, entry in pending.items():
+            if blockhash in self.downloadBlockHashes:
+                continue
+            response = await self.forward_request("getblock", [blockhash, 0])
+            body: bytes = await response.read()
+            if response.status == 200 and not body.startswith(ERROR_RESPONSE_PREFIX):
+                self.journal_record(DOWNLOADED, blockhash, entry["p"])
+                continue
+            LOG.info("🧈 Block ...%s: resuming download", blockhash[30:])
+            await self.request_block_download(blockhash)
+
+    def get_txout_cache(self) -> TxOutCache | None:
+        if self.txOutCache is None:
+            # The fast path is on unless gettxout_fast_path is false
+            if not self.getCfgValue("gettxout", "gettxout_fast_path", True, parse_bool):
+                return None
+            self.txOutCache = TxOutCache(
+                self,
+                self.getCfgValue("gettxout", "gettxout_cache_ttl", 5.0, float),
+                int(
+                    self.getCfgValue("gettxout", "gettxout_cache_size_mb", 8, float)
+                    * 1024
+                    * 1024
+                ),
+                self.getCfgValue("gettxout", "gettxout_batch_window", 0.002, float),
+                self.getCfgValue("gettxout", "gettxout_batch_size", 100, int),
+            )
+        return self.txOutCache
+
+    def get_hedger(self) -> Hedger | None:
+        # Hedging is disabled unless hedge_max_per_block is set
+        if self.hedger is None:
+            maxPerBlock: int = self.getCfgValue(
+                "hedging", "hedge_max_per_block", 0, int
+            )
+            if maxPerBlock <= 0:
+                return None
+            self.hedger = Hedger(
+                self,
+                self.getCfgValue("hedging", "hedge_delay", 2.0, float),
+                maxPerBlock,
+                self.getCfgValue("hedging", "hedge_max_in_flight", 16, int),
+            )
+        return self.hedger
+
+    def get_prefetcher(self) -> Prefetcher | None:
+        # Prefetching is disabled unless prefetch_window is set
+        if self.prefetcher is None:
+            window: int = self.getCfgValue("prefetch", "prefetch_window", 0, int)
+            if window <= 0:
+                return None
+            self.prefetcher = Prefetcher(
+                self,
+                window,
+                self.getCfgValue("prefetch", "prefetch_max_in_flight", window, int),
+                self.getCfgValue("prefetch", "prefetch_timeout", 60.0, float),
+            )
+        return self.prefetcher
+
+    async def get_block_store(self) -> BlockStore | None:
+        # The block store is optional and only enabled if blockstore_dir is set
+        if self.blockStore is None:
+            directory: str = self.getCfgValue("blockstore", "blockstore_dir", "")
+            if not directory:
+                return None
+            pinned = self.getCfgValue("blockstore", "blockstore_pinned", "").split(",")
+            blockStore = BlockStore(
+                os.path.expanduser(directory),
+                int(
+                    self.getCfgValue("blockstore", "blockstore_size_mb", 2048, float)
+                    * 1024
+                    * 1024
+                ),
+                [blockhash.strip() for blockhash in pinned if blockhash.strip()],
+                shared=self.coordinator is not None,
+            )
+            await asyncio.to_thread(blockStore.load)
+            LOG.info(
+                "Block store %s holds %d blocks (%d bytes)",
+                blockStore.directory,
+                len(blockStore.index),
+                blockStore.size,
+            )
+            self.blockStore = blockStore
+        return self.blockStore
+
+    async def get_stored_block(self, blockhash: str) -> bytes | None:
+        # Returns a complete getblock <hash> 0 response body for a stored block
+        blockStore: BlockStore | None = await self.get_block_store()
+        if blockStore is None:
+            return None
+        blockHex: str | None = await asyncio.to_thread(blockStore.get_hex, blockhash)
+        if blockHex is None:
+            return None
+        return b'{"result":"' + blockHex.encode() + b'","error":null,"id":null}'
+
+    async def store_block(self, blockhash: str, blockHex: str) -> None:
+        blockStore: BlockStore | None = await self.get_block_store()
+        if blockStore is None:
+            return
+        try:
+            await asyncio.to_thread(blockStore.put, blockhash, blockHex)
+        except (OSError, ValueError) as e:
+            LOG.error("Could not store block %s: %s", blockhash, e)
+
+    async def poll_for_block(self, download: BlockDownload, timeout: float):
+        # Poll until the block is available, backing off exponentially between
+        # attempts. A peer that has not delivered within peer_stall_timeout is
+        # considered stalled and the block is requested from another peer,
+        # unless hedging already requests it from other peers.
+        pollInterval: float = self.getCfgValue("app", "poll_interval", 0.1, float)
+        pollIntervalMax: float = self.getCfgValue(
+            "app", "poll_interval_max", 2.0, float
+        )
+        stallTimeout: float = self.getCfgValue("app", "peer_stall_timeout", 5.0, float)
+        deadline: float = time.monotonic() + timeout
+        peerDeadline: float = time.monotonic() + stallTimeout
+        while True:
+            getBlockResponse, available = await self.retry_getblock(download)
+            now = time.monotonic()
+            if available or now >= deadline:
+                break
+            if now >= peerDeadline and self.hedger is None:
+                if download.peerId is not None:
+                    LOG.info(
+                        "🧈 Block ...%s: peer %s stalled, trying another peer",
+                        download.blockhash[30:],
+                        download.peerId,
                     )
+                    self.get_peer_scoreboard().record_failure(download.peerAddr)
+                    self.journal_record(FAILED, download.blockhash, download.peerAddr)
+                await self.request_block_download(
+                    download.blockhash, exclude=download.triedPeers
+                )
+                peerDeadline = time.monotonic() + stallTimeout
+            await asyncio.sleep(min(pollInterval, deadline - now))
+            pollInterval = min(pollInterval * 2, pollIntervalMax)
+        if not available:
+            LOG.info(
+                "🧈 Block ...%s: not downloaded within %ss",
+                download.blockhash[30:],
+                timeout,
+            )
+        return getBlockResponse
 
-                    responseText = await getBlockResponse.text()
-                    dictRetry = json.loads(responseText)
-                    if dictRetry["result"] is not None:
-                        LOG.info(f"🧈 Block {blockhash} has now been downloaded.")
-                    return getBlockResponse
+    async def request_block_download(
+        self, blockhash: str, exclude: set[int] = frozenset()
+    ) -> BlockDownload | None:
+        # Returns the download state of the block, or None if bitcoind has no peers.
+        # Peers in exclude are only used if there are no other peers. In worker
+        # mode, a block another worker has just requested is not requested again.
+        if self.coordinator is not None:
+            claimed: bool = await asyncio.to_thread(
+                self.coordinator.claim_download,
+                blockhash,
+                self.getCfgValue("app", "download_retry_interval", 20.0, float),
+            )
+            if not claimed:
+                LOG.debug(
+                    "Block %s: download was already requested by another worker",
+                    blockhash,
+                )
+                download = self.downloadBlockHashes.setdefault(
+                    blockhash, BlockDownload(blockhash)
+                )
+                download.requested_elsewhere()
+                return download
+        peerEntries: list[dict] = await self.get_peer_info_cache().get()
+        LOG.debug("Got %d peerIds", len(peerEntries))
+        if len(peerEntries) == 0:
+            LOG.error(
+                "No peers to download from found. Is bitcoind connected to the internet?"
+            )
+            return None
 
+        selectedPeer: dict | None = self.get_peer_scoreboard().select(
+            peerEntries, exclude
+        )
+        if selectedPeer is None:
+            LOG.error(
+                "None of the %d peers can serve historic blocks.", len(peerEntries)
+            )
+            return None
+        peer_id = selectedPeer.get("id", "")
+        peer_addr = selectedPeer.get("addr", "")
+        LOG.debug(
+            "Block %s will be downloaded from peer %s / %s",
+            blockhash,
+            peer_id,
+            peer_addr,
+        )
+        download: BlockDownload = self.downloadBlockHashes.setdefault(
+            blockhash, BlockDownload(blockhash)
+        )
+        download.requested(peer_id, peer_addr)
+        self.peerScoreboard.record_request(peer_addr)
+        self.journal_record(REQUESTED, blockhash, peer_addr)
+        try:
+            getblockfrompeer_result: web.Response = await self.forward_request(
+                "getblockfrompeer", [blockhash, peer_id]
+            )
+            getBlockFromPeerDict = loads(await getblockfrompeer_result.read())
+        except Exception as e:
+            LOG.error("Error calling getblockfrompeer: %s", e)
+            getBlockFromPeerDict = {"error": {"message": str(e)}}
+        LOG.debug("getBlockFromPeerDict:  %s", getBlockFromPeerDict)
 
+        if (
+            "error" in getBlockFromPeerDict
+            and getBlockFromPeerDict["error"] is not None
+        ):
+            errMessage = getBlockFromPeerDict["error"]["message"]
+            LOG.info(
+                "🧈 Block ...%s: could not initiate download via peer %s: %s.",
+                blockhash[30:],
+                peer_id,
+                errMessage,
+            )
+            download.set_state(FAILED)
+            self.peerScoreboard.record_failure(peer_addr)
+            self.journal_record(FAILED, blockhash, peer_addr)
+            if "peer does not exist" in errMessage.lower():
+                self.peerInfoCache.invalidate(peer_id)
+        else:
+            LOG.info(
+                "🧈 Block ...%s: download initiated via peer id %s / %s",
+                blockhash[30:],
+                peer_id,
+                peer_addr,
+            )
+        return download
 
     async def _handle(self, request) -> web.Response:
         response: web.Response = await self.handle_request(request)
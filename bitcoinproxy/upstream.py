@@ -0,0 +1,115 @@
+import contextlib
+import aiohttp
+from aiohttp import (
+    BasicAuth,
+    ClientSession,
+    ClientTimeout,
+    TCPConnector,
+)
+from bitcoinproxy.codec import dumps, loads
+
+
+class Upstream:
+    """
+    Long-lived, keep-alive connection pool to a bitcoind RPC backend.
+
+    The underlying ClientSession is created lazily on first use, so that it is
+    bound to the event loop the proxy server actually runs in, and lives until
+    close() is called.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        user: str,
+        password: str,
+        poolSize: int = 100,
+        poolSizePerHost: int = 0,
+        idleTimeout: float = 15.0,
+        connectTimeout: float = 5.0,
+        readTimeout: float | None = 120.0,
+    ) -> None:
+        self.url: str = url
+        self.headers = {
+            "Authorization": BasicAuth(user, password).encode(),
+            "Content-Type": "application/json",
+        }
+        self.poolSize: int = poolSize
+        self.poolSizePerHost: int = poolSizePerHost
+        self.idleTimeout: float = idleTimeout
+        self.timeout = ClientTimeout(
+            total=None, connect=connectTimeout, sock_read=readTimeout
+        )
+        self.session: ClientSession | None = None
+        # requests currently holding a connection, and requests sent in total
+        self.active: int = 0
+        self.requests: int = 0
+
+    def get_session(self) -> ClientSession:
+        if self.session is None or self.session.closed:
+            connector = TCPConnector(
+                limit=self.poolSize,
+                limit_per_host=self.poolSizePerHost,
+                keepalive_timeout=self.idleTimeout,
+            )
+            self.session = aiohttp.ClientSession(
+                headers=self.headers, connector=connector, timeout=self.timeout
+            )
+        return self.session
+
+    async def post(self, payload) -> "BufferedResponse":
+        async with self.stream(payload) as response:
+            body: bytes = await response.read()
+            return BufferedResponse(response.status, response.headers, body)
+
+    @contextlib.asynccontextmanager
+    async def stream(self, payload):
+        # Yields the aiohttp response with its body not read yet. An already
+        # encoded payload (bytes) is sent unchanged.
+        data: bytes = payload if isinstance(payload, bytes) else dumps(payload)
+        self.active += 1
+        self.requests += 1
+        try:
+            async with self.get_session().post(self.url, data=data) as response:
+                yield response
+        finally:
+            self.active -= 1
+
+    async def close(self) -> None:
+        if self.session is not None and not self.session.closed:
+            await self.session.close()
+        self.session = None
+
+
+class BufferedResponse:
+    """A completely read response from bitcoind."""
+
+    def __init__(self, status: int, headers, body: bytes) -> None:
+        self.status: int = status
+        self.headers = headers
+        self.body: bytes = body
+
+    @property
+    def content_type(self) -> str:
+        contentType: str = self.headers.get("Content-Type", "application/json")
+        return contentType.split(";")[0].strip()
+
+    async def read(self) -> bytes:
+        return self.body
+
+    async def text(self) -> str:
+        return self.body.decode("utf-8")
+
+    async def json(self):
+        return loads(self.body)
+
+
+async def read_prefix(content, size: int) -> bytes:
+    # Reads the first `size` bytes of a response body (fewer if it is shorter)
+    prefix: bytes = b""
+    while len(prefix) < size and not content.at_eof():
+        chunk: bytes = await content.read(size - len(prefix))
+        if not chunk:
+            break
+        prefix += chunk
+    return prefix
@@ -0,0 +1,211 @@
+import asyncio
+import time
+from collections import OrderedDict
+from bitcoinproxy.codec import dumps, loads
+from bitcoinproxy.log import LOG
+
+
+def outpoint_key(params) -> tuple[str, int, bool] | None:
+    # Returns (txid, vout, include_mempool) of a gettxout call, or None if the
+    # parameters are not the plain positional ones
+    if not isinstance(params, list) or not 2 <= len(params) <= 3:
+        return None
+    txid, vout = params[0], params[1]
+    includeMempool = params[2] if len(params) == 3 else True
+    if (
+        not isinstance(txid, str)
+        or not isinstance(vout, int)
+        or not isinstance(includeMempool, bool)
+    ):
+        return None
+    return txid, vout, includeMempool
+
+
+class TxOutCache:
+    """
+    Fast path for gettxout. Results are cached for at most `ttl` seconds and
+    only for the chain tip they were looked up at: the cache is cleared as soon
+    as a new block is seen, either by the chain tip watcher or in the
+    "bestblock" of a result. Results including the mempool can be up to `ttl`
+    seconds old.
+
+    A lookup that is not cached is sent to bitcoind right away if no other
+    lookup is in progress. Otherwise it is collected until the lookup in
+    progress is done, for at most `batchWindow` seconds, and sent in one batch
+    of at most `maxBatch` calls. Concurrent lookups of the same outpoint share
+    one call.
+    """
+
+    def __init__(
+        self,
+        proxy,
+        ttl: float = 5.0,
+        maxBytes: int = 8 * 1024 * 1024,
+        batchWindow: float = 0.002,
+        maxBatch: int = 100,
+    ) -> None:
+        self.proxy = proxy
+        self.ttl: float = ttl
+        self.maxBytes: int = maxBytes
+        self.batchWindow: float = batchWindow
+        self.maxBatch: int = maxBatch
+        # outpoint -> (monotonic time stored, response body without id)
+        self.entries: OrderedDict[tuple, tuple[float, bytes]] = OrderedDict()
+        self.size: int = 0
+        self.tipHash: str | None = None
+        # Results of the lookups in progress are (status, body)
+        self.waiting: dict[tuple, asyncio.Future] = {}
+        self.queue: list[tuple] = []
+        # Batches sent to bitcoind and not answered yet
+        self.inFlight: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self.coalesced: int = 0
+        self.batches: int = 0
+        self.lookups: int = 0
+
+    async def get(self, key: tuple[str, int, bool]) -> tuple[int, bytes]:
+        # Returns the HTTP status and response body (with a null id) for the
+        # outpoint
+        entry = self.entries.get(key)
+        if entry is not None:
+            if time.monotonic() - entry[0] < self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return 200, entry[1]
+            self.remove(key)
+        self.misses += 1
+        future: asyncio.Future | None = self.waiting.get(key)
+        if future is not None:
+            self.coalesced += 1
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self.waiting[key] = future
+            self.queue.append(key)
+            if not self.inFlight or len(self.queue) >= self.maxBatch:
+                self.flush()
+            elif len(self.queue) == 1:
+                self.proxy.run_background(self.flush_later(), "gettxout batch")
+        # A client dropping its request does not cancel the lookup for others
+        return await asyncio.shield(future)
+
+    async def flush_later(self) -> None:
+        await asyncio.sleep(self.batchWindow)
+        self.flush()
+
+    def flush(self) -> None:
+        if not self.queue:
+            return
+        keys, self.queue = self.queue, []
+        self.inFlight += 1
+        self.proxy.run_background(self.lookup(keys), "gettxout batch")
+
+    async def lookup(self, keys: list[tuple]) -> None:
+        try:
+            await self.send(keys)
+        finally:
+            self.inFlight -= 1
+            # Lookups collected in the meantime go out now
+            self.flush()
+
+    async def send(self, keys: list[tuple]) -> None:
+        self.batches += 1
+        self.lookups += len(keys)
+        tipHash: str | None = self.tipHash
+        calls = [
+            {"jsonrpc": "1.0", "id": index, "method": "gettxout", "params": list(key)}
+            for index, key in enumerate(keys)
+        ]
+        try:
+            response = await self.proxy.forward_request(
+                "gettxout",
+                None,
+                self.proxy.get_backends().select(),
+                dumps(calls),
+            )
+            results = loads(await response.read())
+            if not isinstance(results, list) or len(results) != len(keys):
+                raise ValueError(f"unexpected batch response (HTTP {response.status})")
+        except Exception as e:
+            LOG.error("Error looking up gettxout batch: %s", e)
+            body: bytes = dumps(
+                {
+                    "result": None,
+                    "error": {"code": -32603, "message": str(e)},
+                    "id": None,
+                }
+            )
+            results = None
+        status: int = 500
+        if results is not None and self.tipHash == tipHash:
+            # A new block shows up in the results before the watcher sees it
+            bestBlocks: set = {
+                result["result"].get("bestblock")
+                for result in results
+                if isinstance(result.get("result"), dict)
+            }
+            if len(bestBlocks) == 1 and None not in bestBlocks:
+                tipHash = bestBlocks.pop()
+                self.new_tip(tipHash)
+        for index, key in enumerate(keys):
+            future: asyncio.Future = self.waiting.pop(key)
+            if results is not None:
+                result = results[index]
+                body = dumps(
+                    {
+                        "result": result.get("result"),
+                        "error": result.get("error"),
+                        "id": None,
+                    }
+                )
+                status = 200 if result.get("error") is None else 500
+                if status == 200 and self.is_current(result.get("result"), tipHash):
+                    self.put(key, body)
+            if not future.done():
+                future.set_result((status, body))
+
+    def is_current(self, result, tipHash: str | None) -> bool:
+        # Whether a result of a lookup at tipHash may be cached: the tip must not
+        # have changed since
+        if self.tipHash != tipHash:
+            return False
+        bestBlock = result.get("bestblock") if isinstance(result, dict) else None
+        return bestBlock is None or bestBlock == tipHash
+
+    def new_tip(self, tipHash: str) -> None:
+        if tipHash != self.tipHash:
+            self.tipHash = tipHash
+            self.clear()
+
+    def put(self, key: tuple, body: bytes) -> None:
+        if self.ttl <= 0 or len(body) > self.maxBytes:
+            return
+        self.remove(key)
+        self.entries[key] = (time.monotonic(), body)
+        self.size += len(body)
+        while self.size > self.maxBytes:
+            _, (_, evicted) = self.entries.popitem(last=False)
+            self.size -= len(evicted)
+            self.evictions += 1
+
+    def remove(self, key: tuple) -> None:
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+    def clear(self) -> None:
+        self.entries.clear()
+        self.size = 0
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "entries": len(self.entries),
+            "bytes": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "coalesced": self.coalesced,
+            "batches": self.batches,
+            "lookups": self.lookups,
+        }
@@ -0,0 +1,108 @@
+import fcntl
+import json
+import os
+import time
+from bitcoinproxy.blockstore import BLOCKHASH_PATTERN
+
+
+class WorkerCoordinator:
+    """
+    State shared by the worker processes of one proxy through files in a
+    common directory: which worker requested a pruned block from a peer, and
+    the metrics of every worker. A claim file is removed once its block has
+    been downloaded or the claim has expired.
+
+    All methods do blocking file I/O and are meant to be run in a thread.
+    """
+
+    def __init__(self, directory: str, workerId: int) -> None:
+        self.directory: str = directory
+        self.workerId: int = workerId
+
+    def claim_download(self, blockhash: str, interval: float) -> bool:
+        # Returns True if this worker may request the block from a peer, i.e.
+        # no other worker has claimed it within the last `interval` seconds.
+        # The claim file is locked while it is checked and updated.
+        if not BLOCKHASH_PATTERN.match(blockhash):
+            return True
+        fd = os.open(self.claim_path(blockhash), os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            claim = os.read(fd, 64).split()
+            now: float = time.time()
+            if len(claim) == 2:
+                owner, claimedAt = int(claim[0]), float(claim[1])
+                if owner != self.workerId and now - claimedAt < interval:
+                    return False
+            os.lseek(fd, 0, os.SEEK_SET)
+            os.ftruncate(fd, 0)
+            os.write(fd, f"{self.workerId} {now}".encode())
+            return True
+        finally:
+            os.close(fd)
+
+    def claim_path(self, blockhash: str) -> str:
+        return os.path.join(self.directory, blockhash + ".download")
+
+    def release_download(self, blockhash: str) -> None:
+        # Removes the claim of a block that has been downloaded
+        if not BLOCKHASH_PATTERN.match(blockhash):
+            return
+        try:
+            os.unlink(self.claim_path(blockhash))
+        except FileNotFoundError:
+            pass
+
+    def remove_expired_claims(self, interval: float) -> int:
+        # Removes the claims of downloads that were not completed within
+        # `interval` seconds and returns their number. Each claim is checked
+        # again while locked, as a worker may just have renewed it.
+        removed: int = 0
+        now: float = time.time()
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".download"):
+                continue
+            try:
+                if now - entry.stat().st_mtime < interval:
+                    continue
+                fd = os.open(entry.path, os.O_RDWR)
+            except FileNotFoundError:
+                continue
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                claim = os.read(fd, 64).split()
+                if len(claim) == 2 and now - float(claim[1]) < interval:
+                    continue
+                os.unlink(entry.path)
+                removed += 1
+            except (FileNotFoundError, ValueError):
+                continue
+            finally:
+                os.close(fd)
+        return removed
+
+    def metrics_path(self, workerId: int) -> str:
+        return os.path.join(self.directory, f"metrics-{workerId}.json")
+
+    def write_metrics(self, snapshot: dict) -> None:
+        path: str = self.metrics_path(self.workerId)
+        with open(path + ".tmp", "w") as metricsFile:
+            json.dump(snapshot, metricsFile)
+        os.replace(path + ".tmp", path)
+
+    def read_metrics(self) -> list[dict]:
+        # Latest metrics snapshots of all other workers
+        snapshots: list[dict] = []
+        ownPath: str = self.metrics_path(self.workerId)
+        for entry in os.scandir(self.directory):
+            if (
+                entry.name.startswith("metrics-")
+                and entry.name.endswith(".json")
+                and entry.path != ownPath
+            ):
+                try:
+                    with open(entry.path) as metricsFile:
+                        snapshots.append(json.load(metricsFile))
+                except (OSError, ValueError):
+                    continue
+        return snapshots
@@ -0,0 +1,57 @@
+import json
+import pytest_asyncio
+from benchmarks.fakebitcoind import FakeBitcoind
+from bitcoinproxy.log import LOG
+from bitcoinproxy.proxy import BTCProxy
+
+BLOCKHASH = "00000000000000000001ebc605622d5d8e5b7c7d3c1f2a0b9e8d7c6b5a493827"
+
+
+async def getblock_error(proxy):
+    # The error response of bitcoind for the pruned block BLOCKHASH
+    response = await proxy.forward_request("getblock", [BLOCKHASH])
+    assert json.loads(await response.text())["error"]["code"] == -1
+    return response
+
+
+@pytest_asyncio.fixture
+async def bitcoind_factory(aiohttp_server):
+    # Starts additional fake bitcoinds, e.g. for multiple backends
+    async def start() -> FakeBitcoind:
+        fake = FakeBitcoind()
+        server = await aiohttp_server(fake.create_app())
+        fake.host = server.host
+        fake.port = server.port
+        return fake
+
+    return start
+
+
+@pytest_asyncio.fixture
+async def bitcoind(bitcoind_factory):
+    return await bitcoind_factory()
+
+
+@pytest_asyncio.fixture
+async def proxy(bitcoind):
+    proxy = BTCProxy()
+    proxy.conf = {
+        "net": {
+            "dest_ip": bitcoind.host,
+            "dest_port": str(bitcoind.port),
+            "dest_user": "user",
+            "dest_pass": "pass",
+        },
+        "app": {"wait_for_download": "0"},
+    }
+    yield proxy
+    await proxy.cancel_background_tasks()
+    await proxy.close_upstream()
+    # Messages still queued would be written while the next test captures output
+    LOG.flush()
+
+
+@pytest_asyncio.fixture
+async def client(proxy, aiohttp_client):
+    # Test client sending JSON-RPC requests to the proxy under test
+    return await aiohttp_client(proxy.create_app())
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import time
+import pytest
+from conftest import BLOCKHASH
+from bitcoinproxy.admission import Lane, LaneFull
+
+
+@pytest.mark.asyncio
+async def test_lane_queues_and_rejects_calls():
+    lane = Lane("default", limit=1, maxQueue=1)
+    await lane.acquire()
+    waiting = asyncio.create_task(lane.acquire())
+    await asyncio.sleep(0)
+
+    with pytest.raises(LaneFull):
+        await lane.acquire()
+
+    lane.release()
+    await waiting
+    assert (lane.active, len(lane.waiters), lane.rejected) == (1, 0, 1)
+
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_does_not_keep_slot():
+    lane = Lane("default", limit=1)
+    await lane.acquire()
+    cancelled = asyncio.create_task(lane.acquire())
+    waiting = asyncio.create_task(lane.acquire())
+    await asyncio.sleep(0)
+    cancelled.cancel()
+
+    lane.release()
+    await waiting
+    assert lane.active == 1
+    lane.release()
+    assert lane.active == 0
+
+
+@pytest.mark.asyncio
+async def test_fast_calls_pass_saturated_lane(client, bitcoind, proxy):
+    proxy.conf["admission"] = {"method_limits": "uptime:1:1"}
+    lane = proxy.get_admission().lanes["uptime"]
+    # two uptime calls in progress or waiting already
+    await lane.acquire()
+    waiting = asyncio.create_task(lane.acquire())
+    await asyncio.sleep(0)
+
+    rejected = await client.post("/", json={"id": 3, "method": "uptime"})
+    fast = await client.post("/", json={"id": 4, "method": "getblockcount"})
+
+    assert rejected.status == 503
+    error = json.loads(await rejected.text())
+    assert (error["error"]["code"], error["id"]) == (-32000, 3)
+    assert json.loads(await fast.text())["result"] == bitcoind.height
+    assert proxy.admission.rejected()[("uptime",)] == 1
+    waiting.cancel()
+
+
+@pytest.mark.asyncio
+async def test_default_lane_leaves_room_in_upstream_pool(proxy):
+    assert proxy.get_admission().lanes["default"].limit == 50
+
+    proxy.admission = None
+    proxy.conf["net"]["pool_size"] = "10"
+    assert proxy.get_admission().lanes["default"].limit == 5
+
+
+@pytest.mark.asyncio
+async def test_rejected_recovery_gives_503(client, bitcoind, proxy):
+    bitcoind.blocks[BLOCKHASH] = "00ff"
+    bitcoind.pruned.add(BLOCKHASH)
+    proxy.conf["admission"] = {"recovery_limit": "1", "recovery_queue": "1"}
+    lane = proxy.get_admission().lanes["recovery"]
+    await lane.acquire()
+    waiting = asyncio.create_task(lane.acquire())
+    await asyncio.sleep(0)
+
+    response = await client.post(
+        "/", json={"id": 5, "method": "getblock", "params": [BLOCKHASH, 0]}
+    )
+
+    assert response.status == 503
+    error = json.loads(await response.text())
+    assert (error["error"]["code"], error["id"]) == (-32000, 5)
+    waiting.cancel()
+
+
+@pytest.mark.asyncio
+async def test_waiting_recoveries_do_not_hold_default_lane(client, bitcoind, proxy):
+    proxy.conf["net"]["pool_size"] = "4"
+    proxy.conf["app"]["wait_for_download"] = "2"
+    bitcoind.downloadDelay = 60
+    blockhashes = [BLOCKHASH, "c" * 64, "d" * 64]
+    for blockhash in blockhashes:
+        bitcoind.blocks[blockhash] = "00ff"
+        bitcoind.pruned.add(blockhash)
+    recoveries = [
+        asyncio.create_task(
+            client.post("/", json={"method": "getblock", "params": [blockhash, 0]})
+        )
+        for blockhash in blockhashes
+    ]
+    # more recoveries waiting for downloads than the default lane has slots
+    for _ in range(100):
+        if len(proxy.blockRecoveries) == len(blockhashes):
+            break
+        await asyncio.sleep(0.01)
+
+    startTime = time.perf_counter()
+    response = await client.post("/", json={"id": 6, "method": "uptime"})
+
+    assert time.perf_counter() - startTime < 1
+    assert json.loads(await response.text())["error"] is None
+    assert proxy.admission.lanes["default"].active == 0
+    for recovery in recoveries + list(proxy.blockRecoveries.values()):
+        recovery.cancel()
+    await asyncio.gather(*recoveries, return_exceptions=True)
@@ -0,0 +1,101 @@
+import json
+import socket
+import pytest
+
+BLOCKHASH = "0000000000000000000000000000000000000000000000000000000000000032"
+
+
+def backend_section(bitcoind, **options) -> dict:
+    return {"dest_ip": bitcoind.host, "dest_port": str(bitcoind.port), **options}
+
+
+def unused_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.mark.asyncio
+async def test_pruned_block_is_served_by_archival_backend(
+    client, bitcoind, bitcoind_factory, proxy
+):
+    archival = await bitcoind_factory()
+    archival.blocks[BLOCKHASH] = "00ff"
+    bitcoind.pruned.add(BLOCKHASH)
+    bitcoind.pruneHeight = 80
+    proxy.conf["net"]["health_check_interval"] = "0"
+    proxy.conf["backend:pruned"] = backend_section(bitcoind)
+    proxy.conf["backend:archival"] = backend_section(archival, role="archival")
+
+    response = await client.post(
+        "/", json={"method": "getblock", "params": [BLOCKHASH, 0]}
+    )
+
+    assert json.loads(await response.text())["result"] == "00ff"
+    assert bitcoind.calls_of("getblockfrompeer") == []
+    assert proxy.backendBlockFallbacks.values[()] == 1
+
+
+@pytest.mark.asyncio
+async def test_health_checks_skip_lagging_and_unreachable_backends(
+    bitcoind, bitcoind_factory, proxy
+):
+    lagging = await bitcoind_factory()
+    lagging.height = 90
+    proxy.conf["net"]["health_check_interval"] = "0"
+    proxy.conf["backend:down"] = {"dest_ip": "127.0.0.1", "dest_port": unused_port()}
+    proxy.conf["backend:lagging"] = backend_section(lagging)
+    proxy.conf["backend:synced"] = backend_section(bitcoind)
+    backends = proxy.get_backends()
+
+    await backends.check_all()
+
+    assert [backend.healthy for backend in backends.backends] == [False, False, True]
+    assert backends.primary().name == "synced"
+    assert backends.select().name == "synced"
+
+
+@pytest.mark.asyncio
+async def test_calls_fail_over_to_next_backend(bitcoind, proxy):
+    proxy.conf["net"]["health_check_interval"] = "0"
+    proxy.conf["backend:down"] = {"dest_ip": "127.0.0.1", "dest_port": unused_port()}
+    proxy.conf["backend:up"] = backend_section(bitcoind)
+
+    response = await proxy.forward_request("uptime", [])
+
+    assert (await response.json())["result"] == "uptime"
+    assert proxy.get_backends().primary().name == "up"
+
+
+@pytest.mark.asyncio
+async def test_client_calls_fail_over_to_next_backend(client, bitcoind, proxy):
+    proxy.conf["net"]["health_check_interval"] = "0"
+    proxy.conf["backend:down"] = {"dest_ip": "127.0.0.1", "dest_port": unused_port()}
+    proxy.conf["backend:up"] = backend_section(bitcoind)
+    calls = [
+        {"id": 1, "method": "uptime"},
+        [{"id": 2, "method": "uptime"}],
+        {"id": 3, "method": "gettxout", "params": ["ab" * 32, 0]},
+    ]
+
+    for call in calls:
+        response = await client.post("/", json=call)
+        proxy.get_backends().backends[0].healthy = True
+        reply = json.loads(await response.text())
+        assert response.status == 200
+        assert [
+            r["error"] for r in (reply if isinstance(reply, list) else [reply])
+        ] == [None]
+
+    assert proxy.get_backends().backends[0].failures == 3
+
+
+@pytest.mark.asyncio
+async def test_unreachable_backend_gives_jsonrpc_error(client, proxy):
+    proxy.conf["net"]["dest_port"] = unused_port()
+
+    response = await client.post("/", json={"id": 5, "method": "uptime"})
+
+    assert response.status == 500
+    reply = json.loads(await response.text())
+    assert (reply["id"], reply["error"]["code"]) == (5, -32603)
@@ -0,0 +1,47 @@
+import json
+import pytest
+
+PRUNED = "a" * 64
+AVAILABLE = "b" * 64
+
+
+@pytest.mark.asyncio
+async def test_batch_results_keep_order_and_ids(client, bitcoind, proxy):
+    bitcoind.blocks.update({PRUNED: "00aa", AVAILABLE: "00bb"})
+    bitcoind.pruned.add(PRUNED)
+    proxy.conf["app"].update({"wait_for_download": "2", "wait_mode": "poll"})
+    batch = [
+        {"jsonrpc": "1.0", "id": "count", "method": "getblockcount", "params": []},
+        {"jsonrpc": "1.0", "id": 7, "method": "getblock", "params": [PRUNED, 0]},
+        {"jsonrpc": "1.0", "id": 8, "method": "getblock", "params": [AVAILABLE, 0]},
+        {"jsonrpc": "1.0", "id": "hash", "method": "getblockhash", "params": [1000]},
+        "not a call",
+    ]
+
+    response = await client.post("/", json=batch)
+    results = json.loads(await response.text())
+
+    assert [result["id"] for result in results] == ["count", 7, 8, "hash", None]
+    assert results[0]["result"] == 100
+    assert results[1]["result"] == "00aa"
+    assert results[2]["result"] == "00bb"
+    assert results[3]["error"]["code"] == -8
+    assert results[4]["error"]["code"] == -32600
+    # getblockcount and getblockhash were forwarded as one batch
+    assert bitcoind.batches == [2]
+    assert len(bitcoind.calls_of("getblockfrompeer")) == 1
+    assert proxy.requestCounter == 5
+
+
+@pytest.mark.asyncio
+async def test_batch_of_only_getblock_calls_needs_no_upstream_batch(client, bitcoind):
+    bitcoind.blocks[AVAILABLE] = "00bb"
+    batch = [
+        {"id": n, "method": "getblock", "params": [AVAILABLE, 0]} for n in range(3)
+    ]
+
+    response = await client.post("/", json=batch)
+    results = json.loads(await response.text())
+
+    assert [result["result"] for result in results] == ["00bb"] * 3
+    assert bitcoind.batches == []
@@ -0,0 +1,26 @@
+import pytest
+from benchmarks.run import compare, parse_args, run_scenario
+from benchmarks.scenarios import SCENARIOS
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("name", list(SCENARIOS))
+async def test_scenarios_run_without_errors(name):
+    options = parse_args(
+        ["--requests", "20", "--concurrency", "4", "--block-size", "1000"]
+    )
+    options.prune_every = 3
+
+    result = await run_scenario(SCENARIOS[name], options)
+
+    assert (result["scenario"], result["requests"], result["errors"]) == (name, 20, 0)
+    assert 0 < result["p50_ms"] <= result["p99_ms"]
+
+
+def test_compare_reports_regressions():
+    baseline = [{"scenario": "rescan", "throughput": 100.0, "p99_ms": 50.0}]
+    results = [{"scenario": "rescan", "throughput": 80.0, "p99_ms": 52.0}]
+
+    assert compare(results, baseline, 0.1) == [
+        "rescan: throughput 80.0/s (baseline 100.0/s)"
+    ]
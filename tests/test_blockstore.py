@@ -0,0 +1,101 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from bitcoinproxy.blockstore import BlockStore
+
+HASH_A = "a" * 64
+HASH_B = "b" * 64
+HASH_C = "c" * 64
+
+
+def test_blockstore_roundtrip_and_reload(tmp_path):
+    store = BlockStore(str(tmp_path), maxBytes=100)
+    store.load()
+    store.put(HASH_A, "00ff10")
+    assert os.path.getsize(store.path(HASH_A)) == 3
+    assert store.get_hex(HASH_A) == "00ff10"
+    assert store.get_hex(HASH_B) is None
+
+    reloaded = BlockStore(str(tmp_path), maxBytes=100)
+    reloaded.load()
+    assert HASH_A in reloaded
+    assert reloaded.size == 3
+
+
+def test_blockstore_evicts_least_recently_used_unpinned(tmp_path):
+    store = BlockStore(str(tmp_path), maxBytes=4, pinned=[HASH_A])
+    store.load()
+    store.put(HASH_A, "0000")
+    store.put(HASH_B, "0000")
+    store.put(HASH_C, "0000")
+    assert HASH_A in store
+    assert HASH_B not in store
+    assert not os.path.exists(store.path(HASH_B))
+    assert store.evictions == 1
+
+
+def test_blockstore_is_used_from_several_threads(tmp_path):
+    store = BlockStore(str(tmp_path), maxBytes=8)
+    store.load()
+    hashes = [f"{number:064x}" for number in range(8)]
+
+    def use(offset: int) -> None:
+        for round in range(200):
+            blockhash = hashes[(offset + round) % len(hashes)]
+            store.put(blockhash, "0000")
+            store.get_hex(blockhash)
+
+    with ThreadPoolExecutor(4) as executor:
+        list(executor.map(use, range(4)))
+
+    assert store.size == sum(store.index.values()) <= 8
+    assert sorted(os.listdir(tmp_path)) == sorted(
+        blockhash + ".blk" for blockhash in store.index
+    )
+
+
+def test_shared_blockstore_keeps_one_budget(tmp_path):
+    first = BlockStore(str(tmp_path), maxBytes=4, shared=True)
+    second = BlockStore(str(tmp_path), maxBytes=4, shared=True)
+    first.load()
+    second.load()
+
+    first.put(HASH_A, "0000")
+    second.put(HASH_B, "0000")
+    second.put(HASH_C, "0000")
+
+    # blocks stored by another worker are found on disk
+    assert first.get_hex(HASH_C) == "0000"
+    assert first.get_hex(HASH_A) is None
+    assert sorted(name for name in os.listdir(tmp_path) if name.endswith(".blk")) == [
+        HASH_B + ".blk",
+        HASH_C + ".blk",
+    ]
+
+
+def test_blockstore_rejects_invalid_hashes(tmp_path):
+    store = BlockStore(str(tmp_path), maxBytes=100)
+    store.load()
+    store.put("../../etc/passwd", "00")
+    assert store.size == 0
+
+
+@pytest.mark.asyncio
+async def test_recovered_block_is_served_from_store(client, bitcoind, proxy, tmp_path):
+    proxy.conf["blockstore"] = {"blockstore_dir": str(tmp_path)}
+    proxy.conf["cache"] = {"cache_size_mb": "0"}
+    bitcoind.blocks[HASH_A] = "00ff"
+    bitcoind.pruned.add(HASH_A)
+    proxy.conf["app"].update({"wait_for_download": "5", "wait_mode": "poll"})
+
+    for _ in range(2):
+        response = await client.post(
+            "/", json={"method": "getblock", "params": [HASH_A, 0]}
+        )
+        assert json.loads(await response.text())["result"] == "00ff"
+        # bitcoind prunes the block again
+        bitcoind.pruned.add(HASH_A)
+
+    assert len(bitcoind.calls_of("getblockfrompeer")) == 1
+    assert proxy.blockStore.hits == 1
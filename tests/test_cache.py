@@ -0,0 +1,73 @@
+import json
+import pytest
+from bitcoinproxy.cache import ResponseCache, cache_key
+
+BLOCKHASH = "00000000000000000001ebc605622d5d8e5b7c7d3c1f2a0b9e8d7c6b5a493827"
+
+
+def test_cache_evicts_least_recently_used():
+    cache = ResponseCache(maxBytes=10)
+    cache.put("a", b"1234")
+    cache.put("b", b"1234")
+    assert cache.get("a") == b"1234"
+    cache.put("c", b"1234")
+    assert cache.get("b") is None
+    assert cache.get("a") == b"1234"
+    assert cache.stats() == {
+        "entries": 2,
+        "bytes": 8,
+        "hits": 2,
+        "misses": 1,
+        "evictions": 1,
+    }
+
+
+def test_cache_skips_oversized_entries():
+    cache = ResponseCache(maxBytes=3)
+    cache.put("a", b"1234")
+    assert len(cache) == 0
+
+
+async def rpc(client, method, params):
+    response = await client.post("/", json={"method": method, "params": params})
+    assert response.status == 200
+    return json.loads(await response.text())
+
+
+@pytest.mark.asyncio
+async def test_raw_getblock_is_served_from_cache(client, bitcoind, proxy):
+    bitcoind.blocks[BLOCKHASH] = "00ff"
+    for _ in range(3):
+        assert (await rpc(client, "getblock", [BLOCKHASH, 0]))["result"] == "00ff"
+    assert len(bitcoind.calls_of("getblock")) == 1
+    assert proxy.responseCache.hits == 2
+
+
+@pytest.mark.asyncio
+async def test_verbose_getblock_is_not_cached(client, bitcoind, proxy):
+    bitcoind.blocks[BLOCKHASH] = "00ff"
+    await rpc(client, "getblock", [BLOCKHASH, 1])
+    await rpc(client, "getblock", [BLOCKHASH, 1])
+    assert len(bitcoind.calls_of("getblock")) == 2
+
+
+@pytest.mark.asyncio
+async def test_only_deep_getblockhash_is_cached(client, bitcoind, proxy):
+    # Without a known tip, nothing can be considered buried
+    await rpc(client, "getblockhash", [10])
+    assert len(proxy.responseCache) == 0
+
+    await rpc(client, "getblockcount", [])
+    assert proxy.tipHeight == 100
+    for height in (10, 10, 99, 99):
+        await rpc(client, "getblockhash", [height])
+    assert bitcoind.calls_of("getblockhash") == [[10], [10], [99], [99]]
+    assert cache_key("getblockhash", [10]) in proxy.responseCache.entries
+
+
+@pytest.mark.asyncio
+async def test_errors_are_not_cached(client, bitcoind, proxy):
+    await rpc(client, "getblockcount", [])
+    bitcoind.height = 5
+    await rpc(client, "getblockhash", [50])
+    assert len(proxy.responseCache) == 0
@@ -0,0 +1,69 @@
+import asyncio
+import json
+import pytest
+from bitcoinproxy.cache import cache_key
+
+
+async def wait_until(condition, timeout: float = 2.0) -> None:
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("condition not met")
+
+
+async def call(client, method, params, callId=1):
+    response = await client.post(
+        "/", json={"id": callId, "method": method, "params": params}
+    )
+    return json.loads(await response.text())
+
+
+@pytest.mark.asyncio
+async def test_tip_calls_are_answered_from_watcher(client, bitcoind, proxy):
+    await call(client, "getblockcount", [])
+    await wait_until(lambda: proxy.chainTip.is_fresh())
+    forwarded = len(bitcoind.calls)
+
+    count = await call(client, "getblockcount", [], "a")
+    best = await call(client, "getbestblockhash", [])
+    info = await call(client, "getblockchaininfo", [], "b")
+    bitcoind.mine()
+    await wait_until(lambda: proxy.chainTip.height == 101)
+    blockhash = await call(client, "getblockhash", [101])
+
+    assert (count["result"], count["id"]) == (100, "a")
+    assert best["result"] == bitcoind.hash_of(100)
+    assert (info["result"]["blocks"], info["id"]) == (100, "b")
+    assert blockhash["result"] == bitcoind.hash_of(101)
+    clientCalls = ("getblockcount", "getbestblockhash", "getblockhash")
+    assert not [m for (m, _) in bitcoind.calls[forwarded:] if m in clientCalls]
+
+
+@pytest.mark.asyncio
+async def test_reorg_invalidates_replaced_heights(client, bitcoind, proxy):
+    proxy.conf["chaintip"] = {"tip_mode": "poll", "tip_poll_interval": "0.01"}
+    await call(client, "getblockcount", [])
+    await wait_until(lambda: proxy.chainTip.is_fresh())
+    bitcoind.mine(2)
+    await wait_until(lambda: proxy.chainTip.height == 102)
+    oldHash = proxy.chainTip.hashes[101]
+    proxy.responseCache.put(cache_key("getblockhash", [90]), b"90")
+    proxy.responseCache.put(cache_key("getblockhash", [101]), b"101")
+
+    bitcoind.mine(reorgDepth=2)
+    await wait_until(lambda: proxy.chainTip.height == 103)
+
+    assert proxy.chainTip.reorgs == 1
+    assert proxy.chainTip.hashes[101] == bitcoind.hash_of(101) != oldHash
+    assert proxy.chainTip.hashes[100] == bitcoind.hash_of(100)
+    assert cache_key("getblockhash", [101]) not in proxy.responseCache.entries
+    assert cache_key("getblockhash", [90]) in proxy.responseCache.entries
+    result = await call(client, "getblockhash", [102])
+    assert result["result"] == bitcoind.hash_of(102)
+
+
+@pytest.mark.asyncio
+async def test_only_first_worker_long_polls(proxy):
+    proxy.workerId = 1
+    assert proxy.get_chain_tip().mode == "poll"
@@ -0,0 +1,34 @@
+import json
+import pytest
+from bitcoinproxy.codec import with_id
+
+BLOCKHASH = "c" * 64
+
+
+def test_with_id_replaces_response_id():
+    body = b'{"result":{"id":1},"error":null,"id":null}\n'
+    assert with_id(body, "abc") == b'{"result":{"id":1},"error":null,"id":"abc"}\n'
+    assert with_id(body, None) is body
+    assert with_id(b"[]", 1) == b"[]"
+
+
+@pytest.mark.asyncio
+async def test_request_ids_are_kept(client, bitcoind):
+    bitcoind.blocks[BLOCKHASH] = "00ff"
+    request = b'{"jsonrpc":"1.0","id":"first","method":"getblock","params":["%s",0]}'
+
+    first = await client.post("/", data=request % BLOCKHASH.encode())
+    second = await client.post(
+        "/", json={"id": 7, "method": "getblock", "params": [BLOCKHASH, 0]}
+    )
+    uptime = await client.post("/", json={"id": 8, "method": "uptime", "params": []})
+
+    assert json.loads(await first.text()) == {
+        "result": "00ff",
+        "error": None,
+        "id": "first",
+    }
+    # served from the response cache
+    assert json.loads(await second.text())["id"] == 7
+    assert len(bitcoind.calls_of("getblock")) == 1
+    assert json.loads(await uptime.text())["id"] == 8
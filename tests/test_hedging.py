@@ -0,0 +1,61 @@
+import asyncio
+import json
+import pytest
+from conftest import BLOCKHASH, getblock_error
+from bitcoinproxy.downloads import DOWNLOADED
+
+PEERS = [
+    {"id": 1, "addr": "127.0.0.2:8333"},
+    {"id": 2, "addr": "127.0.0.3:8333"},
+    {"id": 3, "addr": "127.0.0.4:8333"},
+]
+
+
+def setup_slow_peers(proxy, bitcoind, **hedging):
+    bitcoind.blocks[BLOCKHASH] = "00ff"
+    bitcoind.pruned.add(BLOCKHASH)
+    bitcoind.peers = PEERS
+    bitcoind.downloadDelay = 60
+    proxy.conf["app"].update({"wait_for_download": "3", "wait_mode": "poll"})
+    proxy.conf["hedging"] = {"hedge_delay": "0.1", **hedging}
+
+
+@pytest.mark.asyncio
+async def test_hedge_wins_when_first_peer_is_slow(proxy, bitcoind):
+    setup_slow_peers(proxy, bitcoind, hedge_max_per_block="2")
+    errorResponse = await getblock_error(proxy)
+    # only the first hedge's peer delivers
+    proxy.get_peer_scoreboard().exploration = 0
+    firstPeer = proxy.get_peer_scoreboard().select(PEERS)["id"]
+    hedgePeer = proxy.get_peer_scoreboard().select(PEERS, {firstPeer})["id"]
+    bitcoind.peerDelays[hedgePeer] = 0.05
+
+    response = await proxy.handle_getblock_error([BLOCKHASH], errorResponse)
+
+    assert json.loads(await response.text())["result"] == "00ff"
+    peersTried = [params[1] for params in bitcoind.calls_of("getblockfrompeer")]
+    assert peersTried == [firstPeer, hedgePeer]
+    download = proxy.downloadBlockHashes[BLOCKHASH]
+    assert (download.state, download.hedges) == (DOWNLOADED, 1)
+    assert proxy.hedger.wins == {1: 1}
+    assert proxy.hedger.inFlight == 0 and proxy.hedger.tasks == {}
+    await asyncio.sleep(0.3)
+    assert len(bitcoind.calls_of("getblockfrompeer")) == 2
+
+
+@pytest.mark.asyncio
+async def test_hedges_stop_at_caps(proxy, bitcoind):
+    setup_slow_peers(proxy, bitcoind, hedge_max_per_block="3", hedge_max_in_flight="1")
+    proxy.conf["app"]["wait_for_download"] = "1"
+    errorResponse = await getblock_error(proxy)
+
+    response = await proxy.handle_getblock_error([BLOCKHASH], errorResponse)
+    getblockCalls = len(bitcoind.calls_of("getblock"))
+    await asyncio.sleep(0.3)
+
+    assert json.loads(await response.text())["result"] is None
+    assert len(bitcoind.calls_of("getblockfrompeer")) == 2
+    assert proxy.hedger.stats()["capped"] == 2
+    # the hedge task has ended without the block and stopped polling
+    assert proxy.hedger.tasks == {} and proxy.hedger.inFlight == 0
+    assert len(bitcoind.calls_of("getblock")) == getblockCalls
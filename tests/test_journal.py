@@ -0,0 +1,103 @@
+import asyncio
+import json
+import time
+import pytest
+from bitcoinproxy.journal import (
+    DOWNLOADED,
+    FAILED,
+    PEER,
+    PENDING,
+    REQUESTED,
+    DownloadJournal,
+)
+
+
+def test_load_replays_and_compacts(tmp_path):
+    path = str(tmp_path / "journal" / "downloads.jsonl")
+    journal = DownloadJournal(path, maxAge=60)
+    journal.load()
+    journal.open()
+    journal.record(REQUESTED, "aa", "1.1.1.1:8333")
+    journal.record(DOWNLOADED, "aa", "1.1.1.1:8333", 2.0)
+    journal.record(REQUESTED, "bb", "2.2.2.2:8333")
+    journal.record(FAILED, "bb", "2.2.2.2:8333")
+    journal.record(REQUESTED, "bb", "1.1.1.1:8333")
+    journal.close()
+    with open(path, "a") as journalFile:
+        journalFile.write('{"t": 1, "e": "requ')
+
+    pending, peers = DownloadJournal(path, maxAge=60).load()
+    again, peersAgain = DownloadJournal(path, maxAge=60).load()
+
+    assert list(pending) == list(again) == ["bb"]
+    assert pending["bb"]["p"] == "1.1.1.1:8333"
+    stats = peers["1.1.1.1:8333"]
+    assert (stats.attempts, stats.successes, stats.failures) == (2, 1, 0)
+    assert stats.latency == peersAgain["1.1.1.1:8333"].latency == 2.0
+    assert peersAgain["2.2.2.2:8333"].failures == 1
+    with open(path) as journalFile:
+        events = [json.loads(line)["e"] for line in journalFile]
+    assert events == [PEER, PEER, PENDING]
+
+
+def test_old_downloads_are_not_resumed(tmp_path):
+    path = str(tmp_path / "downloads.jsonl")
+    with open(path, "w") as journalFile:
+        entry = {"t": time.time() - 120, "e": REQUESTED, "h": "aa", "p": "x"}
+        journalFile.write(json.dumps(entry) + "\n")
+
+    pending, peers = DownloadJournal(path, maxAge=60).load()
+
+    assert pending == {} and peers["x"].attempts == 1
+
+
+@pytest.mark.asyncio
+async def test_pending_downloads_resume_on_startup(
+    tmp_path, bitcoind, proxy, aiohttp_client
+):
+    prunedHash = bitcoind.hash_of(90)
+    availableHash = bitcoind.hash_of(91)
+    bitcoind.blockSize = 100
+    bitcoind.pruned.add(prunedHash)
+    path = str(tmp_path / "downloads.jsonl")
+    with open(path, "w") as journalFile:
+        for blockhash in (prunedHash, availableHash):
+            entry = {"t": time.time(), "e": REQUESTED, "h": blockhash, "p": "y"}
+            journalFile.write(json.dumps(entry) + "\n")
+    proxy.conf["journal"] = {"journal_file": path}
+
+    await aiohttp_client(proxy.create_app())
+    for _ in range(200):
+        if bitcoind.calls_of("getblockfrompeer"):
+            break
+        await asyncio.sleep(0.01)
+
+    assert [p[0] for p in bitcoind.calls_of("getblockfrompeer")] == [prunedHash]
+    assert proxy.get_peer_scoreboard().history["y"].attempts == 2
+    proxy.journal.close()
+    pending, _ = DownloadJournal(path).load()
+    assert list(pending) == [prunedHash]
+    assert pending[prunedHash]["p"] == bitcoind.peers[0]["addr"]
+
+
+@pytest.mark.asyncio
+async def test_only_first_worker_resumes_downloads(
+    tmp_path, bitcoind, proxy, aiohttp_client
+):
+    path = str(tmp_path / "downloads.jsonl")
+    with open(path, "w") as journalFile:
+        entry = {"t": time.time(), "e": REQUESTED, "h": "aa", "p": "y"}
+        journalFile.write(json.dumps(entry) + "\n")
+    proxy.conf["journal"] = {"journal_file": path}
+    proxy.journalState = proxy.make_journal().load()
+    proxy.workerId = 1
+
+    await aiohttp_client(proxy.create_app())
+    await asyncio.sleep(0.1)
+    proxy.journal_record(REQUESTED, "bb", "z")
+    proxy.journal.close()
+
+    assert bitcoind.calls_of("getblockfrompeer") == []
+    assert proxy.get_peer_scoreboard().history["y"].attempts == 1
+    pending, _ = DownloadJournal(path).load()
+    assert list(pending) == ["aa", "bb"]
@@ -0,0 +1,56 @@
+import asyncio
+import json
+import os
+import signal
+import socket
+import aiohttp
+import pytest
+
+
+def unused_port() -> str:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return str(sock.getsockname()[1])
+
+
+@pytest.mark.asyncio
+async def test_sigterm_drains_requests_in_flight(bitcoind, proxy):
+    proxy.conf["net"].update({"listen_ip": "127.0.0.1", "listen_port": unused_port()})
+    url = f"http://127.0.0.1:{proxy.conf['net']['listen_port']}/"
+    server = asyncio.create_task(proxy.serve())
+    async with aiohttp.ClientSession() as session:
+        for _ in range(100):
+            try:
+                async with session.post(url, json={"method": "uptime"}):
+                    break
+            except aiohttp.ClientConnectionError:
+                await asyncio.sleep(0.01)
+        bitcoind.rpcDelay = 0.3
+
+        async def slow_call():
+            async with session.post(url, json={"id": 7, "method": "uptime"}) as r:
+                return r.status, json.loads(await r.text())
+
+        call = asyncio.create_task(slow_call())
+        await asyncio.sleep(0.1)
+        os.kill(os.getpid(), signal.SIGTERM)
+        status, reply = await call
+        await asyncio.wait_for(server, 2)
+
+        assert (status, reply["id"], reply["result"]) == (200, 7, "uptime")
+        assert proxy.background_tasks == set()
+        with pytest.raises(aiohttp.ClientConnectionError):
+            async with session.post(url, json={"method": "uptime"}):
+                pass
+
+
+@pytest.mark.asyncio
+async def test_listen_error_is_raised(bitcoind, proxy):
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        sock.listen()
+        port = str(sock.getsockname()[1])
+        proxy.conf["net"].update({"listen_ip": "127.0.0.1", "listen_port": port})
+
+        with pytest.raises(OSError):
+            await proxy.serve()
@@ -0,0 +1,78 @@
+import json
+import time
+from bitcoinproxy.log import LOGGING
+
+
+class Unformattable:
+    def __str__(self):
+        raise AssertionError("disabled log message was formatted")
+
+
+def json_lines(output: str) -> list[dict]:
+    return [json.loads(line) for line in output.splitlines()]
+
+
+def test_disabled_levels_are_not_formatted(capsys):
+    log = LOGGING()
+    log.configure(level="info", format="json")
+    log.debug("never formatted %s", Unformattable())
+    log.info("block %s", "00ff")
+    log.flush()
+    lines = json_lines(capsys.readouterr().out)
+    assert [(line["level"], line["msg"]) for line in lines] == [("info", "block 00ff")]
+
+
+def test_repeated_messages_are_rate_limited(capsys):
+    log = LOGGING()
+    log.configure(level="debug", format="json", rateLimit=2, rateInterval=0.05)
+    for peer in range(5):
+        log.info("peer %d does not exist", peer)
+    log.info("other message")
+    time.sleep(0.1)
+    log.info("peer %d does not exist", 5)
+    log.flush()
+    messages = [line["msg"] for line in json_lines(capsys.readouterr().out)]
+    assert messages == [
+        "peer 0 does not exist",
+        "peer 1 does not exist",
+        "other message",
+        "3 similar messages were suppressed: peer %d does not exist",
+        "peer 5 does not exist",
+    ]
+
+
+def test_forked_process_gets_new_writer_and_console(capsys):
+    log = LOGGING()
+    log.configure(level="info", format="json")
+    log.console = object()
+    log.info("started")
+    writer, messages = log.writer, log.queue
+
+    log.reset_after_fork()
+
+    assert (log.writer, log.console) == (None, None)
+    assert log.queue is not messages
+    # stops the parent's writer thread, waiting on the old or the new queue
+    messages.put(None)
+    log.queue.put(None)
+    writer.join(timeout=5)
+    assert not writer.is_alive()
+
+
+def test_messages_beyond_queue_size_are_dropped_and_reported(capsys):
+    log = LOGGING()
+    log.configure(level="info", format="json", queueSize=3)
+    # the writer is not started, so nothing leaves the queue
+    log.start_writer = lambda: None
+    for block in range(5):
+        log.info("block %d", block)
+    del log.start_writer
+    log.start_writer()
+    log.flush()
+    messages = [line["msg"] for line in json_lines(capsys.readouterr().out)]
+    assert messages == [
+        "2 log messages were dropped, the log queue was full",
+        "block 0",
+        "block 1",
+        "block 2",
+    ]
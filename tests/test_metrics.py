@@ -0,0 +1,42 @@
+import pytest
+from bitcoinproxy.metrics import MetricsRegistry
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("latency_seconds", "Latency.", ("method",), (0.1, 1))
+    for value in (0.05, 0.5, 5):
+        histogram.observe(value, ("getblock",))
+    lines = registry.render().splitlines()
+    assert 'latency_seconds_bucket{method="getblock",le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{method="getblock",le="1"} 2' in lines
+    assert 'latency_seconds_bucket{method="getblock",le="+Inf"} 3' in lines
+    assert 'latency_seconds_count{method="getblock"} 3' in lines
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint(client, bitcoind, proxy):
+    blockhash = "a" * 64
+    bitcoind.blocks[blockhash] = "00ff"
+    bitcoind.pruned.add(blockhash)
+    proxy.conf["app"].update({"wait_for_download": "2", "wait_mode": "poll"})
+    await client.post("/", json={"method": "getblock", "params": [blockhash, 0]})
+    await client.post("/", json={"method": "getblock", "params": [blockhash, 0]})
+    await client.post("/", json={"method": "getblockhash", "params": [1000]})
+
+    response = await client.get("/metrics")
+    lines = (await response.text()).splitlines()
+
+    assert (
+        'btcproxy_request_duration_seconds_count{method="getblock",outcome="ok"} 2'
+        in lines
+    )
+    assert (
+        'btcproxy_request_duration_seconds_count{method="getblockhash",outcome="error"} 1'
+        in lines
+    )
+    assert "btcproxy_pruned_block_misses_total 1" in lines
+    assert 'btcproxy_block_recovery_seconds_count{outcome="recovered"} 1' in lines
+    assert 'btcproxy_cache_events_total{cache="response",event="hits"} 1' in lines
+    assert 'btcproxy_block_downloads{state="downloaded"} 1' in lines
+    assert 'btcproxy_upstream_connections_in_use{backend="default"} 0' in lines
@@ -0,0 +1,84 @@
+import asyncio
+import pytest
+from bitcoinproxy.peers import PeerInfoCache, PeerScoreboard
+
+
+def peer(peerId, **fields):
+    entry = {
+        "id": peerId,
+        "addr": f"10.0.0.{peerId}:8333",
+        "servicesnames": ["NETWORK", "WITNESS"],
+        "connection_type": "outbound-full-relay",
+        "network": "ipv4",
+        "minping": 0.05,
+    }
+    entry.update(fields)
+    return entry
+
+
+def test_ineligible_peers_are_never_selected():
+    scoreboard = PeerScoreboard(exploration=1.0)
+    peers = [
+        peer(1, servicesnames=["NETWORK_LIMITED", "WITNESS"]),
+        peer(2, connection_type="feeler"),
+        peer(3),
+    ]
+    for _ in range(20):
+        assert scoreboard.select(peers)["id"] == 3
+
+
+def test_fast_outbound_clearnet_peer_is_preferred():
+    scoreboard = PeerScoreboard(exploration=0.0)
+    peers = [
+        peer(1, network="onion", minping=0.8),
+        peer(2, connection_type="inbound"),
+        peer(3),
+    ]
+    assert scoreboard.select(peers)["id"] == 3
+    assert scoreboard.select(peers, exclude={3})["id"] == 2
+
+
+def test_history_moves_downloads_away_from_failing_peers():
+    scoreboard = PeerScoreboard(exploration=0.0)
+    peers = [peer(1), peer(2)]
+    scoreboard.record_request(peers[0]["addr"])
+    scoreboard.record_failure(peers[0]["addr"])
+    scoreboard.record_request(peers[1]["addr"])
+    scoreboard.record_success(peers[1]["addr"], 1.5)
+    assert scoreboard.select(peers)["id"] == 2
+    assert scoreboard.history[peers[1]["addr"]].latency == 1.5
+
+
+@pytest.mark.asyncio
+async def test_peer_info_cache_coalesces_refreshes():
+    fetches = []
+
+    async def fetch():
+        fetches.append(1)
+        await asyncio.sleep(0.01)
+        return [peer(1), peer(2)]
+
+    cache = PeerInfoCache(fetch, refreshInterval=30)
+    results = await asyncio.gather(*[cache.get() for _ in range(5)])
+    assert len(fetches) == 1
+    assert all(len(peers) == 2 for peers in results)
+
+    cache.invalidate(1)
+    assert [entry["id"] for entry in await cache.get()] == [2]
+    assert len(fetches) == 1
+
+
+@pytest.mark.asyncio
+async def test_recoveries_share_peer_snapshot(proxy, bitcoind):
+    bitcoind.peers = [
+        {"id": 1, "addr": "127.0.0.2:8333"},
+        {"id": 2, "addr": "127.0.0.3:8333"},
+    ]
+    bitcoind.disconnectedPeers.add(1)
+    proxy.conf["peers"] = {"peer_exploration": "0"}
+    for blockhash in ("a" * 64, "b" * 64):
+        await proxy.request_block_download(blockhash)
+    assert len(bitcoind.calls_of("getpeerinfo")) == 1
+    # peer 1 was reported as disconnected and dropped from the snapshot
+    assert [entry["id"] for entry in proxy.peerInfoCache.peers] == [2]
+    assert bitcoind.calls_of("getblockfrompeer")[-1] == ["b" * 64, 2]
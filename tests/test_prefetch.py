@@ -0,0 +1,86 @@
+import asyncio
+import json
+import pytest
+
+
+def blockhash(height: int) -> str:
+    return f"{height:064x}"
+
+
+async def getblock(client, proxy, height):
+    response = await client.post(
+        "/", json={"method": "getblock", "params": [blockhash(height), 0]}
+    )
+    await asyncio.gather(
+        *[
+            task
+            for task in proxy.background_tasks
+            if task.get_name().startswith("Prefetch")
+        ]
+    )
+    return json.loads(await response.text())
+
+
+@pytest.fixture
+def pruned_chain(bitcoind, proxy):
+    bitcoind.pruneHeight = 50
+    for height in range(101):
+        bitcoind.blocks[blockhash(height)] = "00ff"
+        if height < 50:
+            bitcoind.pruned.add(blockhash(height))
+    bitcoind.downloadDelay = 0.05
+    bitcoind.peers = [
+        {"id": peerId, "addr": f"127.0.0.{peerId}:8333"} for peerId in (1, 2, 3)
+    ]
+    proxy.conf["prefetch"] = {"prefetch_window": "3"}
+    proxy.conf["app"].update({"wait_for_download": "2", "wait_mode": "poll"})
+
+
+@pytest.mark.asyncio
+async def test_sequential_getblock_prefetches_next_blocks(
+    client, bitcoind, proxy, pruned_chain
+):
+    await getblock(client, proxy, 10)
+    assert bitcoind.calls_of("getblockhash") == []
+
+    await getblock(client, proxy, 11)
+    prefetched = [params[0] for params in bitcoind.calls_of("getblockfrompeer")[2:]]
+    assert prefetched == [blockhash(12), blockhash(13), blockhash(14)]
+    # spread across different peers
+    peers = [params[1] for params in bitcoind.calls_of("getblockfrompeer")[2:]]
+    assert len(set(peers)) == 3
+
+    await asyncio.sleep(0.1)
+    result = await getblock(client, proxy, 12)
+    assert result["result"] == "00ff"
+    assert proxy.prefetcher.hits == 1
+    assert proxy.prefetcher.stats()["issued"] == 4
+
+
+@pytest.mark.asyncio
+async def test_unpruned_blocks_are_not_prefetched(
+    client, bitcoind, proxy, pruned_chain
+):
+    await getblock(client, proxy, 60)
+    await getblock(client, proxy, 61)
+    assert bitcoind.calls_of("getblockfrompeer") == []
+    assert proxy.prefetcher.issued == 0
+
+
+@pytest.mark.asyncio
+async def test_known_heights_and_cache_hits_need_no_header_lookup(
+    client, bitcoind, proxy, pruned_chain
+):
+    await getblock(client, proxy, 60)
+    await getblock(client, proxy, 61)
+    await getblock(client, proxy, 10)
+    await getblock(client, proxy, 11)
+    headers = len(bitcoind.calls_of("getblockheader"))
+
+    # 12 was looked up for prefetching, 61 is served from the response cache
+    await asyncio.sleep(0.1)
+    await getblock(client, proxy, 12)
+    await getblock(client, proxy, 61)
+
+    assert len(bitcoind.calls_of("getblockheader")) == headers
+    assert proxy.prefetcher.hits == 1
@@ -39,7 +39,7 @@ def test_btcproxy_initialization():
     assert proxy.background_tasks == set()
     assert proxy.taskCounter == 0
     assert proxy.requestCounter == 0
-    assert proxy.downloadBlockHashes == set()
+    assert proxy.downloadBlockHashes == {}
     assert proxy.conf is None
     assert proxy.configFile is not None
 
@@ -0,0 +1,130 @@
+import asyncio
+import json
+import pytest
+from aiohttp import ClientConnectionError
+from conftest import BLOCKHASH, getblock_error
+from bitcoinproxy.downloads import DOWNLOADED, FAILED, PENDING
+from bitcoinproxy.log import LOG
+
+
+@pytest.mark.asyncio
+async def test_concurrent_recoveries_share_one_download(proxy, bitcoind):
+    bitcoind.blocks[BLOCKHASH] = "00ff"
+    bitcoind.pruned.add(BLOCKHASH)
+    proxy.conf["app"]["wait_for_download"] = "1"
+    errorResponse = await getblock_error(proxy)
+
+    responses = await asyncio.gather(
+        *[proxy.handle_getblock_error([BLOCKHASH], errorResponse) for _ in range(5)]
+    )
+
+    assert len(bitcoind.calls_of("getpeerinfo")) == 1
+    assert len(bitcoind.calls_of("getblockfrompeer")) == 1
+    assert len({id(response) for response in responses}) == 1
+    assert json.loads(await responses[0].text())["result"] == "00ff"
+    assert proxy.downloadBlockHashes[BLOCKHASH].state == DOWNLOADED
+    assert proxy.blockRecoveries == {}
+
+
+@pytest.mark.asyncio
+async def test_pending_download_is_not_requested_again(proxy, bitcoind):
+    bitcoind.blocks[BLOCKHASH] = "00ff"
+    bitcoind.pruned.add(BLOCKHASH)
+    bitcoind.downloadDelay = 60
+    errorResponse = await getblock_error(proxy)
+
+    for _ in range(3):
+        response = await proxy.handle_getblock_error([BLOCKHASH], errorResponse)
+        assert json.loads(await response.text())["result"] is None
+
+    assert len(bitcoind.calls_of("getblockfrompeer")) == 1
+    assert len(bitcoind.calls_of("getblock")) == 4
+    assert proxy.downloadBlockHashes[BLOCKHASH].state == PENDING
+
+
+@pytest.mark.asyncio
+async def test_failed_download_is_recorded(proxy, bitcoind):
+    bitcoind.blocks[BLOCKHASH] = "00ff"
+    bitcoind.pruned.add(BLOCKHASH)
+    bitcoind.peers = [{"id": 7, "addr": "127.0.0.3:8333"}]
+    bitcoind.disconnectedPeers.add(7)
+    errorResponse = await getblock_error(proxy)
+
+    await proxy.handle_getblock_error([BLOCKHASH], errorResponse)
+
+    assert proxy.downloadBlockHashes[BLOCKHASH].state == FAILED
+    assert proxy.downloadBlockHashes[BLOCKHASH].peerId == 7
+
+
+@pytest.mark.asyncio
+async def test_repeated_recovery_messages_are_rate_limited(
+    proxy, bitcoind, monkeypatch
+):
+    monkeypatch.setattr(LOG, "rateLimit", 1)
+    monkeypatch.setattr(LOG, "rates", {})
+    bitcoind.peers = [{"id": 7, "addr": "127.0.0.3:8333"}]
+    bitcoind.disconnectedPeers.add(7)
+
+    for blockhash in ("a" * 64, "b" * 64, "c" * 64):
+        await proxy.request_block_download(blockhash)
+
+    # one template for all blocks and peers, logged once and suppressed twice
+    rates = [rate for template, rate in LOG.rates.items() if "via peer" in template]
+    assert [rate[1:] for rate in rates] == [[1, 2]]
+
+
+@pytest.mark.asyncio
+async def test_poll_mode_returns_block_once_downloaded(proxy, bitcoind):
+    bitcoind.blocks[BLOCKHASH] = "00ff"
+    bitcoind.pruned.add(BLOCKHASH)
+    bitcoind.downloadDelay = 0.3
+    proxy.conf["app"].update({"wait_for_download": "10", "wait_mode": "poll"})
+    errorResponse = await getblock_error(proxy)
+
+    response = await proxy.handle_getblock_error([BLOCKHASH], errorResponse)
+
+    assert json.loads(await response.text())["result"] == "00ff"
+    download = proxy.downloadBlockHashes[BLOCKHASH]
+    assert download.state == DOWNLOADED
+    assert 0.3 <= download.fetchTime < 2
+
+
+@pytest.mark.asyncio
+async def test_poll_mode_switches_stalled_peer(proxy, bitcoind):
+    bitcoind.blocks[BLOCKHASH] = "00ff"
+    bitcoind.pruned.add(BLOCKHASH)
+    bitcoind.downloadDelay = 60
+    bitcoind.peers = [
+        {"id": 1, "addr": "127.0.0.2:8333"},
+        {"id": 2, "addr": "127.0.0.3:8333"},
+    ]
+    proxy.conf["app"].update(
+        {"wait_for_download": "1", "wait_mode": "poll", "peer_stall_timeout": "0.4"}
+    )
+    errorResponse = await getblock_error(proxy)
+
+    response = await proxy.handle_getblock_error([BLOCKHASH], errorResponse)
+
+    assert json.loads(await response.text())["result"] is None
+    peersTried = [params[1] for params in bitcoind.calls_of("getblockfrompeer")]
+    assert len(peersTried) >= 2
+    assert peersTried[0] != peersTried[1]
+
+
+@pytest.mark.asyncio
+async def test_failed_recovery_gives_jsonrpc_error(client, bitcoind, proxy):
+    bitcoind.blocks[BLOCKHASH] = "00ff"
+    bitcoind.pruned.add(BLOCKHASH)
+
+    async def backend_down(blockhash, exclude=frozenset()):
+        raise ClientConnectionError("Connection lost")
+
+    proxy.request_block_download = backend_down
+
+    response = await client.post(
+        "/", json={"id": 7, "method": "getblock", "params": [BLOCKHASH, 0]}
+    )
+
+    assert response.status == 500
+    reply = json.loads(await response.text())
+    assert (reply["id"], reply["error"]["code"]) == (7, -32603)
@@ -0,0 +1,83 @@
+import json
+import pytest
+from aiohttp import web
+from bitcoinproxy.proxy import STREAM_CHUNK_SIZE
+
+BLOCKHASH = "a" * 64
+
+
+@pytest.mark.asyncio
+async def test_large_block_is_streamed_and_cached(client, bitcoind, proxy):
+    blockHex = "00ff" * 1_000_000
+    bitcoind.blocks[BLOCKHASH] = blockHex
+    for _ in range(2):
+        response = await client.post(
+            "/", json={"method": "getblock", "params": [BLOCKHASH, 0]}
+        )
+        assert response.status == 200
+        assert response.content_type == "application/json"
+        assert json.loads(await response.read())["result"] == blockHex
+    assert len(bitcoind.calls_of("getblock")) == 1
+    assert proxy.responseCache.hits == 1
+
+
+@pytest.mark.asyncio
+async def test_uncached_block_is_streamed_without_buffering(
+    client, bitcoind, proxy, monkeypatch
+):
+    proxy.conf["cache"] = {"cache_size_mb": "0"}
+    blockHex = "00ff" * 500_000
+    bitcoind.blocks[BLOCKHASH] = blockHex
+    writes: list[int] = []
+    write = web.StreamResponse.write
+
+    async def record_write(self, data):
+        writes.append(len(data))
+        await write(self, data)
+
+    monkeypatch.setattr(web.StreamResponse, "write", record_write)
+
+    response = await client.post(
+        "/", json={"method": "getblock", "params": [BLOCKHASH, 1]}
+    )
+    body = await response.read()
+
+    assert json.loads(body)["result"] == blockHex
+    # written to the client chunk by chunk as it arrives from bitcoind
+    assert len(writes) > 1 and max(writes) <= STREAM_CHUNK_SIZE
+    assert sum(writes) == len(body)
+    assert len(proxy.responseCache) == 0
+
+
+@pytest.mark.asyncio
+async def test_generic_errors_pass_through_status(client, bitcoind):
+    response = await client.post("/", json={"method": "getblockhash", "params": [5000]})
+    assert response.status == 500
+    assert json.loads(await response.read())["error"]["code"] == -8
+
+
+@pytest.mark.asyncio
+async def test_pruned_block_error_still_triggers_recovery(client, bitcoind, proxy):
+    bitcoind.blocks[BLOCKHASH] = "00ff"
+    bitcoind.pruned.add(BLOCKHASH)
+    proxy.conf["app"].update({"wait_for_download": "2", "wait_mode": "poll"})
+    response = await client.post(
+        "/", json={"method": "getblock", "params": [BLOCKHASH, 0]}
+    )
+    assert json.loads(await response.read())["result"] == "00ff"
+    assert len(bitcoind.calls_of("getblockfrompeer")) == 1
+
+
+@pytest.mark.asyncio
+async def test_jsonrpc2_getblock_of_pruned_block_is_recovered(client, bitcoind, proxy):
+    # bitcoind 28+ answers JSON-RPC 2.0 errors with HTTP 200 and no "result"
+    bitcoind.blocks[BLOCKHASH] = "00ff"
+    bitcoind.pruned.add(BLOCKHASH)
+    proxy.conf["app"].update({"wait_for_download": "2", "wait_mode": "poll"})
+    response = await client.post(
+        "/",
+        json={"jsonrpc": "2.0", "id": 3, "method": "getblock", "params": [BLOCKHASH]},
+    )
+    reply = json.loads(await response.read())
+    assert (reply["result"], reply["id"]) == ("00ff", 3)
+    assert len(bitcoind.calls_of("getblockfrompeer")) == 1
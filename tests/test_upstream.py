@@ -0,0 +1,22 @@
+import pytest
+
+
+@pytest.mark.asyncio
+async def test_upstream_connection_is_reused(proxy, bitcoind):
+    for _ in range(10):
+        response = await proxy.forward_request("uptime", [])
+        assert (await response.json())["result"] == "uptime"
+    assert len(proxy.get_backends().backends) == 1
+    assert len(set(bitcoind.clientPorts)) == 1
+
+
+@pytest.mark.asyncio
+async def test_upstream_pool_settings_from_config(proxy):
+    proxy.conf["net"]["pool_size"] = "4"
+    proxy.conf["net"]["pool_idle_timeout"] = "30"
+    upstream = proxy.get_upstream()
+    session = upstream.get_session()
+    assert session.connector.limit == 4
+    assert upstream.idleTimeout == 30.0
+    await proxy.close_upstream()
+    assert upstream.session is None
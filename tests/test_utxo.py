@@ -0,0 +1,82 @@
+import asyncio
+import json
+import socket
+import pytest
+from bitcoinproxy.utxo import outpoint_key
+
+TXID = "ab" * 32
+
+
+def unused_port() -> str:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return str(sock.getsockname()[1])
+
+
+async def gettxout(client, params, callId=1):
+    response = await client.post(
+        "/", json={"id": callId, "method": "gettxout", "params": params}
+    )
+    return response.status, json.loads(await response.text())
+
+
+@pytest.mark.asyncio
+async def test_concurrent_lookups_are_batched_and_cached(client, bitcoind, proxy):
+    params = [[TXID, vout] for vout in range(4)] * 2
+
+    replies = await asyncio.gather(
+        *[gettxout(client, p, index) for index, p in enumerate(params)]
+    )
+    again = await gettxout(client, [TXID, 0], "x")
+
+    assert [status for status, _ in replies] == [200] * 8
+    assert [reply["id"] for _, reply in replies] == list(range(8))
+    assert replies[0][1]["result"]["bestblock"] == bitcoind.hash_of(100)
+    assert replies[1][1]["result"] is None
+    assert again[1]["id"] == "x" and again[1]["result"] == replies[0][1]["result"]
+    assert len(bitcoind.calls_of("gettxout")) == 4
+    # the first lookup is sent alone, the others wait for it and are batched
+    assert bitcoind.batches[0] == 1 and sum(bitcoind.batches) == 4
+    stats = proxy.txOutCache.stats()
+    assert (stats["hits"], stats["coalesced"]) == (1, 4)
+    assert stats["batches"] == len(bitcoind.batches)
+
+
+@pytest.mark.asyncio
+async def test_single_lookup_does_not_wait_for_batch_window(client, bitcoind, proxy):
+    proxy.conf["gettxout"] = {"gettxout_batch_window": "5"}
+
+    for vout in range(3):
+        await asyncio.wait_for(gettxout(client, [TXID, vout]), 1)
+
+    assert bitcoind.batches == [1, 1, 1]
+
+
+@pytest.mark.asyncio
+async def test_new_block_clears_cache(client, bitcoind, proxy):
+    await gettxout(client, [TXID, 0, False])
+    bitcoind.mine()
+    await gettxout(client, [TXID, 2, False])
+
+    _, reply = await gettxout(client, [TXID, 0, False])
+
+    assert reply["result"]["bestblock"] == bitcoind.hash_of(101)
+    assert len(bitcoind.calls_of("gettxout")) == 3
+    assert proxy.txOutCache.tipHash == bitcoind.hash_of(101)
+
+
+@pytest.mark.asyncio
+async def test_errors_are_returned_and_not_cached(client, proxy):
+    proxy.conf["net"]["dest_port"] = unused_port()
+
+    status, reply = await gettxout(client, [TXID, 0])
+
+    assert status == 500 and reply["error"]["code"] == -32603
+    assert proxy.txOutCache.entries == {}
+
+
+def test_outpoint_key():
+    assert outpoint_key([TXID, 1]) == (TXID, 1, True)
+    assert outpoint_key([TXID, 1, False]) == (TXID, 1, False)
+    assert outpoint_key([TXID, "1"]) is None
+    assert outpoint_key({"txid": TXID, "n": 1}) is None
@@ -0,0 +1,78 @@
+import asyncio
+import json
+import os
+import pytest
+from bitcoinproxy.metrics import MetricsRegistry
+from bitcoinproxy.workers import WorkerCoordinator
+
+BLOCKHASH = "b" * 64
+
+
+def test_download_is_claimed_by_one_worker(tmp_path):
+    first = WorkerCoordinator(str(tmp_path), 0)
+    second = WorkerCoordinator(str(tmp_path), 1)
+
+    assert first.claim_download(BLOCKHASH, 20)
+    assert not second.claim_download(BLOCKHASH, 20)
+    # the owner may request it again, e.g. from another peer
+    assert first.claim_download(BLOCKHASH, 20)
+    # an expired claim can be taken over
+    assert second.claim_download(BLOCKHASH, 0)
+
+
+def test_claims_are_removed_when_done_or_expired(tmp_path):
+    coordinator = WorkerCoordinator(str(tmp_path), 0)
+    other = WorkerCoordinator(str(tmp_path), 1)
+    downloaded, stale = "c" * 64, "d" * 64
+    assert coordinator.claim_download(downloaded, 20)
+    assert other.claim_download(stale, 20)
+
+    coordinator.release_download(downloaded)
+    assert coordinator.remove_expired_claims(20) == 0
+    assert coordinator.remove_expired_claims(0) == 1
+
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_metrics_of_workers_are_combined(tmp_path):
+    registries = []
+    for workerId, (latency, healthy) in enumerate([(0.05, 1), (0.5, 0)]):
+        registry = MetricsRegistry()
+        registry.counter("misses_total", "Misses.").inc()
+        registry.histogram("latency_seconds", "Latency.", (), (0.1, 1)).observe(latency)
+        registry.gauge("healthy", "Healthy.", lambda h=healthy: h, aggregate="min")
+        WorkerCoordinator(str(tmp_path), workerId).write_metrics(registry.snapshot())
+        registries.append(registry)
+
+    snapshots = WorkerCoordinator(str(tmp_path), 0).read_metrics()
+    lines = registries[0].render(snapshots).splitlines()
+
+    assert "misses_total 2" in lines
+    assert 'latency_seconds_bucket{le="0.1"} 1' in lines
+    assert 'latency_seconds_bucket{le="1"} 2' in lines
+    assert "latency_seconds_count 2" in lines
+    assert "healthy 0" in lines
+
+
+@pytest.mark.asyncio
+async def test_block_requested_by_other_worker_is_awaited(
+    client, bitcoind, proxy, tmp_path
+):
+    bitcoind.blocks[BLOCKHASH] = "00ff"
+    bitcoind.pruned.add(BLOCKHASH)
+    proxy.conf["app"].update({"wait_for_download": "2", "wait_mode": "poll"})
+    proxy.conf["blockstore"] = {"blockstore_dir": str(tmp_path / "blocks")}
+    proxy.coordinator = WorkerCoordinator(str(tmp_path), 0)
+    assert WorkerCoordinator(str(tmp_path), 1).claim_download(BLOCKHASH, 20)
+    # the other worker's download arrives
+    asyncio.get_running_loop().call_later(0.3, bitcoind.pruned.discard, BLOCKHASH)
+
+    response = await client.post(
+        "/", json={"method": "getblock", "params": [BLOCKHASH, 0]}
+    )
+
+    assert json.loads(await response.text())["result"] == "00ff"
+    assert bitcoind.calls_of("getblockfrompeer") == []
+    assert not (tmp_path / f"{BLOCKHASH}.download").exists()
+    # the block is stored by the worker that downloaded it
+    assert os.listdir(tmp_path / "blocks") == []